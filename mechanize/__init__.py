@@ -1,48 +1,108 @@
 from __future__ import absolute_import
 
 import logging
+import sys
 
 from ._clientcookie import request_host_lc as request_host
 # cookies
 from ._clientcookie import (Cookie, CookieJar, CookiePolicy,
                             DefaultCookiePolicy, FileCookieJar, LoadError,
-                            LWPCookieJar, MozillaCookieJar,
+                            LWPCookieJar, MozillaCookieJar, SQLiteCookieJar,
                             effective_request_host, lwp_cookie_str)
-# forms
-from ._form_controls import (
-    AmbiguityError, CheckboxControl, Control, ControlNotFoundError,
-    FileControl, HiddenControl, HTMLForm, IgnoreControl, ImageControl, Item,
-    ItemCountError, ItemNotFoundError, Label, ListControl, LocateError,
-    Missing, PasswordControl, RadioControl, ScalarControl, SelectControl,
-    SubmitButtonControl, SubmitControl, TextareaControl, TextControl)
-from ._html import Factory, Link
-# misc
-from ._entities import html5_entities
 from ._equiv import HTTPEquivParser
-# high-level stateful browser-style interface
-from ._mechanize import (Browser, BrowserStateError, FormNotFoundError,
-                         History, LinkNotFoundError)
-from ._opener import ContentTooShortError, OpenerFactory, urlretrieve
+from ._opener import (ContentTooShortError, HandlerTimings, OpenerFactory,
+                      urlretrieve)
 from ._response import (make_response, response_seek_wrapper,
                         seek_wrapped_response)
 from ._rfc3986 import urljoin
 from ._urllib2 import (
     AbstractBasicAuthHandler, AbstractDigestAuthHandler, BaseHandler,
-    CacheFTPHandler, FileHandler, FTPHandler, HTTPBasicAuthHandler,
+    CacheFTPHandler, ConnectionPool, FileHandler, FTPHandler, HTTPBasicAuthHandler,
     HTTPCookieProcessor, HTTPDefaultErrorHandler, HTTPDigestAuthHandler,
     HTTPEquivProcessor, HTTPError, HTTPErrorProcessor, HTTPHandler,
-    HTTPPasswordMgr, HTTPPasswordMgrWithDefaultRealm, HTTPProxyPasswordMgr,
+    HTTPPasswordMgr, HTTPPasswordMgrWithDefaultRealm,
+    HTTPPasswordMgrWithPriorAuth, HTTPProxyPasswordMgr,
     HTTPRedirectDebugProcessor, HTTPRedirectHandler, HTTPRefererProcessor,
     HTTPRefreshProcessor, HTTPResponseDebugProcessor, HTTPRobotRulesProcessor,
     HTTPSClientCertMgr, HTTPSHandler, OpenerDirector, ProxyBasicAuthHandler,
-    ProxyDigestAuthHandler, ProxyHandler, Request, RobotExclusionError,
-    SeekableResponseOpener, UnknownHandler, URLError, build_opener,
-    install_opener, urlopen)
+    ProxyDigestAuthHandler, ProxyHandler, RedirectCache, Request,
+    RobotExclusionError, RobotRulesCache, SeekableResponseOpener,
+    UnknownHandler, URLError, build_opener, install_opener, urlopen)
 # configurable URL-opener interface
 from ._useragent import UserAgent, UserAgentBase
 from ._util import http2time as str2time
 from ._version import __version__
-from ._gzip import HTTPGzipProcessor
+from ._gzip import HTTPGzipProcessor, HTTPRequestGzipProcessor
+from ._cache import DiskCache, HTTPCacheProcessor, MemoryCache
+
+# The forms machinery, the HTML parsing front end, Browser and the HTML
+# entity table are only imported when first used, so that code which just
+# needs urlopen() or UserAgent does not pay for them at import time.
+_lazy_imports = {
+    # forms
+    'AmbiguityError': '_form_controls',
+    'CheckboxControl': '_form_controls',
+    'Control': '_form_controls',
+    'ControlNotFoundError': '_form_controls',
+    'FileControl': '_form_controls',
+    'HiddenControl': '_form_controls',
+    'HTMLForm': '_form_controls',
+    'IgnoreControl': '_form_controls',
+    'ImageControl': '_form_controls',
+    'Item': '_form_controls',
+    'ItemCountError': '_form_controls',
+    'ItemNotFoundError': '_form_controls',
+    'Label': '_form_controls',
+    'ListControl': '_form_controls',
+    'LocateError': '_form_controls',
+    'Missing': '_form_controls',
+    'PasswordControl': '_form_controls',
+    'RadioControl': '_form_controls',
+    'ScalarControl': '_form_controls',
+    'SelectControl': '_form_controls',
+    'SubmitButtonControl': '_form_controls',
+    'SubmitControl': '_form_controls',
+    'TextareaControl': '_form_controls',
+    'TextControl': '_form_controls',
+    'Factory': '_html',
+    'Link': '_html',
+    'ParseCache': '_html',
+    # misc
+    'html5_entities': '_entities',
+    # high-level stateful browser-style interface
+    'Browser': '_mechanize',
+    'BrowserStateError': '_mechanize',
+    'FormNotFoundError': '_mechanize',
+    'History': '_mechanize',
+    'LinkNotFoundError': '_mechanize',
+}
+
+
+def __getattr__(name):
+    try:
+        module = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + module, __package__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
+
+
+if sys.version_info[:2] < (3, 7):
+    # no module __getattr__ (PEP 562) before Python 3.7
+    for _name in _lazy_imports:
+        __getattr__(_name)
+    del _name
+else:
+    # asyncio interface
+    _lazy_imports['AsyncBrowser'] = '_async'
+    _lazy_imports['AsyncOpenerDirector'] = '_async'
 
 # If you hate the idea of turning bugs into warnings, do:
 # import mechanize; mechanize.USE_BARE_EXCEPT = False
@@ -59,18 +119,22 @@ __all__ = [
     'Browser',
     'BrowserStateError',
     'CacheFTPHandler',
+    'ConnectionPool',
     'ContentTooShortError',
     'Cookie',
     'CookieJar',
     'CookiePolicy',
     'DefaultCookiePolicy',
+    'DiskCache',
     'effective_request_host',
     'FTPHandler',
     'Factory',
     'FileCookieJar',
     'FileHandler',
     'FormNotFoundError',
+    'HandlerTimings',
     'HTTPBasicAuthHandler',
+    'HTTPCacheProcessor',
     'HTTPCookieProcessor',
     'HTTPDefaultErrorHandler',
     'HTTPDigestAuthHandler',
@@ -82,11 +146,13 @@ __all__ = [
     'HTTPSHandler',
     'HTTPPasswordMgr',
     'HTTPPasswordMgrWithDefaultRealm',
+    'HTTPPasswordMgrWithPriorAuth',
     'HTTPProxyPasswordMgr',
     'HTTPRedirectDebugProcessor',
     'HTTPRedirectHandler',
     'HTTPRefererProcessor',
     'HTTPRefreshProcessor',
+    'HTTPRequestGzipProcessor',
     'HTTPResponseDebugProcessor',
     'HTTPRobotRulesProcessor',
     'HTTPSClientCertMgr',
@@ -95,14 +161,19 @@ __all__ = [
     'Link',
     'LinkNotFoundError',
     'LoadError',
+    'MemoryCache',
     'MozillaCookieJar',
     'OpenerDirector',
     'OpenerFactory',
+    'ParseCache',
     'ProxyBasicAuthHandler',
     'ProxyDigestAuthHandler',
     'ProxyHandler',
+    'RedirectCache',
     'Request',
     'RobotExclusionError',
+    'RobotRulesCache',
+    'SQLiteCookieJar',
     'SeekableResponseOpener',
     'URLError',
     'USE_BARE_EXCEPT',
@@ -153,3 +224,6 @@ __all__ = [
     'TextControl',
     'TextareaControl',
 ]
+
+if sys.version_info[:2] >= (3, 7):
+    __all__ += ['AsyncBrowser', 'AsyncOpenerDirector']
@@ -0,0 +1,512 @@
+"""asyncio versions of OpenerDirector and Browser.
+
+Requires Python 3.7 or later.
+
+HTTP and HTTPS requests are sent over asyncio streams (see
+asyncio.open_connection()), so no thread is tied up while waiting for the
+network, and many sessions can be driven at once from one event loop.
+Requests and responses go through the usual handlers, so cookies, redirects,
+robots.txt, authentication, gzip, HTTP-EQUIV, Refresh and the rest behave as
+they do for the blocking classes.
+
+The body of each response is read before the coroutine that opens it
+returns, so reading the response does not block.  Bodies are kept in memory,
+or in a temporary file past the spool threshold (see
+UserAgentBase.set_spool_threshold()).
+
+Limitations:
+
+ - every request is made on a new connection, closed after the response, so
+   set_connection_pool() has no effect
+ - ftp: URLs are opened by the blocking FTPHandler, which blocks the event
+   loop, and file: URLs are read synchronously from disk
+ - HTTPS through a proxy needs Python 3.11 or later
+ - retrieve() does not support resume or connections
+
+"""
+
+import asyncio
+import os
+import socket
+import tempfile
+from http.client import (BadStatusLine, InvalidURL, RemoteDisconnected,
+                         parse_headers)
+from io import BytesIO
+
+from . import _opener, _rfc3986
+from ._form_controls import MultipartBody
+from ._gzip import GzipBody
+from ._http import (HTTPRefreshProcessor, HTTPRobotRulesProcessor,
+                    MechanizeRobotFileParser)
+from ._mechanize import Browser
+from ._response import closeable_response, seek_wrapper
+from ._sockettimeout import _GLOBAL_DEFAULT_TIMEOUT
+from ._urllib2_fork import HTTPHandler, HTTPSHandler
+from .polyglot import HTTPError, URLError, perf_counter
+
+# the HTTP handler methods that are replaced by ._http_open()
+HTTP_OPEN_METHODS = (HTTPHandler.http_open, HTTPSHandler.https_open)
+
+
+def split_host_port(host_port, default_port):
+    """Return (host, port) given an authority "host[:port]", as
+    http.client.HTTPConnection does.
+
+    >>> split_host_port("example.com", 80)
+    ('example.com', 80)
+    >>> split_host_port("[::1]:8080", 80)
+    ('::1', 8080)
+
+    """
+    host, port = host_port, default_port
+    ii = host.rfind(":")
+    jj = host.rfind("]")  # IPv6 addresses have [...]
+    if ii > jj:
+        try:
+            port = int(host[ii + 1:]) if host[ii + 1:] else default_port
+        except ValueError:
+            raise InvalidURL("nonnumeric port: '%s'" % host[ii + 1:])
+        host = host[:ii]
+    if host and host[0] == "[" and host[-1] == "]":
+        host = host[1:-1]
+    return host, port
+
+
+async def wait(awaitable, timeout):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout("timed out")
+
+
+class AsyncOpenerMixin(object):
+    # The parts of AsyncOpenerDirector that AsyncBrowser shares.  The handler
+    # methods stay synchronous: the handlers that open another request (for
+    # a redirect, say) return the coroutine of self.open(), which is then
+    # awaited here.
+
+    BLOCK_SIZE = _opener.OpenerDirector.BLOCK_SIZE
+    # seconds to wait before the next request, for a Refresh
+    _pending_sleep = 0
+
+    def _maybe_reindex_handlers(self):
+        if self._handler_index_valid:
+            return
+        super(AsyncOpenerMixin, self)._maybe_reindex_handlers()
+        for handler in self.handlers:
+            if isinstance(handler, HTTPRefreshProcessor):
+                handler._sleep = self._sleep_later
+
+    def _sleep_later(self, seconds):
+        self._pending_sleep += seconds
+
+    def _call(self, handler, meth_name, meth, *args):
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            return meth(*args)
+        return _opener.timed_call(instrumentation, handler, meth_name, meth,
+                                  *args)
+
+    async def _settle(self, result):
+        # Return result, once it is a response rather than the coroutine of a
+        # nested .open().  Nothing else runs between a handler returning and
+        # this, so the pause belongs to that handler.
+        pause, self._pending_sleep = self._pending_sleep, 0
+        if pause:
+            await asyncio.sleep(pause)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def open(self, fullurl, data=None, timeout=_GLOBAL_DEFAULT_TIMEOUT):
+        req = self._request(fullurl, data, None, timeout)
+        req_scheme = req.get_type()
+
+        self._maybe_reindex_handlers()
+        await self._read_robots(req)
+
+        for processor, meth_name, meth in self._processor_chain(
+                req_scheme, "request"):
+            req = self._call(processor, meth_name, meth, req)
+
+        response = await self._open_request(req)
+
+        for processor, meth_name, meth in self._processor_chain(
+                req_scheme, "response"):
+            response = await self._settle(
+                self._call(processor, meth_name, meth, req, response))
+
+        return response
+
+    async def _read_robots(self, req):
+        # Fetch robots.txt for HTTPRobotRulesProcessor if it is not cached,
+        # so that the processor does not fetch it synchronously.
+        for processor in self.process_request.get(req.get_type(), ()):
+            if not isinstance(processor, HTTPRobotRulesProcessor):
+                continue
+            key = processor._cache_key(req)
+            if key is None or processor.cache.get(key) is not None:
+                continue
+            rfp = processor._parser(key, req.timeout)
+            if not isinstance(rfp, MechanizeRobotFileParser):
+                # left to the processor
+                continue
+            try:
+                f = await self.open(rfp._request())
+            except HTTPError as err:
+                f = err
+            except (IOError, socket.error, OSError) as exc:
+                rfp._read_failed(exc)
+                f = None
+            if f is not None:
+                rfp._read_response(f)
+            processor.cache.put(key, rfp)
+
+    async def _open_request(self, req):
+        # as OpenerDirector._open()
+        result = await self._call_open_chain('default', 'default_open', req)
+        if result:
+            return result
+
+        protocol = req.get_type()
+        result = await self._call_open_chain(protocol, protocol + '_open',
+                                             req)
+        if result:
+            return result
+
+        return await self._call_open_chain('unknown', 'unknown_open', req)
+
+    async def _call_open_chain(self, kind, meth_name, req):
+        for handler in self.handle_open.get(kind, ()):
+            meth = getattr(handler, meth_name)
+            if getattr(meth, "__func__", None) in HTTP_OPEN_METHODS:
+                result = await self._http_open(handler, req)
+            else:
+                result = await self._settle(
+                    self._call(handler, meth_name, meth, req))
+            if result is not None:
+                return result
+
+    def _body_file(self):
+        threshold = getattr(self, "_spool_threshold", None)
+        if threshold is None:
+            threshold = seek_wrapper.spool_threshold
+        if threshold is None:
+            return BytesIO()
+        return tempfile.SpooledTemporaryFile(max_size=threshold)
+
+    async def _http_open(self, handler, req):
+        # AbstractHTTPHandler.do_open(), over asyncio streams
+        host_port = req.get_host()
+        if not host_port:
+            raise URLError('no host given')
+        https = isinstance(handler, HTTPSHandler)
+        host, port = split_host_port(host_port, 443 if https else 80)
+        headers, tunnel_headers = handler._request_headers(req, True)
+        context = None
+        if https:
+            context = handler._context(*handler._key_cert(req))
+        timeout = req.timeout
+        if timeout is _GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+
+        if req._tunnel_host and not hasattr(asyncio.StreamWriter,
+                                            "start_tls"):
+            raise URLError("HTTPS through a proxy needs Python 3.11 or later")
+
+        instrumentation = self._instrumentation
+        writer = None
+        try:
+            start = perf_counter()
+            if req._tunnel_host:
+                reader, writer = await wait(
+                    asyncio.open_connection(host, port), timeout)
+                await self._tunnel(reader, writer, req._tunnel_host,
+                                   tunnel_headers, timeout)
+                tunnel_host = split_host_port(req._tunnel_host, 443)[0]
+                await wait(writer.start_tls(
+                    context, server_hostname=tunnel_host), timeout)
+            else:
+                reader, writer = await wait(asyncio.open_connection(
+                    host, port, ssl=context), timeout)
+            if instrumentation is not None:
+                instrumentation.record(
+                    "network.connect", perf_counter() - start)
+                start = perf_counter()
+            await self._send_request(writer, req, headers, timeout)
+            if instrumentation is not None:
+                instrumentation.record("network.send", perf_counter() - start)
+                start = perf_counter()
+            version, status, reason, msg = await self._read_head(
+                reader, timeout)
+            if instrumentation is not None:
+                instrumentation.record("network.wait", perf_counter() - start)
+            body = self._body_file()
+            await self._read_body(reader, body, req, status, msg, timeout)
+        except (socket.error, OSError) as err:
+            raise URLError(err)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        body.seek(0)
+        return closeable_response(
+            body, msg, req.get_full_url(), status, reason, version)
+
+    async def _tunnel(self, reader, writer, tunnel_host, tunnel_headers,
+                      timeout):
+        lines = ["CONNECT %s HTTP/1.0" % tunnel_host]
+        lines.extend("%s: %s" % item for item in tunnel_headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await wait(writer.drain(), timeout)
+        version, status, reason, msg = await self._read_head(reader, timeout)
+        if status != 200:
+            raise OSError(
+                "Tunnel connection failed: %d %s" % (status, reason.strip()))
+
+    async def _send_request(self, writer, req, headers, timeout):
+        # as http.client.HTTPConnection.request() sends it
+        data = req.data
+        method = str(req.get_method())
+        if "Host" not in headers:
+            headers["Host"] = req.get_host()
+        if "Accept-Encoding" not in headers:
+            headers["Accept-Encoding"] = "identity"
+        chunked = False
+        if hasattr(data, "read"):
+            if isinstance(data, (MultipartBody, GzipBody)):
+                # may already have been sent, e.g. before an authentication
+                # retry
+                data.seek(0)
+            if "Content-Length" not in headers:
+                headers["Transfer-Encoding"] = "chunked"
+                chunked = True
+        elif data is not None:
+            if isinstance(data, str):
+                data = data.encode("iso-8859-1")
+            if "Content-Length" not in headers:
+                headers["Content-Length"] = str(len(data))
+        elif (method in ("POST", "PUT", "PATCH") and
+              "Content-Length" not in headers):
+            headers["Content-Length"] = "0"
+
+        head = ["%s %s HTTP/1.1" % (method, req.get_selector())]
+        head.extend("%s: %s" % item for item in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if hasattr(data, "read"):
+            while True:
+                block = data.read(self.BLOCK_SIZE)
+                if isinstance(block, str):
+                    block = block.encode("iso-8859-1")
+                if chunked:
+                    writer.write(b"%X\r\n%s\r\n" % (len(block), block))
+                elif block:
+                    writer.write(block)
+                await wait(writer.drain(), timeout)
+                if not block:
+                    break
+        elif data:
+            writer.write(data)
+        await wait(writer.drain(), timeout)
+
+    async def _read_head(self, reader, timeout):
+        # Return (version, status, reason, headers) of a response, skipping
+        # any 100 Continue responses.
+        while True:
+            line = await wait(reader.readline(), timeout)
+            if not line:
+                raise RemoteDisconnected(
+                    "Remote end closed connection without response")
+            words = line.decode("iso-8859-1").split(None, 2)
+            if len(words) == 2:
+                words.append("")
+            try:
+                version, status, reason = words
+                if not version.startswith("HTTP/"):
+                    raise ValueError(version)
+                status = int(status)
+            except ValueError:
+                raise BadStatusLine(line)
+            lines = []
+            while True:
+                line = await wait(reader.readline(), timeout)
+                lines.append(line)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            if status != 100:
+                break
+        version = 10 if version == "HTTP/1.0" else 11
+        return (version, status, reason.strip(),
+                parse_headers(BytesIO(b"".join(lines))))
+
+    async def _read_body(self, reader, body, req, status, msg, timeout):
+        # Copy the response body to file body.  A body cut short is kept:
+        # retrieve() checks its length, as it does for blocking responses.
+        if (req.get_method() == "HEAD" or status in (204, 304) or
+                100 <= status < 200):
+            return
+        if "chunked" in msg.get("transfer-encoding", "").lower():
+            while True:
+                line = await wait(reader.readline(), timeout)
+                try:
+                    size = int(line.split(b";", 1)[0], 16)
+                except ValueError:
+                    return
+                if not size:
+                    # skip the trailer
+                    while line not in (b"\r\n", b"\n", b""):
+                        line = await wait(reader.readline(), timeout)
+                    return
+                if await self._copy(reader, body, size, timeout) < size:
+                    return
+                await wait(reader.readline(), timeout)
+        length = msg.get("content-length")
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            length = -1
+        await self._copy(reader, body, length, timeout)
+
+    async def _copy(self, reader, body, size, timeout):
+        # copy size bytes (or up to EOF, if size is negative) from reader to
+        # body, returning the number copied
+        copied = 0
+        while size < 0 or copied < size:
+            nr_wanted = self.BLOCK_SIZE
+            if size >= 0:
+                nr_wanted = min(nr_wanted, size - copied)
+            block = await wait(reader.read(nr_wanted), timeout)
+            if not block:
+                break
+            body.write(block)
+            copied += len(block)
+        return copied
+
+    async def retrieve(self, fullurl, filename=None, reporthook=None,
+                       data=None, timeout=_GLOBAL_DEFAULT_TIMEOUT,
+                       open=_opener.open_file):
+        """Returns (filename, headers).
+
+        See OpenerDirector.retrieve(), except that resume and connections
+        are not supported.
+        """
+        req = self._request(fullurl, data, False, timeout)
+        scheme = req.get_type()
+        fp = await self.open(req)
+        try:
+            headers = fp.info()
+            if filename is None and scheme == 'file':
+                return None, headers
+            if filename:
+                tfp = open(filename, 'wb')
+            else:
+                path = _rfc3986.urlsplit(req.get_full_url())[2]
+                suffix = os.path.splitext(path)[1]
+                fd, filename = tempfile.mkstemp(suffix)
+                self._tempfiles.append(filename)
+                tfp = os.fdopen(fd, 'wb')
+            try:
+                result = filename, headers
+                bs = self.BLOCK_SIZE
+                size = -1
+                if "content-length" in headers:
+                    size = int(headers["content-length"])
+                if reporthook:
+                    reporthook(0, bs, size)
+                read = self._copy_body(fp, tfp, bs, 0, size, reporthook)
+            finally:
+                tfp.close()
+        finally:
+            fp.close()
+
+        # raise exception if actual size does not match content-length header
+        if size >= 0 and read < size:
+            raise _opener.ContentTooShortError(
+                "retrieval incomplete: "
+                "got only %i out of %i bytes" % (read, size),
+                result
+            )
+        return result
+
+
+class AsyncOpenerDirector(AsyncOpenerMixin, _opener.OpenerDirector):
+    """An OpenerDirector whose :meth:`open` and :meth:`retrieve` are
+    coroutines.
+
+    Build one with the usual handlers like so:
+
+    .. code-block:: python
+
+        opener = mechanize.OpenerFactory(
+            mechanize.AsyncOpenerDirector).build_opener()
+        response = await opener.open("http://example.com/")
+
+    Any number of requests may be in progress at once on one opener.
+
+    """
+
+
+class AsyncBrowser(AsyncOpenerMixin, Browser):
+    """A :class:`mechanize.Browser` whose methods that open URLs are
+    coroutines.
+
+    .. code-block:: python
+
+        async def login(url):
+            br = mechanize.AsyncBrowser()
+            await br.open(url)
+            br.select_form(nr=0)
+            br["user"] = "joe"
+            return await br.submit()
+
+    These are :meth:`open`, :meth:`open_novisit`, :meth:`follow_link`,
+    :meth:`submit`, :meth:`reload`, :meth:`back`, :meth:`open_local_file`
+    and :meth:`retrieve`.  Only one of them may be in progress at once on one
+    browser, since they change its state; use one browser (or a copy of one)
+    per session, and :func:`asyncio.gather` rather than :meth:`fetch_many`.
+
+    """
+
+    async def open(self, url_or_request, data=None,
+                   timeout=_GLOBAL_DEFAULT_TIMEOUT):
+        return await self._mech_open(url_or_request, data, timeout=timeout)
+
+    async def open_novisit(self, url_or_request, data=None,
+                           timeout=_GLOBAL_DEFAULT_TIMEOUT):
+        return await self._mech_open(
+            url_or_request, data, visit=False, timeout=timeout)
+
+    async def _mech_open(self, url, data=None, update_history=True,
+                         visit=None, timeout=_GLOBAL_DEFAULT_TIMEOUT):
+        request, visit = self._mech_request(
+            url, data, update_history, visit, timeout)
+
+        success = True
+        try:
+            response = await AsyncOpenerMixin.open(self, request, data)
+        except HTTPError as error:
+            success = False
+            if error.fp is None:  # not a response
+                raise
+            response = error
+
+        return self._mech_response(response, visit, success)
+
+    async def open_local_file(self, filename):
+        return await Browser.open_local_file(self, filename)
+
+    async def reload(self):
+        return await Browser.reload(self)
+
+    async def back(self, n=1):
+        response = Browser.back(self, n)
+        if asyncio.iscoroutine(response):
+            # the page was not kept in the history: reloaded
+            response = await response
+        return response
+
+    async def submit(self, *args, **kwds):
+        return await Browser.submit(self, *args, **kwds)
+
+    async def follow_link(self, link=None, **kwds):
+        return await Browser.follow_link(self, link, **kwds)
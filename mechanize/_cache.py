@@ -0,0 +1,581 @@
+"""HTTP caching (RFC 7234) for the urllib2-level interface.
+
+HTTPCacheProcessor keeps responses to GET requests in a cache object and,
+while they are fresh, answers requests for them without touching the network.
+Stale responses that carry a validator (ETag or Last-Modified) are revalidated
+with a conditional request, and a 304 Not Modified reply is turned back into
+the full cached response.
+
+The cache behaves as a private (browser) cache.  Bodies are stored as
+received, so content-encodings are still decoded by HTTPGzipProcessor on the
+way out.
+
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from ._headersutil import split_header_words
+from ._http import max_age_from_headers
+from ._response import closeable_response, make_headers
+from ._urllib2_fork import BaseHandler
+from ._util import http2time
+
+# responses that may be cached without explicit freshness information
+HEURISTICALLY_CACHEABLE = frozenset((200, 203))
+# maximum heuristic freshness lifetime (RFC 7234 section 4.2.2)
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+# headers that describe the connection, or the client, rather than the
+# stored response
+UNSTORED_HEADERS = frozenset((
+    "connection", "keep-alive", "proxy-connection", "te", "trailer",
+    "transfer-encoding", "upgrade", "set-cookie", "set-cookie2"))
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "TRACE"))
+# atomic on POSIX; Python 2 on Windows can't replace existing files
+_replace = getattr(os, "replace", os.rename)
+# names of the files DiskCache stores entries in
+_DISK_CACHE_FILE = re.compile(r"^[0-9a-f]{40}\.(?:json|body)$")
+
+
+def cache_directives(header_values):
+    """Return a dict mapping lowercased Cache-Control directives to their
+    values (None for directives without one).
+
+    >>> d = cache_directives(['max-age=60, No-Cache', 'private="set-cookie"'])
+    >>> sorted(d.items())
+    [('max-age', '60'), ('no-cache', None), ('private', 'set-cookie')]
+
+    """
+    ans = {}
+    for pairs in split_header_words(header_values):
+        for key, value in pairs:
+            ans.setdefault(key.lower(), value)
+    return ans
+
+
+def _header_values(pairs, name):
+    return [v for k, v in pairs if k.lower() == name]
+
+
+def _request_directives(request):
+    return cache_directives([request.get_header("Cache-control", "")])
+
+
+def _last_date(pairs, name):
+    values = _header_values(pairs, name)
+    if values:
+        return http2time(values[-1])
+    return None
+
+
+class CacheEntry(object):
+    """A stored response, together with what is needed to judge its age."""
+
+    def __init__(self, url, code, msg, headers, body, vary, request_time,
+                 response_time):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        # sequence of (name, value) pairs, as received
+        self.headers = headers
+        self.body = body
+        # (name, value) pairs of the request headers named by Vary
+        self.vary = vary
+        self.request_time = request_time
+        self.response_time = response_time
+
+    def directives(self):
+        return cache_directives(_header_values(self.headers, "cache-control"))
+
+    def validators(self):
+        """Return the ETag and Last-Modified header values (either may be
+        None)."""
+        etag = _header_values(self.headers, "etag")
+        last_modified = _header_values(self.headers, "last-modified")
+        return (etag[-1] if etag else None,
+                last_modified[-1] if last_modified else None)
+
+    def freshness_lifetime(self):
+        """Return the number of seconds the entry is fresh for after it was
+        generated (RFC 7234 section 4.2.1)."""
+        headers = make_headers(self.headers)
+        lifetime = max_age_from_headers(headers, self.response_time)
+        if lifetime is not None:
+            return lifetime
+        if self.code not in HEURISTICALLY_CACHEABLE:
+            return 0
+        last_modified = _last_date(self.headers, "last-modified")
+        if last_modified is None:
+            return 0
+        date = _last_date(self.headers, "date")
+        if date is None:
+            date = self.response_time
+        return min(max(date - last_modified, 0) // 10,
+                   MAX_HEURISTIC_LIFETIME)
+
+    def current_age(self, now=None):
+        """Return the age of the entry in seconds (RFC 7234 section 4.2.3)."""
+        if now is None:
+            now = time.time()
+        try:
+            age_value = int(_header_values(self.headers, "age")[-1])
+        except (IndexError, ValueError):
+            age_value = 0
+        date = _last_date(self.headers, "date")
+        if date is None:
+            date = self.response_time
+        apparent_age = max(0, self.response_time - date)
+        response_delay = self.response_time - self.request_time
+        corrected_age_value = age_value + response_delay
+        corrected_initial_age = max(apparent_age, corrected_age_value)
+        return corrected_initial_age + max(0, now - self.response_time)
+
+    def matches(self, request):
+        for name, value in self.vary:
+            if request.get_header(name) != value:
+                return False
+        return True
+
+    def to_response(self, now=None):
+        pairs = [(k, v) for k, v in self.headers if k.lower() != "age"]
+        pairs.append(("Age", str(int(self.current_age(now)))))
+        return closeable_response(
+            BytesIO(self.body), make_headers(pairs), self.url, self.code,
+            self.msg)
+
+
+class MemoryCache(object):
+    """Least-recently-used in-memory cache of HTTP responses.
+
+    Holds at most max_entries responses, and at most max_size bytes of
+    response bodies.  One instance may be shared between several
+    HTTPCacheProcessor instances (e.g. those of copied Browsers): it is
+    thread-safe.
+    """
+
+    def __init__(self, max_entries=1000, max_size=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        with self._lock:
+            try:
+                entry = self._entries.pop(key)
+            except KeyError:
+                return None
+            # re-insert as most recently used
+            self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self._size > self.max_size):
+                key, old = self._entries.popitem(last=False)
+                self._size -= len(old.body)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class DiskCache(object):
+    """Cache of HTTP responses stored as files in a directory.
+
+    Each response is stored as two files named after a hash of its URL: the
+    body as received, and a JSON file holding the status, headers and
+    timestamps.  Files are replaced atomically, and an entry whose body file
+    does not match its JSON file is ignored, so several processes may share
+    the directory.
+
+    Holds at most max_size bytes of response bodies: the least recently used
+    entries are removed to make room for new ones.  The sizes of the entries
+    are read from the directory once, then kept up to date in memory; the
+    directory is only read again when it seems to be full, since other
+    processes may have changed it.
+    """
+
+    # when full, entries are removed until this fraction of max_size is used,
+    # so that the directory is not read again on every .set()
+    low_water_mark = 0.9
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._scan()
+
+    def _path(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode("utf-8")
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest())
+
+    def _scan(self):
+        # load entry name --> body size, least recently used first
+        entries = []
+        for name in os.listdir(self.directory):
+            if not _DISK_CACHE_FILE.match(name) or not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name[:-len(".json")])
+            try:
+                used = os.stat(path + ".json").st_mtime
+                body_size = os.stat(path + ".body").st_size
+            except EnvironmentError:
+                continue
+            entries.append((used, path, body_size))
+        entries.sort()
+        self._sizes = OrderedDict(
+            (path, body_size) for used, path, body_size in entries)
+        self._size = sum(self._sizes.values())
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            _replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except EnvironmentError:
+                pass
+            raise
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path + ".json", "rb") as f:
+                meta = json.loads(f.read().decode("utf-8"))
+            with open(path + ".body", "rb") as f:
+                body = f.read()
+            if (meta["url"] != key or
+                    hashlib.sha1(body).hexdigest() != meta["body_sha1"]):
+                # a concurrent .set() has replaced only one of the files
+                return None
+            entry = CacheEntry(
+                meta["url"], meta["code"], meta["msg"],
+                [tuple(pair) for pair in meta["headers"]], body,
+                [tuple(pair) for pair in meta["vary"]],
+                meta["request_time"], meta["response_time"])
+        except Exception:
+            # missing, or truncated or written by an incompatible version
+            return None
+        try:
+            # mark as most recently used
+            os.utime(path + ".json", None)
+        except EnvironmentError:
+            pass
+        with self._lock:
+            self._sizes.pop(path, None)
+            self._sizes[path] = len(body)
+        return entry
+
+    def set(self, key, entry):
+        if len(entry.body) > self.max_size:
+            # storing it would evict everything else, then itself
+            self.delete(key)
+            return
+        meta = {
+            "url": entry.url, "code": entry.code, "msg": entry.msg,
+            "headers": entry.headers, "vary": entry.vary,
+            "request_time": entry.request_time,
+            "response_time": entry.response_time,
+            "body_sha1": hashlib.sha1(entry.body).hexdigest(),
+        }
+        path = self._path(key)
+        self._write(path + ".body", entry.body)
+        self._write(path + ".json", json.dumps(meta).encode("utf-8"))
+        with self._lock:
+            self._size += len(entry.body) - self._sizes.pop(path, 0)
+            self._sizes[path] = len(entry.body)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # other processes may have added or removed entries
+        self._scan()
+        target = self.max_size * self.low_water_mark
+        while self._sizes and self._size > target:
+            path, body_size = self._sizes.popitem(last=False)
+            self._size -= body_size
+            self._remove(path)
+
+    def _remove(self, path):
+        for suffix in (".json", ".body"):
+            try:
+                os.remove(path + suffix)
+            except EnvironmentError:
+                pass
+
+    def delete(self, key):
+        path = self._path(key)
+        self._remove(path)
+        with self._lock:
+            self._size -= self._sizes.pop(path, 0)
+
+    def clear(self):
+        """Remove all entries (other files in the directory are kept)."""
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if _DISK_CACHE_FILE.match(name):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except EnvironmentError:
+                        pass
+            self._sizes.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.directory)
+                    if _DISK_CACHE_FILE.match(name) and
+                    name.endswith(".json")])
+
+
+class _CachingReader(object):
+    # Passes a response body through, and hands the complete body to
+    # on_complete once it has been read to the end.
+
+    def __init__(self, fp, on_complete, max_size):
+        self.fp = fp
+        self.on_complete = on_complete
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+        if hasattr(fp, "fileno"):
+            self.fileno = fp.fileno
+
+    def _seen(self, data, eof):
+        if self.chunks is None:
+            return data
+        if data:
+            self.size += len(data)
+            if self.size > self.max_size:
+                self.chunks = None
+                return data
+            self.chunks.append(data)
+        if eof:
+            body, self.chunks = b"".join(self.chunks), None
+            self.on_complete(body)
+        return data
+
+    def read(self, size=-1):
+        data = self.fp.read() if size is None or size < 0 else \
+            self.fp.read(size)
+        return self._seen(data, not data or size is None or size < 0)
+
+    def readline(self, size=-1):
+        data = self.fp.readline(size)
+        return self._seen(data, not data)
+
+    def readlines(self, sizehint=-1):
+        return list(iter(self.readline, b""))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
+    next = __next__
+
+    def close(self):
+        # a body that was not read to the end is not stored
+        self.chunks = None
+        self.fp.close()
+
+
+class HTTPCacheProcessor(BaseHandler):
+    """Cache responses to GET requests, following RFC 7234.
+
+    cache: object with .get(key), .set(key, entry) and .delete(key) methods,
+        such as MemoryCache (the default) or DiskCache
+    max_entry_size: larger responses are not stored
+
+    Responses are stored once their body has been read to the end.  Requests
+    with Cache-Control: no-cache (or Pragma: no-cache) are always revalidated,
+    and those with Cache-Control: no-store bypass the cache entirely.
+    Successful requests with unsafe methods (e.g. POST) invalidate the entry
+    for their URL.
+
+    """
+    # request processing after HTTPCookieProcessor, .http_open() before
+    # HTTPHandler, response processing before HTTPGzipProcessor (bodies are
+    # stored with their content-encoding) and HTTPErrorProcessor (which would
+    # turn a 304 into an exception)
+    handler_order = 150
+
+    def __init__(self, cache=None, max_entry_size=10 * 1024 * 1024):
+        if cache is None:
+            cache = MemoryCache()
+        self.cache = cache
+        self.max_entry_size = max_entry_size
+
+    def __copy__(self):
+        # copies share the cache
+        return self.__class__(self.cache, self.max_entry_size)
+
+    def _lookup(self, request, directives):
+        if "no-store" in directives:
+            return None
+        entry = self.cache.get(request.get_full_url())
+        if entry is None or not entry.matches(request):
+            return None
+        return entry
+
+    def http_open(self, request):
+        # Request headers are final only once all request processors have
+        # run, so the cache is consulted here rather than in .http_request().
+        request._cache_entry = None
+        request._cache_request_time = time.time()
+        if request.get_method() != "GET":
+            return None
+        directives = _request_directives(request)
+        entry = self._lookup(request, directives)
+        if entry is None:
+            return None
+
+        no_cache = "no-cache" in directives or "no-cache" in (
+            request.get_header("Pragma", "").lower())
+        now = time.time()
+        if not no_cache:
+            age = entry.current_age(now)
+            fresh = age < entry.freshness_lifetime()
+            if fresh and "max-age" in directives:
+                try:
+                    fresh = age <= int(directives["max-age"])
+                except (TypeError, ValueError):
+                    fresh = False
+            if fresh:
+                return entry.to_response(now)
+
+        # stale: revalidate if possible, unless the caller is doing their own
+        # conditional request
+        etag, last_modified = entry.validators()
+        if etag is None and last_modified is None:
+            return None
+        for name in ("If-none-match", "If-modified-since", "If-match",
+                     "If-unmodified-since", "If-range", "Range"):
+            if request.has_header(name):
+                return None
+        if etag is not None:
+            request.add_unredirected_header("If-None-Match", etag)
+        if last_modified is not None:
+            request.add_unredirected_header("If-Modified-Since", last_modified)
+        request._cache_entry = entry
+        return None
+
+    def _vary(self, request, pairs):
+        vary = []
+        for value in _header_values(pairs, "vary"):
+            for name in value.split(","):
+                name = name.strip()
+                if name == "*":
+                    return None
+                if name:
+                    vary.append((name, request.get_header(name)))
+        return vary
+
+    def http_response(self, request, response):
+        method = request.get_method()
+        code = response.code
+        if method not in SAFE_METHODS:
+            if code < 400:
+                self.cache.delete(request.get_full_url())
+            return response
+        if method != "GET":
+            return response
+
+        entry = getattr(request, "_cache_entry", None)
+        if entry is not None and code == 304:
+            return self._refreshed(request, response, entry)
+        if code not in HEURISTICALLY_CACHEABLE or not hasattr(
+                response, "_set_fp"):
+            return response
+
+        request_directives = _request_directives(request)
+        headers = response.info()
+        directives = cache_directives(headers.getheaders("cache-control"))
+        if "no-store" in directives or "no-store" in request_directives:
+            return response
+        if request.has_header("Authorization") and not (
+                "public" in directives or "must-revalidate" in directives):
+            return response
+        pairs = [(k, v) for k, v in headers.items()
+                 if k.lower() not in UNSTORED_HEADERS]
+        vary = self._vary(request, pairs)
+        if vary is None:
+            return response
+        entry = CacheEntry(
+            request.get_full_url(), code, response.msg, pairs, None, vary,
+            getattr(request, "_cache_request_time", time.time()),
+            time.time())
+        if (not entry.freshness_lifetime() and
+                entry.validators() == (None, None)):
+            # not worth storing: never fresh, and can't be revalidated
+            return response
+
+        def on_complete(body):
+            # response_time stays the time the headers arrived: the time
+            # taken to read the body is not part of the response's age
+            entry.body = body
+            self.cache.set(entry.url, entry)
+        response._set_fp(
+            _CachingReader(response.fp, on_complete, self.max_entry_size))
+        return response
+
+    def _refreshed(self, request, response, entry):
+        # RFC 7234 section 4.3.4: headers of the 304 replace the stored ones
+        response.read()
+        response.close()
+        update = [(k, v) for k, v in response.info().items()
+                  if k.lower() not in UNSTORED_HEADERS and
+                  k.lower() != "content-length"]
+        names = set(k.lower() for k, v in update)
+        pairs = [(k, v) for k, v in entry.headers if k.lower() not in names]
+        pairs.extend(update)
+        entry = CacheEntry(
+            entry.url, entry.code, entry.msg, pairs, entry.body, entry.vary,
+            getattr(request, "_cache_request_time", time.time()), time.time())
+        if "no-store" not in entry.directives():
+            self.cache.set(entry.url, entry)
+        else:
+            self.cache.delete(entry.url)
+        return entry.to_response()
+
+    https_open = http_open
+    https_response = http_response
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import json
 import re
 import time
 from .polyglot import (
@@ -49,11 +50,63 @@ class Cookie(_Cookie):
         return not (self == other)
 
 
+INF = float("inf")
+
+
+def _func(method):
+    return getattr(method, "__func__", method)
+
+
+_default_domain_return_ok = _func(DefaultCookiePolicy.domain_return_ok)
+
+
+def candidate_cookie_domains(request):
+    """Return the cookie domains that may be returned to request's host.
+
+    These are the only domains DefaultCookiePolicy.domain_return_ok() accepts:
+    those that, with a leading dot added if missing, are a suffix of the
+    request-host or effective request-host with a leading dot added.
+
+    >>> from mechanize import Request
+    >>> candidate_cookie_domains(Request("http://www.example.com/"))
+    ['.www.example.com', 'www.example.com', '.example.com', 'example.com', \
+'.com', 'com', '']
+    >>> candidate_cookie_domains(Request("http://intranet/"))
+    ['.intranet', 'intranet', '.intranet.local', 'intranet.local', '.local', \
+'local', '']
+    """
+    domains = []
+    seen = set()
+    for host in eff_request_host(request):
+        if not host.startswith("."):
+            host = "." + host
+        i = 0
+        while i != -1:
+            for domain in host[i:], host[i + 1:]:
+                if domain not in seen:
+                    seen.add(domain)
+                    domains.append(domain)
+            i = host.find(".", i + 1)
+    if "" not in seen:
+        domains.append("")
+    return domains
+
+
 class CookieJar(CJ):
 
+    # (self._cookies, {(request-host, effective request-host): [(domain,
+    # path, cookie), ...]}): candidate cookies for each host, longest path
+    # first, dropped whenever the jar changes
+    _request_cookies_cache = None
+    request_cookies_cache_size = 1000
+    # (self._cookies, earliest expiry time of any cookie in it)
+    _next_expiry = None
+
     def __getstate__(self):
         ans = self.__dict__.copy()
         del ans['_cookies_lock']
+        ans.pop('_request_cookies_cache', None)
+        ans.pop('_next_expiry', None)
         return ans
 
     def __setstate__(self, val):
@@ -80,6 +133,78 @@ class CookieJar(CJ):
             cookies.sort(key=key, reverse=True)
             return cookies
 
+    def _cookies_for_request(self, request):
+        # used by both cookies_for_request() and add_cookie_header()
+        if _func(type(self._policy).domain_return_ok) is \
+                _default_domain_return_ok:
+            return self._indexed_cookies_for_request(request)
+        return CJ._cookies_for_request(self, request)
+
+    def _indexed_cookies_for_request(self, request):
+        # Like CJ._cookies_for_request(), but only looks at the domains that
+        # can match the request host, rather than every domain in the jar.
+        jar = self._cookies
+        cache = self._request_cookies_cache
+        if cache is None or cache[0] is not jar:
+            cache = self._request_cookies_cache = (jar, {})
+        key = eff_request_host(request)
+        candidates = cache[1].get(key)
+        if candidates is None:
+            candidates = []
+            for domain in candidate_cookie_domains(request):
+                for path, cookies_by_name in iteritems(jar.get(domain, {})):
+                    for cookie in cookies_by_name.values():
+                        candidates.append((domain, path, cookie))
+            candidates.sort(key=lambda x: len(x[1]), reverse=True)
+            if len(cache[1]) >= self.request_cookies_cache_size:
+                cache[1].clear()
+            cache[1][key] = candidates
+
+        policy = self._policy
+        domain_ok = {}
+        path_ok = {}
+        cookies = []
+        for domain, path, cookie in candidates:
+            ok = domain_ok.get(domain)
+            if ok is None:
+                ok = domain_ok[domain] = policy.domain_return_ok(
+                    domain, request)
+            if not ok:
+                continue
+            ok = path_ok.get(path)
+            if ok is None:
+                ok = path_ok[path] = policy.path_return_ok(path, request)
+            if ok and policy.return_ok(cookie, request):
+                cookies.append(cookie)
+        return cookies
+
+    def clear_expired_cookies(self):
+        # add_cookie_header() calls this after every request: skip the sweep
+        # through the whole jar until the earliest expiry time has passed
+        with self._cookies_lock:
+            now = time.time()
+            next_expiry = self._next_expiry
+            if (next_expiry is not None and next_expiry[0] is self._cookies and
+                    now < next_expiry[1]):
+                return
+            CJ.clear_expired_cookies(self)
+            expiries = [c.expires for c in self if c.expires is not None]
+            self._next_expiry = (self._cookies, min(expiries or [INF]))
+
+    def set_cookie(self, cookie):
+        with self._cookies_lock:
+            CJ.set_cookie(self, cookie)
+            self._request_cookies_cache = None
+            next_expiry = self._next_expiry
+            if next_expiry is not None and cookie.expires is not None:
+                self._next_expiry = (
+                    next_expiry[0], min(next_expiry[1], cookie.expires))
+
+    def clear(self, domain=None, path=None, name=None):
+        with self._cookies_lock:
+            self._request_cookies_cache = None
+            CJ.clear(self, domain, path, name)
+
     def get_policy(self):
         return self._policy
 
@@ -188,6 +313,240 @@ class CookieJar(CJ):
         raise IndexError()
 
 
+class SQLiteCookieJar(CookieJar):
+    """CookieJar that keeps its cookies in an SQLite database.
+
+    Rather than rewriting a whole file as FileCookieJar.save() does, changes
+    are written to the database as they are made.  The cookies set by one
+    response are written in one transaction; changes made by calling
+    set_cookie() or clear() directly are written batch_size at a time, or
+    when commit() is called.  Cookies are read from the database a domain at
+    a time, the first time a request needs them.
+
+    Several processes may share one database.  Each notices when the others
+    have written to it, and then reads cookies from the database afresh.
+    Session cookies are stored as well, so they are shared too: call
+    clear_session_cookies() when a new session starts.
+
+    :param filename: path of the database, which is created if necessary
+    :param policy: as for CookieJar
+    :param timeout: seconds to wait for another process to finish writing
+    :param batch_size: maximum number of changes held back before writing
+
+    """
+
+    # seconds between deletions of expired cookies from the database
+    expire_interval = 60
+
+    _columns = ("version", "name", "value", "port", "port_specified",
+                "domain", "domain_specified", "domain_initial_dot", "path",
+                "path_specified", "secure", "expires", "discard", "comment",
+                "comment_url", "rest", "rfc2109")
+    _insert_sql = "INSERT OR REPLACE INTO cookies (%s) VALUES (%s)" % (
+        ", ".join(_columns), ", ".join("?" * len(_columns)))
+
+    def __init__(self, filename, policy=None, timeout=30, batch_size=100):
+        import sqlite3
+        CookieJar.__init__(self, policy)
+        self.filename = filename
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(filename, timeout=timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cookies (version INTEGER, name TEXT,"
+            " value TEXT, port TEXT, port_specified INTEGER, domain TEXT,"
+            " domain_specified INTEGER, domain_initial_dot INTEGER, path TEXT,"
+            " path_specified INTEGER, secure INTEGER, expires INTEGER,"
+            " discard INTEGER, comment TEXT, comment_url TEXT, rest TEXT,"
+            " rfc2109 INTEGER, PRIMARY KEY (domain, path, name))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cookies_expires"
+                         " ON cookies (expires)")
+        self._pending = []
+        self._loaded_domains = set()
+        self._all_loaded = False
+        self._data_version = self._get_data_version()
+        self._next_db_expiry = 0
+
+    def __getstate__(self):
+        raise TypeError("cannot pickle %s" % self.__class__.__name__)
+
+    def close(self):
+        """Write any pending changes and close the database."""
+        with self._cookies_lock:
+            self._write_pending()
+            self._db.close()
+
+    def commit(self):
+        """Write any pending changes to the database."""
+        with self._cookies_lock:
+            self._write_pending()
+
+    def _get_data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in self._pending:
+                db.execute(sql, params)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        del self._pending[:]
+
+    def _queue(self, sql, params=()):
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size:
+            self._write_pending()
+
+    def _sync(self):
+        # If another process has written to the database since we last
+        # looked, forget everything read from it.
+        version = self._get_data_version()
+        if version != self._data_version:
+            self._write_pending()
+            self._data_version = version
+            self._cookies = {}
+            self._loaded_domains = set()
+            self._all_loaded = False
+
+    def _load(self, domains=None):
+        self._write_pending()
+        now = int(time.time())
+        sql = ("SELECT %s FROM cookies WHERE (expires IS NULL OR expires > ?)"
+               % ", ".join(self._columns))
+        if domains is None:
+            rows = self._db.execute(sql, (now,))
+            self._cookies = jar = {}
+            self._all_loaded = True
+        else:
+            if self._all_loaded:
+                return
+            domains = [d for d in set(domains)
+                       if d not in self._loaded_domains]
+            if not domains:
+                return
+            rows = self._db.execute(
+                sql + " AND domain IN (%s)" % ", ".join("?" * len(domains)),
+                [now] + domains)
+            jar = self._cookies
+            for domain in domains:
+                jar.pop(domain, None)
+            self._loaded_domains.update(domains)
+        next_expiry = self._next_expiry
+        if next_expiry is not None and next_expiry[0] is jar:
+            next_expiry = next_expiry[1]
+        else:
+            next_expiry = None
+        for row in rows:
+            cookie = self._row_to_cookie(row)
+            jar.setdefault(cookie.domain, {}).setdefault(
+                cookie.path, {})[cookie.name] = cookie
+            if next_expiry is not None and cookie.expires is not None:
+                next_expiry = min(next_expiry, cookie.expires)
+        self._request_cookies_cache = None
+        if next_expiry is not None:
+            self._next_expiry = (jar, next_expiry)
+
+    def _row_to_cookie(self, row):
+        kwds = dict(zip(self._columns, row))
+        for name in ("port_specified", "domain_specified",
+                     "domain_initial_dot", "path_specified", "secure",
+                     "discard", "rfc2109"):
+            kwds[name] = bool(kwds[name])
+        kwds["rest"] = json.loads(kwds["rest"])
+        return Cookie(**kwds)
+
+    def _cookie_to_row(self, cookie):
+        return tuple(
+            json.dumps(cookie._rest) if name == "rest" else
+            getattr(cookie, name) for name in self._columns)
+
+    def _cookies_for_request(self, request):
+        self._sync()
+        if (_func(type(self._policy).domain_return_ok) is
+                _default_domain_return_ok):
+            self._load(candidate_cookie_domains(request))
+        else:
+            self._load()
+        return CookieJar._cookies_for_request(self, request)
+
+    def __iter__(self):
+        with self._cookies_lock:
+            self._sync()
+            if not self._all_loaded:
+                self._load()
+            return CookieJar.__iter__(self)
+
+    def extract_cookies(self, response, request):
+        with self._cookies_lock:
+            CookieJar.extract_cookies(self, response, request)
+            self._write_pending()
+
+    def set_cookie(self, cookie):
+        with self._cookies_lock:
+            self._sync()
+            CookieJar.set_cookie(self, cookie)
+            self._queue(self._insert_sql, self._cookie_to_row(cookie))
+
+    def clear(self, domain=None, path=None, name=None):
+        with self._cookies_lock:
+            self._sync()
+            if domain is not None:
+                self._load([domain])
+            CookieJar.clear(self, domain, path, name)
+            if name is not None:
+                self._queue("DELETE FROM cookies WHERE domain = ? AND"
+                            " path = ? AND name = ?", (domain, path, name))
+            elif path is not None:
+                self._queue("DELETE FROM cookies WHERE domain = ? AND"
+                            " path = ?", (domain, path))
+            elif domain is not None:
+                self._queue("DELETE FROM cookies WHERE domain = ?", (domain,))
+            else:
+                self._queue("DELETE FROM cookies")
+                self._all_loaded = True
+
+    def clear_session_cookies(self):
+        with self._cookies_lock:
+            self._sync()
+            for cookie in list(CookieJar.__iter__(self)):
+                if cookie.discard:
+                    CookieJar.clear(
+                        self, cookie.domain, cookie.path, cookie.name)
+            self._queue("DELETE FROM cookies WHERE discard")
+            self._write_pending()
+
+    def clear_expired_cookies(self):
+        # Only the cookies read so far are checked in memory; expired cookies
+        # are never read from the database, and are deleted from it every
+        # expire_interval seconds.
+        with self._cookies_lock:
+            now = time.time()
+            next_expiry = self._next_expiry
+            if (next_expiry is None or next_expiry[0] is not self._cookies or
+                    now >= next_expiry[1]):
+                expiries = []
+                for cookie in list(CookieJar.__iter__(self)):
+                    if cookie.is_expired(now):
+                        CookieJar.clear(
+                            self, cookie.domain, cookie.path, cookie.name)
+                    elif cookie.expires is not None:
+                        expiries.append(cookie.expires)
+                self._next_expiry = (self._cookies, min(expiries or [INF]))
+            if now >= self._next_db_expiry:
+                self._next_db_expiry = now + self.expire_interval
+                self._queue("DELETE FROM cookies WHERE expires <= ?",
+                            (int(now),))
+                self._write_pending()
+
+
 try:
     from http.cookiejar import NETSCAPE_MAGIC_RGX, NETSCAPE_HEADER_TEXT
 except ImportError:  # python < 3.10
@@ -11,7 +11,8 @@ class HTTPResponseDebugProcessor(BaseHandler):
 
     def http_response(self, request, response):
         if not hasattr(response, "seek"):
-            response = response_seek_wrapper(response)
+            response = response_seek_wrapper(response, getattr(
+                getattr(self, "parent", None), "_spool_threshold", None))
         info = logging.getLogger("mechanize.http_responses").info
         try:
             info(response.read())
@@ -76,80 +76,121 @@ def parse_select(elem, parent_of, *a):
     return ctype, name, {'__select': attrs}
 
 
-def parse_forms(root, base_url, request_class=None, select_default=False, encoding=None):
-    if request_class is None:
-        request_class = Request
-    global_form = HTMLForm(base_url, encoding=encoding)
-    forms, labels = [], []
-    form_elems = []
-    form_id_map = {}
-    all_elems = tuple(
-        e for e in root.iter('*') if is_string(e.tag))
-    parent_map = {c: p for p in all_elems for c in p}
-    id_to_labels = defaultdict(list)
-    for e in all_elems:
-        q = e.tag.lower()
-        if q == 'form':
-            form_elems.append(e)
-            fid = e.get('id')
-            if fid:
-                form_id_map[fid] = e
-        elif q == 'label':
-            for_id = e.get('for')
-            if for_id is not None:
-                label = Label(label_text(e), for_id)
-                labels.append(label)
-                id_to_labels[for_id].append(label)
-        elif q == 'base':
-            base_url = e.get('href') or base_url
-
-    def parent_of(elem, parent_name):
+control_names = {
+    'option': parse_option,
+    'button': parse_button,
+    'input': parse_input,
+    'textarea': parse_textarea,
+    'select': parse_select,
+}
+
+
+class FormsParser(object):
+    """Turn the forms in a document tree into HTMLForm objects, one form at a
+    time.
+
+    Finding forms, labels and which form each control belongs to is cheap and
+    done up front; creating the controls is what takes the time, so that is
+    only done for a form once it is iterated over.  Iterating again yields the
+    same form objects.
+    """
+
+    def __init__(self, root, base_url, request_class=None,
+                 select_default=False, encoding=None):
+        if request_class is None:
+            request_class = Request
+        self.select_default = select_default
+        self.encoding = encoding
+        self.forms = []
+        labels = []
+        form_elems = []
+        form_id_map = {}
+        all_elems = tuple(
+            e for e in root.iter('*') if is_string(e.tag))
+        self.parent_map = {c: p for p in all_elems for c in p}
+        id_to_labels = defaultdict(list)
+        control_elems = []
+        for i, e in enumerate(all_elems):
+            q = e.tag.lower()
+            if q == 'form':
+                form_elems.append(e)
+                fid = e.get('id')
+                if fid:
+                    form_id_map[fid] = e
+            elif q == 'label':
+                for_id = e.get('for')
+                if for_id is not None:
+                    label = Label(label_text(e), for_id)
+                    labels.append(label)
+                    id_to_labels[for_id].append(label)
+            elif q == 'base':
+                base_url = e.get('href') or base_url
+            elif q in control_names:
+                control_elems.append((i, e, q))
+
+        # the innermost enclosing form, for elements inside a form
+        enclosing_form = {}
+        for form_elem in form_elems:
+            for e in form_elem.iter('*'):
+                enclosing_form[e] = form_elem
+        # (index, element, tag name) of the controls of each form element,
+        # None for those not in any form
+        self.form_controls = defaultdict(list)
+        for i, e, q in control_elems:
+            fid = e.get('form')
+            if fid and fid in form_id_map:
+                form_elem = form_id_map[fid]
+            else:
+                form_elem = enclosing_form.get(e)
+            self.form_controls[form_elem].append((i, e, q))
+
+        self.form_elems = form_elems
+        for form_elem in form_elems:
+            name = form_elem.get('name') or None
+            action = form_elem.get('action') or None
+            method = form_elem.get('method') or 'GET'
+            enctype = form_elem.get(
+                'enctype') or "application/x-www-form-urlencoded"
+            if action:
+                action = urljoin(base_url, action)
+            else:
+                action = base_url
+            form = HTMLForm(action, method, enctype, name, form_elem.attrib,
+                            request_class, self.forms, labels, id_to_labels,
+                            encoding=encoding)
+            self.forms.append(form)
+        self._global_form = HTMLForm(base_url, encoding=encoding)
+        self._global_form_done = False
+        self.nr_done = 0
+        self.attrs_map = {}
+
+    def parent_of(self, elem, parent_name):
         q = elem
         while True:
-            q = parent_map.get(q)
+            q = self.parent_map.get(q)
             if q is None:
                 return
             if q.tag.lower() == parent_name:
                 return q
 
-    forms_map = {}
-    for form_elem in form_elems:
-        name = form_elem.get('name') or None
-        action = form_elem.get('action') or None
-        method = form_elem.get('method') or 'GET'
-        enctype = form_elem.get(
-            'enctype') or "application/x-www-form-urlencoded"
-        if action:
-            action = urljoin(base_url, action)
-        else:
-            action = base_url
-        form = HTMLForm(action, method, enctype, name, form_elem.attrib,
-                        request_class, forms, labels, id_to_labels, encoding=encoding)
-        forms_map[form_elem] = form
-        forms.append(form)
-
-    attrs_map = {}
-    control_names = {
-        'option': parse_option,
-        'button': parse_button,
-        'input': parse_input,
-        'textarea': parse_textarea,
-        'select': parse_select,
-    }
-
-    for i, elem in enumerate(all_elems):
-        q = elem.tag.lower()
-        cfunc = control_names.get(q)
-        if cfunc is not None:
-            fid = elem.get('form')
-            if fid and fid in form_id_map:
-                form_elem = form_id_map[fid]
-            else:
-                form_elem = parent_of(elem, 'form')
-            form = forms_map.get(form_elem, global_form)
+    def _add_controls(self, form, form_elem):
+        attrs_map = self.attrs_map
+        for i, elem, q in self.form_controls.get(form_elem, ()):
+            if q == 'option':
+                sel = self.parent_of(elem, 'select')
+                if sel is not None and sel not in attrs_map:
+                    # the select element belongs to a form not done yet
+                    attrs_map[sel] = parse_select(sel, self.parent_of)[2]
+            elif q == 'select' and elem in attrs_map:
+                # a select element whose options were done first
+                attrs = attrs_map[elem]
+                form.new_control(
+                    'select', attrs['__select'].get('name'), attrs,
+                    index=i * 10, select_default=self.select_default)
+                continue
             try:
-                control_type, control_name, attrs = cfunc(elem, parent_of,
-                                                          attrs_map)
+                control_type, control_name, attrs = control_names[q](
+                    elem, self.parent_of, attrs_map)
             except SkipControl:
                 continue
             attrs_map[elem] = attrs
@@ -158,10 +199,34 @@ def parse_forms(root, base_url, request_class=None, select_default=False, encodi
                 control_name,
                 attrs,
                 index=i * 10,
-                select_default=select_default)
-
-    for form in forms:
+                select_default=self.select_default)
         form.fixup()
-    global_form.fixup()
 
-    return forms, global_form
+    def __iter__(self):
+        i = 0
+        while i < len(self.forms):
+            if i == self.nr_done:
+                self._add_controls(self.forms[i], self.form_elems[i])
+                self.nr_done += 1
+            yield self.forms[i]
+            i += 1
+
+    def all_forms(self):
+        """Return the list of all forms."""
+        for form in self:
+            pass
+        return self.forms
+
+    @property
+    def global_form(self):
+        """The form containing all controls that are not in any form."""
+        if not self._global_form_done:
+            self._global_form_done = True
+            self._add_controls(self._global_form, None)
+        return self._global_form
+
+
+def parse_forms(root, base_url, request_class=None, select_default=False, encoding=None):
+    parser = FormsParser(root, base_url, request_class, select_default,
+                         encoding)
+    return parser.all_forms(), parser.global_form
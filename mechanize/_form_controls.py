@@ -244,6 +244,110 @@ class MimeWriter:
         self._fp.write("\r\n--" + boundary + "--\r\n")
 
 
+class MultipartBody:
+    """File-like multipart/form-data request body that reads upload files only
+    as it is itself read.
+
+    HTMLForm builds one of these instead of a byte string when its
+    stream_multipart attribute is true.
+
+    Public attributes:
+
+    length: total size of the body in bytes, or None if the size of an upload
+     file could not be determined (in which case the body is sent using
+     chunked transfer encoding)
+
+    """
+
+    def __init__(self):
+        self._segments = []
+        # bytes written since the last segment, joined into one segment when
+        # a file is added or the body is read
+        self._pending = []
+        # (file, position to rewind to) pairs, in the order they are read
+        self._files = []
+        self._index = 0
+        self._offset = 0
+        self._started = False
+        self._known_length = 0
+        self._unknown_length = False
+
+    def write(self, data):
+        if isinstance(data, unicode_type):
+            data = data.encode('utf-8')
+        self._pending.append(data)
+        self._known_length += len(data)
+
+    def _flush(self):
+        if self._pending:
+            self._segments.append(b"".join(self._pending))
+            self._pending = []
+
+    def add_file(self, file_object):
+        self._flush()
+        try:
+            start = file_object.tell()
+            file_object.seek(0, 2)
+            size = file_object.tell() - start
+            file_object.seek(start)
+        except (AttributeError, IOError, OSError, ValueError):
+            start = size = None
+        if size is None:
+            self._unknown_length = True
+        else:
+            self._known_length += size
+        self._files.append((file_object, start))
+        self._segments.append(file_object)
+
+    @property
+    def length(self):
+        if self._unknown_length:
+            return None
+        return self._known_length
+
+    def read(self, size=-1):
+        self._flush()
+        self._started = True
+        chunks = []
+        while size != 0 and self._index < len(self._segments):
+            segment = self._segments[self._index]
+            if isinstance(segment, bytes):
+                if size < 0:
+                    end = len(segment)
+                else:
+                    end = min(self._offset + size, len(segment))
+                chunk = segment[self._offset:end]
+                self._offset = end
+                if end == len(segment):
+                    self._index += 1
+                    self._offset = 0
+            else:
+                chunk = segment.read(size)
+                if not chunk:
+                    self._index += 1
+                    continue
+                if isinstance(chunk, unicode_type):
+                    chunk = chunk.encode('utf-8')
+            chunks.append(chunk)
+            if size > 0:
+                size = max(size - len(chunk), 0)
+        return b"".join(chunks)
+
+    def seek(self, offset, whence=0):
+        """Only rewinding to the start of the body is supported."""
+        if offset != 0 or whence != 0:
+            raise ValueError("can only seek to the start of the body")
+        if not self._started:
+            return
+        for file_object, start in self._files:
+            if start is None:
+                raise ValueError("upload file %r can't be rewound" %
+                                 file_object)
+            file_object.seek(start)
+        self._index = self._offset = 0
+        self._started = False
+
+
 class Label:
     def __init__(self, text, for_id=None):
         self.id = for_id
@@ -327,6 +431,9 @@ class Control:
     def add_to_form(self, form):
         self._form = form
         form.controls.append(self)
+        index_control = getattr(form, "_index_control", None)
+        if index_control is not None:
+            index_control(self)
 
     def fixup(self):
         pass
@@ -343,6 +450,16 @@ class Control:
     def __setattr__(self, name, value):
         raise NotImplementedError()
 
+    def _set_id(self, value):
+        # called by .__setattr__() of subclasses
+        changed = self.__dict__.get("id") != value
+        self.__dict__["id"] = value
+        form = self.__dict__.get("_form")
+        if changed and form is not None:
+            id_changed = getattr(form, "_control_id_changed", None)
+            if id_changed is not None:
+                id_changed(self)
+
     def pairs(self):
         """Return list of (key, value) pairs suitable for passing to urlencode.
         """
@@ -435,6 +552,8 @@ class ScalarControl(Control):
             self.__dict__["_value"] = value
         elif name in ("name", "type"):
             raise AttributeError("%s attribute is readonly" % name)
+        elif name == "id":
+            self._set_id(value)
         else:
             self.__dict__[name] = value
 
@@ -515,6 +634,8 @@ class FileControl(ScalarControl):
     def __setattr__(self, name, value):
         if name in ("value", "name", "type"):
             raise AttributeError("%s attribute is readonly" % name)
+        elif name == "id":
+            self._set_id(value)
         else:
             self.__dict__[name] = value
 
@@ -539,6 +660,13 @@ class FileControl(ScalarControl):
             return []
         return [(self._index, self.name, "")]
 
+    def _write_file(self, fh, file_object):
+        if isinstance(fh, MultipartBody):
+            # read the file as the request is sent
+            fh.add_file(file_object)
+        else:
+            fh.write(file_object.read())
+
     # If enctype is application/x-www-form-urlencoded and there's a FILE
     # control present, what should be sent?  Strictly, it should be 'name=data'
     # (see HTML 4.01 spec., section 17.13.2), but code sends "name=" ATM.  What
@@ -560,7 +688,7 @@ class FileControl(ScalarControl):
             disp = 'form-data; name="%s"%s' % (self.name, fn_part)
             mw2.addheader("Content-Disposition", disp, prefix=1)
             fh = mw2.startbody(content_type, prefix=0)
-            fh.write(file_object.read())
+            self._write_file(fh, file_object)
         else:
             # multiple files
             mw2 = mw.nextpart()
@@ -575,7 +703,7 @@ class FileControl(ScalarControl):
                 disp = "file%s" % fn_part
                 mw3.addheader("Content-Disposition", disp, prefix=1)
                 fh2 = mw3.startbody(content_type, prefix=0)
-                fh2.write(file_object.read())
+                self._write_file(fh2, file_object)
             mw2.lastpart()
 
     def __str__(self):
@@ -636,6 +764,8 @@ class IgnoreControl(ScalarControl):
                                  self.name)
         elif name in ("name", "type"):
             raise AttributeError("%s attribute is readonly" % name)
+        elif name == "id":
+            self._set_id(value)
         else:
             self.__dict__[name] = value
 
@@ -1059,16 +1189,22 @@ class ListControl(Control):
             # always count nameless elements as separate controls
             Control.add_to_form(self, form)
         else:
-            for ii in range(len(form.controls) - 1, -1, -1):
-                control = form.controls[ii]
-                if control.name == self.name and control.type == self.type:
-                    if control._closed:
-                        Control.add_to_form(self, form)
-                    else:
-                        control.merge_control(self)
-                    break
-            else:
+            control = self._last_control_like_self(form)
+            if control is None or control._closed:
                 Control.add_to_form(self, form)
+            else:
+                control.merge_control(self)
+
+    def _last_control_like_self(self, form):
+        # the most recently added control with the same name and type
+        get_index = getattr(form, "_get_control_index", None)
+        if get_index is not None:
+            controls = get_index().by_name_type.get((self.name, self.type))
+            return controls[-1] if controls else None
+        for control in reversed(form.controls):
+            if control.name == self.name and control.type == self.type:
+                return control
+        return None
 
     def merge_control(self, control):
         assert bool(control.multiple) == bool(self.multiple)
@@ -1131,6 +1267,8 @@ class ListControl(Control):
             self._set_value(value)
         elif name in ("name", "type", "multiple"):
             raise AttributeError("%s attribute is readonly" % name)
+        elif name == "id":
+            self._set_id(value)
         else:
             self.__dict__[name] = value
 
@@ -1583,6 +1721,35 @@ def is_listcontrol(control):
     return control.is_of_kind("list")
 
 
+class _ControlIndex:
+    """Controls of a form keyed by name, (name, type) and id.
+
+    Each value is a list of controls in document order, so that searching one
+    of these lists gives the same result as searching all of form.controls.
+
+    """
+
+    def __init__(self, controls):
+        self.controls = controls
+        self.count = 0
+        self.by_name = {}
+        self.by_name_type = {}
+        self.by_id = {}
+        for control in controls:
+            self.add(control)
+
+    def add(self, control):
+        self.count += 1
+        self.by_name.setdefault(control.name, []).append(control)
+        self.by_name_type.setdefault(
+            (control.name, control.type), []).append(control)
+        if control.id is not None:
+            self.by_id.setdefault(control.id, []).append(control)
+
+    def is_current(self, controls):
+        return controls is self.controls and len(controls) == self.count
+
+
 class HTMLForm:
     """
     Represents a single HTML <form> ... </form> element.
@@ -1761,6 +1928,10 @@ class HTMLForm:
     :ivar controls: list of Control instances; do not alter this list
         (instead, call form.new_control to make a Control and add it to the
         form, or control.add_to_form if you already have a Control instance)
+    :ivar stream_multipart: if true, multipart/form-data requests get a
+        file-like :class:`mechanize._form_controls.MultipartBody` as their
+        data, which reads upload files only as the request is sent, rather
+        than a byte string holding all of them (default False)
 
 
 
@@ -1811,6 +1982,10 @@ class HTMLForm:
 
     """
 
+    stream_multipart = False
+    # built on first use, see _get_control_index()
+    _control_index = None
+
     type2class = {
         "text": TextControl,
         "password": PasswordControl,
@@ -2373,6 +2548,43 @@ class HTMLForm:
         return self._find_control(name, type, kind, id, label, is_listcontrol,
                                   nr)
 
+    def _index_control(self, control):
+        # called by Control.add_to_form() after appending to self.controls
+        index = self._control_index
+        if index is None:
+            return
+        if (index.controls is self.controls and
+                index.count == len(self.controls) - 1):
+            index.add(control)
+        else:
+            self._control_index = None
+
+    def _control_id_changed(self, control):
+        # unlike name and type, id may be reassigned after the control was
+        # indexed; that's rare, so just build the index again when needed
+        self._control_index = None
+
+    def _get_control_index(self):
+        index = self._control_index
+        if index is None or not index.is_current(self.controls):
+            index = self._control_index = _ControlIndex(self.controls)
+        return index
+
+    def _candidate_controls(self, name, type, id):
+        # A subsequence of self.controls, in order, that contains every
+        # control _find_control() could match.
+        if name is not None:
+            index = self._get_control_index()
+            key = None if name is Missing else name
+            if type is not None:
+                return index.by_name_type.get((key, type), ())
+            return index.by_name.get(key, ())
+        if id is not None:
+            # Control._set_id() calls ._control_id_changed() when an id is
+            # reassigned, so the index stays up to date
+            return self._get_control_index().by_id.get(id, ())
+        return self.controls
+
     def _find_control(self, name, type, kind, id, label, predicate, nr):
         if ((name is not None) and (name is not Missing) and
                 not isstringlike(name)):
@@ -2394,7 +2606,7 @@ class HTMLForm:
         found = None
         ambiguous = False
 
-        for control in self.controls:
+        for control in self._candidate_controls(name, type, id):
             if ((name is not None and name != control.name) and
                     (name is not Missing or control.name is not None)):
                 continue
@@ -2535,7 +2747,10 @@ class HTMLForm:
                 return (uri, encode_query(),
                         [("Content-Type", self.enctype)])
             elif self.enctype == "multipart/form-data":
-                data = StringIO()
+                if self.stream_multipart:
+                    data = MultipartBody()
+                else:
+                    data = StringIO()
                 http_hdrs = []
                 mw = MimeWriter(data, http_hdrs)
                 mw.startmultipartbody(
@@ -2544,7 +2759,9 @@ class HTMLForm:
                     self.controls[control_index]._write_mime_data(
                             mw, encode_data(k), encode_data(v))
                 mw.lastpart()
-                return uri, data.getvalue(), http_hdrs
+                if not self.stream_multipart:
+                    data = data.getvalue()
+                return uri, data, http_hdrs
             else:
                 raise ValueError("unknown POST form encoding type '%s'" %
                                  self.enctype)
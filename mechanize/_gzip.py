@@ -2,11 +2,15 @@ from __future__ import absolute_import
 
 import struct
 import zlib
-from io import DEFAULT_BUFFER_SIZE
+from io import DEFAULT_BUFFER_SIZE, BytesIO
 
-from ._urllib2_fork import BaseHandler
+from ._urllib2_fork import BaseHandler, request_host
 from .polyglot import is_py2
 
+try:
+    from compression.zstd import ZstdDecompressor
+except ImportError:  # python < 3.14
+    ZstdDecompressor = None
 
 CRC_MASK = 0xffffffff
 if is_py2:
@@ -56,99 +60,225 @@ def read_amt(f, amt):
     return ans
 
 
-class UnzipWrapper:
-    def __init__(self, fp):
-        self.__decoder = zlib.decompressobj(-zlib.MAX_WBITS)
-        self.__data = b''
-        self.__crc = zlib.crc32(self.__data) & CRC_MASK
-        self.__fp = fp
-        self.__size = 0
-        self.__is_fully_read = False
+class DecompressWrapper(object):
+    """File-like object reading the decoded body of a compressed stream.
 
-    def read(self, sz=-1):
-        amt_read = 0
-        ans = []
-        if self.__data:
-            if sz < 0 or len(self.__data) < sz:
-                ans.append(self.__data)
-                amt_read += len(self.__data)
-                self.__data = b''
+    fp is the compressed stream.  It is read chunk_size bytes at a time, and
+    never more is decompressed than a call needs, give or take one chunk, so
+    lines may be read one by one from bodies of any size.
+
+    Subclasses implement ._decode().
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp, chunk_size=None):
+        self._fp = fp
+        self._chunk_size = chunk_size or self.CHUNK_SIZE
+        self._is_fully_read = False
+        # decompressed data not yet returned
+        self.__buf = bytearray()
+
+    def _decode(self, max_length):
+        """Return at most max_length more bytes of decompressed data.
+
+        May return no data without being at the end of the stream.  At the
+        end of the stream, sets ._is_fully_read.
+        """
+        raise NotImplementedError()
+
+    def __fill(self, wanted=None):
+        # Decompress until at least wanted bytes are buffered (all the data,
+        # if wanted is None), or the end of the stream.
+        buf = self.__buf
+        while not self._is_fully_read and (
+                wanted is None or len(buf) < wanted):
+            if wanted is None:
+                max_length = self._chunk_size
             else:
-                self.__data, ret = self.__data[sz:], self.__data[:sz]
-                return ret
-
-        if not self.__is_fully_read:
-            while not self.__decoder.unused_data and (sz < 0 or amt_read < sz):
-                chunk = self.__fp.read(1024)
-                if chunk:
-                    if self.__decoder.unconsumed_tail:
-                        chunk = self.__decoder.unconsumed_tail + chunk
-                    chunk = self.__decoder.decompress(chunk)
-                    ans.append(chunk)
-                    amt_read += len(chunk)
-                    self.__size += len(chunk)
-                    self.__crc = zlib.crc32(chunk, self.__crc)
-                else:
-                    if not self.__decoder.unused_data:
-                        raise ValueError(
-                            'unexpected end of compressed gzip data,'
-                            ' before reading trailer')
-                    break
-
-            if self.__decoder.unused_data:
-                # End of compressed stream reached
-                tail = self.__decoder.unused_data
-                if len(tail) < 8:
-                    tail += read_amt(self.__fp, 8 - len(tail))
-                # ignore any extra bytes after end of compressed stream
-                self.__fp.read()
-                # check CRC, ignore size mismatch
-                crc, size = struct.unpack(b'<LL', tail)
-                if (crc & CRC_MASK) != (self.__crc & CRC_MASK):
-                    raise ValueError(
-                        'gzip stream is corrupted, CRC does not match')
-                self.__is_fully_read = True
-
-        ans = b''.join(ans)
-        if len(ans) > sz and sz > -1:
-            ans, self.__data = ans[:sz], ans[sz:]
+                max_length = max(wanted - len(buf), self._chunk_size)
+            buf += self._decode(max_length)
+
+    def __take(self, amt):
+        buf = self.__buf
+        ans = bytes(buf[:amt])
+        del buf[:amt]
         return ans
 
-    def readline(self, sz=-1):
-        # Dont care about making this efficient
-        data = self.read()
-        idx = data.find(b'\n')
-        if idx > 0:
-            if sz < 0 or idx < sz:
-                line, self.__data = data[:idx + 1], data[idx + 1:]
-            else:
-                line, self.__data = data[:sz], data[sz:]
+    def read(self, sz=-1):
+        if sz is None or sz < 0:
+            self.__fill()
+            sz = len(self.__buf)
         else:
-            if sz > -1:
-                line, self.__data = data[:sz], data[sz:]
-            else:
-                line = data
-        return line
+            self.__fill(sz)
+        return self.__take(sz)
+
+    def readinto(self, b):
+        view = memoryview(b)
+        if not is_py2:
+            view = view.cast('B')
+        self.__fill(len(view))
+        amt = min(len(view), len(self.__buf))
+        view[:amt] = self.__buf[:amt]
+        del self.__buf[:amt]
+        return amt
+
+    def readline(self, sz=-1):
+        if sz is None:
+            sz = -1
+        buf = self.__buf
+        start = 0
+        while True:
+            idx = buf.find(b'\n', start)
+            if idx > -1:
+                end = idx + 1
+                break
+            if (0 <= sz <= len(buf)) or self._is_fully_read:
+                end = len(buf)
+                break
+            start = len(buf)
+            self.__fill(start + 1)
+        if sz > -1:
+            end = min(end, sz)
+        return self.__take(end)
+
+    def readlines(self, sizehint=-1):
+        ans = []
+        total = 0
+        for line in self:
+            ans.append(line)
+            total += len(line)
+            if 0 < sizehint <= total:
+                break
+        return ans
 
     def close(self):
-        self.__fp.close()
+        self._fp.close()
 
     def fileno(self):
-        return self.__fp.fileno()
+        return self._fp.fileno()
 
     def __iter__(self):
-        ans = self.readline()
-        if ans:
-            yield ans
+        return self
 
-    def next(self):
+    def __next__(self):
         ans = self.readline()
         if not ans:
             raise StopIteration()
         return ans
+    next = __next__
+
+
+class ZlibWrapper(DecompressWrapper):
+    """Read a zlib (wbits > 0) or raw deflate (wbits < 0) stream.
+
+    If wbits is None, which of the two it is is worked out from the first
+    bytes of the stream, once it is read.  prefix is data already read from
+    the start of fp.
+    """
+
+    def __init__(self, fp, wbits=zlib.MAX_WBITS, chunk_size=None,
+                 prefix=b''):
+        DecompressWrapper.__init__(self, fp, chunk_size)
+        self.__decoder = None if wbits is None else zlib.decompressobj(wbits)
+        self.__prefix = prefix
+
+    def __start(self):
+        prefix = self.__prefix
+        while len(prefix) < 2:
+            data = self._fp.read(2 - len(prefix))
+            if not data:
+                raise ValueError('unexpected end of compressed data')
+            prefix += data
+        self.__prefix = prefix
+        wbits = zlib.MAX_WBITS if is_zlib_header(prefix) else -zlib.MAX_WBITS
+        self.__decoder = zlib.decompressobj(wbits)
+
+    def _decode(self, max_length):
+        if self.__decoder is None:
+            self.__start()
+        decoder = self.__decoder
+        data = decoder.unconsumed_tail or self.__prefix
+        if data:
+            self.__prefix = b''
+        else:
+            data = self._fp.read(self._chunk_size)
+            if not data:
+                raise ValueError('unexpected end of compressed data')
+        ans = decoder.decompress(data, max_length)
+        if getattr(decoder, 'eof', False) or decoder.unused_data:
+            self._is_fully_read = True
+            self._end_of_stream(decoder.unused_data)
+        return ans
+
+    def _end_of_stream(self, tail):
+        # ignore any extra bytes after end of compressed stream
+        self._fp.read()
+
+
+class UnzipWrapper(ZlibWrapper):
+    """Read the deflate data and trailer of a gzip stream.
+
+    fp is positioned just after the gzip header.
+    """
+
+    def __init__(self, fp, chunk_size=None):
+        ZlibWrapper.__init__(self, fp, -zlib.MAX_WBITS, chunk_size)
+        self.__crc = zlib.crc32(b'') & CRC_MASK
+        self.__expected_crc = None
+
+    def _decode(self, max_length):
+        ans = ZlibWrapper._decode(self, max_length)
+        self.__crc = zlib.crc32(ans, self.__crc)
+        if self._is_fully_read and (
+                (self.__crc & CRC_MASK) != self.__expected_crc):
+            raise ValueError('gzip stream is corrupted, CRC does not match')
+        return ans
+
+    def _end_of_stream(self, tail):
+        if len(tail) < 8:
+            try:
+                tail += read_amt(self._fp, 8 - len(tail))
+            except EOFError:
+                raise ValueError('unexpected end of compressed gzip data,'
+                                 ' before reading trailer')
+        ZlibWrapper._end_of_stream(self, tail)
+        # check CRC, ignore size mismatch
+        crc, size = struct.unpack(b'<LL', tail[:8])
+        self.__expected_crc = crc & CRC_MASK
+
+
+class ZstdWrapper(DecompressWrapper):
+    """Read a stream of one or more Zstandard frames.
+
+    Requires the compression.zstd module (Python 3.14 or later).
+    """
+
+    def __init__(self, fp, chunk_size=None):
+        if ZstdDecompressor is None:
+            raise ValueError('zstd content-coding is not supported')
+        DecompressWrapper.__init__(self, fp, chunk_size)
+        self.__decoder = ZstdDecompressor()
+
+    def _decode(self, max_length):
+        decoder = self.__decoder
+        if decoder.eof:
+            # another frame may follow
+            data = decoder.unused_data or self._fp.read(self._chunk_size)
+            if not data:
+                self._is_fully_read = True
+                return b''
+            decoder = self.__decoder = ZstdDecompressor()
+        elif decoder.needs_input:
+            data = self._fp.read(self._chunk_size)
+            if not data:
+                raise ValueError('unexpected end of compressed zstd data')
+        else:
+            data = b''
+        return decoder.decompress(data, max_length)
 
 
-def create_gzip_decompressor(zipped_file):
+def create_gzip_decompressor(zipped_file, chunk_size=None):
     prefix = read_amt(zipped_file, 10)
     if prefix[:2] != b'\x1f\x8b':
         raise ValueError('gzip stream has incorrect magic bytes: %r' %
@@ -158,8 +288,7 @@ def create_gzip_decompressor(zipped_file):
                          prefix[2])
     flag = ord(prefix[3:4])
     if flag & 4:  # extra
-        extra_amt = read_amt(zipped_file, 2)
-        extra_amt = ord(extra_amt[0]) + 256 * ord(extra_amt[1])
+        extra_amt = struct.unpack(b'<H', read_amt(zipped_file, 2))[0]
         if extra_amt:
             read_amt(zipped_file, extra_amt)
     if flag & 8:  # filename
@@ -170,40 +299,223 @@ def create_gzip_decompressor(zipped_file):
             continue
     if flag & 2:  # crc
         read_amt(zipped_file, 2)
-    return UnzipWrapper(zipped_file)
+    return UnzipWrapper(zipped_file, chunk_size)
+
+
+def is_zlib_header(prefix):
+    # RFC 1950: deflate compression method, and a header checksum
+    cmf, flg = bytearray(prefix[:2])
+    return cmf & 0x0f == 8 and cmf >> 4 <= 7 and (cmf * 256 + flg) % 31 == 0
+
+
+def create_deflate_decompressor(zipped_file, chunk_size=None):
+    # The deflate content-coding is the zlib format, but some servers send
+    # raw deflate data instead.  Nothing is read until the body is.
+    return ZlibWrapper(zipped_file, None, chunk_size)
+
+
+def content_decoders():
+    """Return a dict mapping supported content-codings to decompressors.
+
+    Each decompressor is called with the compressed stream and returns a
+    file-like object reading the decoded data.
+    """
+    ans = {
+        'gzip': create_gzip_decompressor,
+        'x-gzip': create_gzip_decompressor,
+        'deflate': create_deflate_decompressor,
+    }
+    if ZstdDecompressor is not None:
+        ans['zstd'] = ZstdWrapper
+    return ans
+
+
+def accepted_encodings():
+    # the content-codings to advertise in Accept-Encoding
+    decoders = content_decoders()
+    return [x for x in ('gzip', 'deflate', 'zstd') if x in decoders]
 
 
 class HTTPGzipProcessor(BaseHandler):
+    """Decode the gzip, deflate and (where supported) zstd content-codings.
+
+    Responses with any other content-coding are left alone.
+    """
+
     handler_order = 200  # response processing before HTTPEquivProcessor
 
     def __init__(self, request_gzip=False):
         self.request_gzip = request_gzip
+        self.decoders = content_decoders()
 
     def __copy__(self):
-        return self.__class__(self.request_gzip)
+        ans = self.__class__(self.request_gzip)
+        ans.decoders = self.decoders.copy()
+        return ans
 
     def http_request(self, request):
-        if self.request_gzip:
+        # a byte range of a compressed body can not be decompressed by itself
+        if self.request_gzip and not request.has_header('Range'):
             existing = [
                 x.strip().lower()
                 for x in request.get_header('Accept-Encoding', '').split(',')
             ]
-            if 'gzip' not in existing:
-                existing.append('gzip')
-                request.add_header("Accept-Encoding",
-                                   ', '.join(filter(None, existing)))
+            for coding in accepted_encodings():
+                if coding not in existing:
+                    existing.append(coding)
+            request.add_header("Accept-Encoding",
+                               ', '.join(filter(None, existing)))
         return request
 
     def http_response(self, request, response):
         # post-process response
+        if getattr(response, "code", None) in (204, 304) or (
+                request is not None and request.get_method() == "HEAD"):
+            # no body to decode (RFC 7230 section 3.3.3)
+            return response
         h = response.info()
-        enc_hdrs = h.getheaders("Content-encoding")
-        for enc_hdr in enc_hdrs:
-            if "gzip" in enc_hdr:
-                response._set_fp(create_gzip_decompressor(response.fp))
-                del h['Content-encoding']
-                del h['Content-length']
+        codings = []
+        for enc_hdr in h.getheaders("Content-encoding"):
+            codings.extend(
+                filter(None, (x.strip().lower() for x in enc_hdr.split(','))))
+        codings = [x for x in codings if x != 'identity']
+        if not codings or not all(x in self.decoders for x in codings):
+            return response
+        # codings are listed in the order they were applied
+        fp = response.fp
+        for coding in reversed(codings):
+            fp = self.decoders[coding](fp)
+        response._set_fp(fp)
+        del h['Content-encoding']
+        del h['Content-length']
         return response
 
     https_response = http_response
     https_request = http_request
+
+
+class GzipBody(object):
+    """File-like request body that gzip-compresses another as it is read.
+
+    As for MultipartBody, only rewinding to the start of the body is
+    supported, and only if the wrapped body can itself be rewound.
+
+    Public attributes:
+
+    length: always None, since the compressed size is not known in advance
+     (so the body is sent using chunked transfer encoding)
+
+    """
+
+    length = None
+
+    def __init__(self, src_file, compress_level=6):
+        self._src_file = src_file
+        self._compress_level = compress_level
+        try:
+            self._start = src_file.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            # e.g. MultipartBody, which can only be rewound to its start
+            self._start = 0 if hasattr(src_file, 'seek') else None
+        self._started = False
+        self._reset()
+
+    def _reset(self):
+        self._chunks = compress_readable_output(
+            self._src_file, self._compress_level)
+        self._buf = b''
+
+    def read(self, size=-1):
+        self._started = True
+        chunks = [self._buf]
+        amt = len(self._buf)
+        while size is None or size < 0 or amt < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            amt += len(chunk)
+        data = b''.join(chunks)
+        if size is None or size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        return data[:size]
+
+    def seek(self, offset, whence=0):
+        """Only rewinding to the start of the body is supported."""
+        if offset != 0 or whence != 0:
+            raise ValueError("can only seek to the start of the body")
+        if not self._started:
+            return
+        if self._start is None:
+            raise ValueError("request body %r can't be rewound" %
+                             self._src_file)
+        self._src_file.seek(self._start)
+        self._reset()
+        self._started = False
+
+
+class HTTPRequestGzipProcessor(BaseHandler):
+    """Send request bodies to some hosts with gzip content-coding.
+
+    Servers are not obliged to accept compressed request bodies, so this is
+    only done for the hosts given.
+
+    hosts: host names (without port) to compress request bodies for; a name
+        starting with a dot, like ".example.com", also matches all its
+        subdomains
+    min_size: bodies smaller than this many bytes are sent as they are
+    compress_level: zlib compression level
+
+    Byte string bodies are compressed up front, and sent as they are if that
+    does not make them smaller.  File-like bodies (for example the
+    MultipartBody of an HTMLForm with stream_multipart set) are compressed as
+    they are sent, unless their length attribute says they are smaller than
+    min_size.  Requests that already have a Content-Encoding header are left
+    alone.
+    """
+
+    handler_order = 200  # request processing before HTTPHandler
+
+    def __init__(self, hosts=(), min_size=1024, compress_level=6):
+        self.hosts = set(host.lower() for host in hosts)
+        self.min_size = min_size
+        self.compress_level = compress_level
+
+    def __copy__(self):
+        return self.__class__(self.hosts, self.min_size, self.compress_level)
+
+    def accepts_gzip(self, request):
+        host = request_host(request)
+        if host in self.hosts:
+            return True
+        return any(x.startswith('.') and ('.' + host).endswith(x)
+                   for x in self.hosts)
+
+    def http_request(self, request):
+        if (not request.has_data() or request.has_header('Content-encoding')
+                or not self.accepts_gzip(request)):
+            return request
+        data = request.get_data()
+        if hasattr(data, 'read'):
+            length = getattr(data, 'length', None)
+            if length is not None and length < self.min_size:
+                return request
+            body = GzipBody(data, self.compress_level)
+        elif isinstance(data, bytes):
+            if len(data) < self.min_size:
+                return request
+            body = b''.join(
+                compress_readable_output(BytesIO(data), self.compress_level))
+            if len(body) >= len(data):
+                return request
+        else:
+            return request
+        request.set_data(body)
+        # HTTPHandler sets it again, from the compressed body
+        request.add_header('Content-length', None)
+        request.add_unredirected_header('Content-length', None)
+        request.add_unredirected_header('Content-encoding', 'gzip')
+        return request
+
+    https_request = http_request
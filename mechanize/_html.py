@@ -2,13 +2,25 @@ from __future__ import absolute_import
 
 import codecs
 import copy
+import hashlib
 import re
+import threading
+from collections import OrderedDict
 
-from ._form import parse_forms
+from ._form import FormsParser
 from ._headersutil import is_html as _is_html
 from ._headersutil import split_header_words
 from ._rfc3986 import clean_url, urljoin
-from .polyglot import is_string
+from .polyglot import is_py2, is_string
+
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+try:
+    from html import unescape
+except ImportError:
+    unescape = HTMLParser().unescape
 
 DEFAULT_ENCODING = "utf-8"
 _encoding_pats = (
@@ -65,8 +77,15 @@ def elem_text(elem):
             yield child.tail
 
 
+link_tags = {"a": "href", "area": "href", "iframe": "src"}
+# elements whose content is text rather than markup: HTML5 raw text elements,
+# and escapable raw text elements, in which character references are decoded
+raw_text_tags = frozenset(
+    ("iframe", "noembed", "noframes", "script", "style", "xmp"))
+escapable_raw_text_tags = frozenset(("textarea", "title"))
+
+
 def iterlinks(root, base_url):
-    link_tags = {"a": "href", "area": "href", "iframe": "src"}
     for tag in root.iter('*'):
         if not is_string(tag.tag):
             continue
@@ -85,6 +104,162 @@ def iterlinks(root, base_url):
                 base_url = href
 
 
+class _LinkRecord(object):
+
+    def __init__(self, base_url, url, tag, attrs):
+        self.base_url, self.url, self.tag, self.attrs = (
+            base_url, url, tag, attrs)
+        self.text = []
+        self.done = False
+
+    def link(self):
+        return Link(self.base_url, self.url,
+                    compress_whitespace(u''.join(self.text)), self.tag,
+                    self.attrs)
+
+
+class LinkTokenizer(HTMLParser):
+    """Tokenizer that collects links without building a document tree.
+
+    Links are appended to .links in document order as soon as their end tag
+    has been seen.  Well-formed documents give the same links as iterlinks()
+    does for their tree; for broken markup the results may differ, since no
+    HTML5 tree construction is done.
+    """
+
+    # newer HTMLParsers decode character references in escapable raw text
+    # elements themselves
+    _decodes_escapable_raw_text = bool(
+        getattr(HTMLParser, "RCDATA_CONTENT_ELEMENTS", ()))
+
+    def __init__(self, base_url):
+        if is_py2:
+            HTMLParser.__init__(self)
+        else:
+            HTMLParser.__init__(self, convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+        # links in document order, not yet moved to .links; and those of
+        # them whose end tag has not been seen
+        self._pending = []
+        self._open = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            # an <a> start tag closes any open <a> element
+            self._close("a")
+        attr = link_tags.get(tag)
+        if attr is not None:
+            items = []
+            seen = set()
+            for name, value in attrs:
+                if name not in seen:
+                    seen.add(name)
+                    items.append((name, u'' if value is None else value))
+            val = dict(items).get(attr)
+            if val:
+                record = _LinkRecord(self.base_url, clean_url(val), tag, items)
+                self._pending.append(record)
+                self._open.append(record)
+                if tag == "area":
+                    # a void element
+                    self._close(tag)
+        elif tag == "base":
+            for name, value in attrs:
+                if name == "href":
+                    if value:
+                        self.base_url = value
+                    break
+        if tag in raw_text_tags or tag in escapable_raw_text_tags:
+            # anything up to the matching end tag, including what looks like
+            # a link, is text
+            self.set_cdata_mode(tag)
+
+    def handle_endtag(self, tag):
+        if tag in link_tags:
+            self._close(tag)
+
+    def handle_data(self, data):
+        if (self.cdata_elem in escapable_raw_text_tags and
+                not self._decodes_escapable_raw_text):
+            data = unescape(data)
+        for record in self._open:
+            record.text.append(data)
+
+    def handle_comment(self, data):
+        # iterlinks() includes the text of comments, too
+        self.handle_data(data)
+
+    def handle_entityref(self, name):
+        # only called on Python 2, where there is no convert_charrefs
+        self.handle_data(self.unescape("&%s;" % name))
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape("&#%s;" % name))
+
+    def close(self):
+        if self.cdata_elem is not None:
+            # HTMLParser discards unterminated raw text
+            self.feed("</%s>" % self.cdata_elem)
+        HTMLParser.close(self)
+        for record in self._open:
+            record.done = True
+        del self._open[:]
+        self._flush()
+
+    def _close(self, tag):
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i].tag == tag:
+                for record in self._open[i:]:
+                    record.done = True
+                del self._open[i:]
+                self._flush()
+                break
+
+    def _flush(self):
+        pending = self._pending
+        n = 0
+        while n < len(pending) and pending[n].done:
+            self.links.append(pending[n].link())
+            n += 1
+        del pending[:n]
+
+
+def stream_links(data, base_url, encoding=DEFAULT_ENCODING,
+                 chunk_size=16 * 1024):
+    """Yield links (:class:`mechanize.Link` objects) from HTML data,
+    without building a document tree.
+
+    data is parsed chunk_size bytes at a time, so that a caller that stops
+    iterating early does not pay for parsing the rest of the document.  See
+    :class:`LinkTokenizer` for how the results can differ from those of
+    :func:`iterlinks()`.
+    """
+    if isinstance(data, bytes):
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)('replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder(
+                DEFAULT_ENCODING)('replace')
+    else:
+        decoder = None
+    tokenizer = LinkTokenizer(base_url)
+    links = tokenizer.links
+    for i in range(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        if decoder is not None:
+            chunk = decoder.decode(chunk)
+        tokenizer.feed(chunk)
+        for link in links:
+            yield link
+        del links[:]
+    if decoder is not None:
+        tokenizer.feed(decoder.decode(b'', True))
+    tokenizer.close()
+    for link in links:
+        yield link
+
+
 def compress_whitespace(text):
     return re.sub(r'\s+', ' ', text or '').strip()
 
@@ -207,6 +382,61 @@ def get_title(root):
 lazy = object()
 
 
+class ParseResult(object):
+    """What Factory derives from a document that does not change when
+    the document is visited again."""
+
+    def __init__(self, root, form_encoding):
+        self.root = root
+        self.form_encoding = form_encoding
+        self.title = self.links = lazy
+
+
+class ParseCache(object):
+    """Least-recently-used cache of parsed documents.
+
+    Entries are keyed on a hash of the document's content together with its
+    URL and whatever else affects how it is parsed, so that going back in
+    history, reloading an unchanged page or visiting the same page from a
+    copied Browser does not parse it again.
+
+    Not used unless passed to Factory.set_parse_cache().  One instance may
+    be shared between several Factory instances (copied Browsers share
+    theirs): it is thread-safe.
+    """
+
+    def __init__(self, max_entries=20):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached ParseResult for key, or None."""
+        with self._lock:
+            try:
+                result = self._entries.pop(key)
+            except KeyError:
+                return None
+            # re-insert as most recently used
+            self._entries[key] = result
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
 class Factory:
     """Factory for forms, links, etc.
 
@@ -215,9 +445,13 @@ class Factory:
     Public methods:
 
     set_request_class(request_class)
+    set_parse_cache(cache)
+    set_stream_links(handle)
     set_response(response)
     forms()
+    iterforms()
     links()
+    iterlinks()
 
     Public attributes:
 
@@ -249,8 +483,11 @@ class Factory:
         self._response_type_finder = ResponseTypeFinder(
             allow_xhtml=allow_xhtml)
         self._content_parser = content_parser
+        self._parse_cache = None
+        self._stream_links = False
         self._current_forms = self._current_links = self._current_title = lazy
-        self._current_global_form = self._root = lazy
+        self._current_global_form = self._parsed = lazy
+        self._forms_parser = lazy
         self._raw_data = b''
         self.is_html, self.encoding = False, DEFAULT_ENCODING
 
@@ -259,6 +496,25 @@ class Factory:
     def set_content_parser(self, val):
         self._content_parser = val
 
+    def set_parse_cache(self, cache):
+        """Set the ParseCache used to avoid parsing the same document again,
+        or None to always parse (the default).
+
+        A cache holds the parsed documents in memory until they are evicted,
+        so choose its max_entries with the size of the documents in mind.
+        """
+        self._parse_cache = cache
+
+    def set_stream_links(self, handle):
+        """Set whether to find links with a tokenizer (see
+        :func:`stream_links()`) rather than from the parsed document tree.
+
+        This is much cheaper when links are all that is needed from a page,
+        since no tree is built.  Once the tree has been built for some other
+        reason (e.g. to find forms), links are taken from it as usual.
+        """
+        self._stream_links = bool(handle)
+
     def set_request_class(self, request_class):
         """Set request class (mechanize.Request by default).
 
@@ -277,40 +533,70 @@ class Factory:
         """
         self._response = copy.copy(response)
         self._current_forms = self._current_links = self._current_title = lazy
-        self._current_global_form = self._root = lazy
+        self._current_global_form = self._parsed = self._raw_data = lazy
+        self._forms_parser = lazy
         self.encoding = self._encoding_finder.encoding(self._response)
         self.is_html = self._response_type_finder.is_html(
             self._response, self.encoding) if self._response else False
 
     @property
     def root(self):
-        if self._root is lazy:
-            response = self._response
-            raw = self._response.read() if self._response else b''
-            default_encoding = self._encoding_finder._default_encoding
-            transport_encoding = get_encoding_from_response(response, verify=False)
-            declared_encoding = find_declared_encoding(raw)
-            self.form_encoding = declared_encoding or transport_encoding or default_encoding
-            self._root = self._content_parser(
-                raw,
-                url=response.geturl() if response else None,
-                response_info=response.info() if response else None,
-                default_encoding=default_encoding,
-                is_html=self.is_html,
-                transport_encoding=transport_encoding)
-        return self._root
+        return self._get_parsed().root
+
+    def _get_parsed(self):
+        if self._parsed is lazy:
+            self._parsed = self._parse()
+            self.form_encoding = self._parsed.form_encoding
+        return self._parsed
+
+    def _get_raw_data(self):
+        if self._raw_data is lazy:
+            self._raw_data = (
+                self._response.read() if self._response else b'')
+        return self._raw_data
+
+    def _parse(self):
+        response = self._response
+        raw = self._get_raw_data()
+        url = response.geturl() if response else None
+        default_encoding = self._encoding_finder._default_encoding
+        transport_encoding = get_encoding_from_response(response, verify=False)
+        cache = self._parse_cache
+        if cache is not None:
+            key = (hashlib.sha1(raw).digest(), url, transport_encoding,
+                   default_encoding, self.is_html, self._content_parser)
+            result = cache.get(key)
+            if result is not None:
+                return result
+        declared_encoding = find_declared_encoding(raw)
+        form_encoding = declared_encoding or transport_encoding or default_encoding
+        result = ParseResult(self._content_parser(
+            raw,
+            url=url,
+            response_info=response.info() if response else None,
+            default_encoding=default_encoding,
+            is_html=self.is_html,
+            transport_encoding=transport_encoding), form_encoding)
+        if cache is not None:
+            cache.put(key, result)
+        return result
 
     @property
     def title(self):
         if self._current_title is lazy:
-            self._current_title = get_title(
-                self.root) if self.root is not None else None
+            parsed = self._get_parsed()
+            if parsed.title is lazy:
+                parsed.title = get_title(
+                    parsed.root) if parsed.root is not None else None
+            self._current_title = parsed.title
         return self._current_title or u''
 
     @property
     def global_form(self):
         if self._current_global_form is lazy:
-            self.forms()
+            parser = self._get_forms_parser()
+            self._current_global_form = (
+                None if parser is None else parser.global_form)
         return self._current_global_form
 
     def forms(self):
@@ -320,19 +606,89 @@ class Factory:
             self._current_forms, self._current_global_form = self._get_forms()
         return self._current_forms
 
+    def iterforms(self):
+        """Return an iterator over HTMLForm-like objects.
+
+        Unlike :meth:`forms()`, this only creates the controls of forms that
+        are iterated over.  The form objects are the same as those returned
+        by :meth:`forms()`.
+        """
+        if self._current_forms is lazy:
+            parser = self._get_forms_parser()
+            if parser is not None:
+                return iter(parser)
+        return iter(self.forms())
+
     def links(self):
         """Return tuple of mechanize.Link-like objects.  """
         if self._current_links is lazy:
-            self._current_links = self._get_links()
-        return self._get_links()
+            if self._streaming():
+                self._current_links = tuple(self._iter_streamed_links())
+                return self._current_links
+            parsed = self._get_parsed()
+            if parsed.links is lazy:
+                parsed.links = self._get_links()
+            self._current_links = parsed.links
+        return self._current_links
+
+    def iterlinks(self):
+        """Return an iterator over mechanize.Link-like objects.
+
+        Unlike :meth:`links()`, this may avoid finding links that are never
+        iterated over.
+        """
+        if self._current_links is lazy:
+            if self._streaming():
+                return self._iter_streamed_links()
+            if self._get_parsed().links is lazy:
+                return self._iter_tree_links()
+        return iter(self.links())
+
+    def _streaming(self):
+        return self._stream_links and self._parsed is lazy
+
+    def _iter_streamed_links(self):
+        response = self._response
+        if not self.is_html:
+            return
+        raw = self._get_raw_data()
+        # as for HTML5 parsers, the HTTP headers take precedence
+        encoding = (get_encoding_from_response(response) or
+                    find_declared_encoding(raw) or
+                    self._encoding_finder._default_encoding)
+        links = []
+        for link in stream_links(raw, response.geturl(), encoding):
+            links.append(link)
+            yield link
+        if self._response is response and self._current_links is lazy:
+            self._current_links = tuple(links)
+
+    def _iter_tree_links(self):
+        parsed = self._get_parsed()
+        if parsed.root is None:
+            return
+        links = []
+        for link in iterlinks(parsed.root, self._response.geturl()):
+            links.append(link)
+            yield link
+        if parsed.links is lazy:
+            parsed.links = tuple(links)
 
     def _get_links(self):
         if self.root is None:
             return ()
         return tuple(iterlinks(self.root, self._response.geturl()))
 
+    def _get_forms_parser(self):
+        if self._forms_parser is lazy:
+            root = self.root
+            self._forms_parser = None if root is None else FormsParser(
+                root, self._response.geturl(), self._request_class,
+                encoding=self.form_encoding)
+        return self._forms_parser
+
     def _get_forms(self):
-        if self.root is None:
+        parser = self._get_forms_parser()
+        if parser is None:
             return (), None
-        return parse_forms(self.root,
-                           self._response.geturl(), self._request_class, encoding=self.form_encoding)
+        return parser.all_forms(), parser.global_form
@@ -16,15 +16,18 @@ from __future__ import absolute_import
 
 import logging
 import socket
+import threading
 import time
+from collections import OrderedDict
 from io import BytesIO
 
 from . import _rfc3986, _sockettimeout
-from ._headersutil import is_html
+from ._headersutil import is_html, split_header_words
 from ._request import Request
 from ._response import response_seek_wrapper
 from ._urllib2_fork import BaseHandler, HTTPError
 from ._equiv import HTTPEquivParser
+from ._util import http2time
 from .polyglot import create_response_info, RobotFileParser, is_py2, as_unicode
 
 debug = logging.getLogger("mechanize").debug
@@ -44,7 +47,8 @@ class HTTPEquivProcessor(BaseHandler):
 
     def http_response(self, request, response):
         if not hasattr(response, "seek"):
-            response = response_seek_wrapper(response)
+            response = response_seek_wrapper(response, getattr(
+                getattr(self, "parent", None), "_spool_threshold", None))
         http_message = response.info()
         url = response.geturl()
         ct_hdrs = http_message.getheaders("content-type")
@@ -72,12 +76,56 @@ class HTTPEquivProcessor(BaseHandler):
     https_response = http_response
 
 
+def max_age_from_headers(headers, now=None):
+    """Return the number of seconds a response may be cached for, going by its
+    Cache-Control and Expires headers, or None if they don't say.
+
+    >>> from mechanize._response import test_response
+    >>> r = test_response(headers=[("Cache-Control", "public, max-age=60")])
+    >>> max_age_from_headers(r.info())
+    60
+    >>> r = test_response(headers=[("Cache-Control", "no-store")])
+    >>> max_age_from_headers(r.info())
+    0
+    >>> print(max_age_from_headers(test_response().info()))
+    None
+
+    """
+    for pairs in split_header_words(headers.getheaders("cache-control")):
+        for key, value in pairs:
+            key = key.lower()
+            if key in ("no-store", "no-cache"):
+                return 0
+            if key == "max-age":
+                try:
+                    return max(int(value), 0)
+                except (TypeError, ValueError):
+                    return 0
+    expires = headers.getheaders("expires")
+    if expires:
+        expires = http2time(expires[-1])
+        if expires is None:
+            # invalid dates mean "already expired"
+            return 0
+        date = headers.getheaders("date")
+        date = http2time(date[-1]) if date else None
+        if date is None:
+            date = time.time() if now is None else now
+        return max(int(expires - date), 0)
+    return None
+
+
 class MechanizeRobotFileParser(RobotFileParser):
 
     def __init__(self, url='', opener=None):
         RobotFileParser.__init__(self, url)
         self._opener = opener
         self._timeout = _sockettimeout._GLOBAL_DEFAULT_TIMEOUT
+        # set by .read(): HTTP status of the robots.txt response (None if it
+        # could not be fetched), and how long it may be cached for according
+        # to its headers (None if they don't say)
+        self.status = None
+        self.max_age = None
 
     def set_opener(self, opener=None):
         from . import _opener
@@ -92,23 +140,40 @@ class MechanizeRobotFileParser(RobotFileParser):
         """Reads the robots.txt URL and feeds it to the parser."""
         if self._opener is None:
             self.set_opener()
-        req = Request(self.url, unverifiable=True, visit=False,
-                      timeout=self._timeout)
         try:
-            f = self._opener.open(req)
+            f = self._opener.open(self._request())
         except HTTPError as err:
             f = err
         except (IOError, socket.error, OSError) as exc:
-            debug_robots("ignoring error opening %r: %s" %
-                         (self.url, exc))
+            self._read_failed(exc)
             return
+        self._read_response(f)
+
+    def _request(self):
+        return Request(self.url, unverifiable=True, visit=False,
+                       timeout=self._timeout)
+
+    def _read_failed(self, exc):
+        # robots.txt is unreachable: assume complete disallow until it is
+        # checked again (RFC 9309 section 2.3.1.4)
+        debug_robots("disallow all after error opening %r: %s" %
+                     (self.url, exc))
+        self.disallow_all = True
+        self.modified()
+
+    def _read_response(self, f):
         lines = []
         line = f.readline()
         while line:
             lines.append(line.strip())
             line = f.readline()
-        status = f.code
-        if status == 401 or status == 403:
+        status = self.status = f.code
+        self.max_age = max_age_from_headers(f.info())
+        # anything not disallowed below (e.g. an empty robots.txt) is allowed
+        self.modified()
+        if status == 401 or status == 403 or status >= 500:
+            # for 5xx, robots.txt is unreachable: assume complete disallow
+            # until it is checked again (RFC 9309 section 2.3.1.4)
             self.disallow_all = True
             debug_robots("disallow all")
         elif status >= 400:
@@ -132,28 +197,94 @@ class RobotExclusionError(HTTPError):
         self.request = request
 
 
+class RobotRulesCache(object):
+    """Least-recently-used cache of parsed robots.txt rules, keyed on scheme
+    and host.
+
+    Rules are kept for at most ttl seconds, less if the robots.txt response's
+    caching headers say so, but for at least min_ttl seconds even if they say
+    not to cache it, so that robots.txt is not fetched before every request.
+    Robots.txt files that could not be fetched, or that were fetched with a
+    5xx status, disallow everything; that is kept for error_ttl seconds only,
+    so that the file is tried again soon.
+
+    One instance may be shared between several HTTPRobotRulesProcessor
+    instances (e.g. those of copied Browsers): it is thread-safe.
+    """
+
+    def __init__(self, max_hosts=100, ttl=24 * 60 * 60, error_ttl=5 * 60,
+                 min_ttl=60):
+        self.max_hosts = max_hosts
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.min_ttl = min_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached parser for key, or None."""
+        with self._lock:
+            try:
+                rfp, expires = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                return None
+            # re-insert as most recently used
+            self._entries[key] = rfp, expires
+            return rfp
+
+    def put(self, key, rfp):
+        """Cache parser rfp (after its .read() was called) for key."""
+        status = getattr(rfp, "status", 200)
+        if status is None or status >= 500:
+            ttl = self.error_ttl
+        else:
+            ttl = self.ttl
+            max_age = getattr(rfp, "max_age", None)
+            if max_age is not None:
+                ttl = min(ttl, max(max_age, self.min_ttl))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = rfp, time.time() + ttl
+            while len(self._entries) > self.max_hosts:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
 class HTTPRobotRulesProcessor(BaseHandler):
     # before redirections, after everything else
     handler_order = 800
     http_response_class = None
 
-    def __init__(self, rfp_class=MechanizeRobotFileParser):
+    def __init__(self, rfp_class=MechanizeRobotFileParser, cache=None):
         self.rfp_class = rfp_class
-        self.rfp = None
-        self._host = None
+        if cache is None:
+            cache = RobotRulesCache()
+        self.cache = cache
 
     def __copy__(self):
-        return self.__class__(self.rfp_class)
+        # copies share the cache
+        return self.__class__(self.rfp_class, self.cache)
 
-    def http_request(self, request):
+    def _cache_key(self, request):
+        # Return the key of the robots.txt rules that apply to request, or
+        # None if request needn't be checked against robots.txt.
         scheme = request.get_type()
         if scheme not in ["http", "https"]:
             # robots exclusion only applies to HTTP
-            return request
+            return None
 
         if request.get_selector() == "/robots.txt":
             # /robots.txt is always OK to fetch
-            return request
+            return None
 
         host = request.get_host()
 
@@ -162,22 +293,36 @@ class HTTPRobotRulesProcessor(BaseHandler):
         if (origin_req is not None and
                 origin_req.get_selector() == "/robots.txt" and
                 origin_req.get_host() == host):
+            return None
+
+        return scheme, host
+
+    def _parser(self, key, timeout):
+        # Return a new parser for the robots.txt rules with cache key key.
+        scheme, host = key
+        rfp = self.rfp_class()
+        try:
+            rfp.set_opener(self.parent)
+        except AttributeError:
+            debug("%r instance does not support set_opener" %
+                  rfp.__class__)
+        rfp.set_url(scheme + "://" + host + "/robots.txt")
+        rfp.set_timeout(timeout)
+        return rfp
+
+    def http_request(self, request):
+        key = self._cache_key(request)
+        if key is None:
             return request
 
-        if host != self._host:
-            self.rfp = self.rfp_class()
-            try:
-                self.rfp.set_opener(self.parent)
-            except AttributeError:
-                debug("%r instance does not support set_opener" %
-                      self.rfp.__class__)
-            self.rfp.set_url(scheme + "://" + host + "/robots.txt")
-            self.rfp.set_timeout(request.timeout)
-            self.rfp.read()
-            self._host = host
+        rfp = self.cache.get(key)
+        if rfp is None:
+            rfp = self._parser(key, request.timeout)
+            rfp.read()
+            self.cache.put(key, rfp)
 
         ua = request.get_header("User-agent", "")
-        if self.rfp.can_fetch(ua, request.get_full_url()):
+        if rfp.can_fetch(ua, request.get_full_url()):
             return request
         else:
             # XXX This should really have raised URLError.  Too late now...
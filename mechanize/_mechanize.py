@@ -13,6 +13,8 @@ from __future__ import absolute_import
 import copy
 import os
 import re
+import tempfile
+from io import BytesIO
 
 from . import _request, _response, _rfc3986, _sockettimeout, _urllib2_fork
 from ._clientcookie import Cookie
@@ -43,18 +45,108 @@ def sanepathname2url(path):
     return urlpath
 
 
+def cached_body_size(response):
+    # number of bytes of response body held in memory by response's .seek()
+    # cache
+    if isinstance(response, _response.seek_wrapper):
+        return response.cached_bytes_in_memory()
+    return 0
+
+
+class EvictedResponse(object):
+    """Stands in for a History response whose cached body has been evicted.
+
+    If the request sent data (e.g. a form POST), re-fetching it would repeat
+    the submission, so the body is spilled to a temporary file and restored
+    from there instead.  Otherwise the body is dropped, and the restored
+    response is incomplete, so that Browser.back() re-fetches it.
+    """
+
+    def __init__(self, request, response):
+        self._headers = response.info()
+        self._url = response.geturl()
+        self._code = getattr(response, "code", None)
+        self._msg = getattr(response, "msg", None)
+        self._spill = None
+        if request is not None and request.has_data():
+            self._spill = tempfile.TemporaryFile()
+            self._spill.write(response.get_data())
+
+    def restore(self):
+        if self._spill is None:
+            fp = _response.eoffile()
+        else:
+            self._spill.seek(0)
+            fp = BytesIO(self._spill.read())
+        response = _response.response_seek_wrapper(
+            _response.closeable_response(
+                fp, self._headers, self._url, self._code, self._msg))
+        if self._spill is not None:
+            response.get_data()  # mark the response as read completely
+        return response
+
+    def close(self):
+        # History copies share this object: the spill file is deleted when it
+        # is garbage collected
+        pass
+
+
 class History:
     """
 
     Though this will become public, the implied interface is not yet stable.
 
+    :param max_entries: if not None, forget the oldest entries once there are
+        more than this many
+    :param max_bytes: if not None, evict the response bodies of the oldest
+        entries once the bodies cached in memory add up to more than this many
+        bytes.  :meth:`Browser.back()` re-fetches evicted responses, except
+        those to requests that sent data, whose bodies are kept in temporary
+        files instead.
+
     """
 
-    def __init__(self):
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
         self._history = []  # LIFO
+        self._sizes = []  # cached body bytes of each entry
+        self._cached_bytes = 0
+        # entries before this index have had their bodies evicted
+        self._first_cached = 0
 
     def add(self, request, response):
+        size = cached_body_size(response)
         self._history.append((request, response))
+        self._sizes.append(size)
+        self._cached_bytes += size
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        if self.max_entries is not None:
+            excess = len(self._history) - self.max_entries
+            if excess > 0:
+                for request, response in self._history[:excess]:
+                    if response is not None:
+                        response.close()
+                self._cached_bytes -= sum(self._sizes[:excess])
+                del self._history[:excess]
+                del self._sizes[:excess]
+                self._first_cached = max(self._first_cached - excess, 0)
+        if self.max_bytes is not None:
+            while (self._cached_bytes > self.max_bytes and
+                   self._first_cached < len(self._history)):
+                self._evict(self._first_cached)
+                self._first_cached += 1
+
+    def _evict(self, index):
+        size = self._sizes[index]
+        if size:
+            request, response = self._history[index]
+            self._history[index] = request, EvictedResponse(request, response)
+            response.close()
+            self._sizes[index] = 0
+            self._cached_bytes -= size
 
     def back(self, n, _response):
         response = _response  # XXX move Browser._response into this class?
@@ -63,21 +155,30 @@ class History:
                 request, response = self._history.pop()
             except IndexError:
                 raise BrowserStateError("already at start of history")
+            self._cached_bytes -= self._sizes.pop()
             n -= 1
+        self._first_cached = min(self._first_cached, len(self._history))
+        if isinstance(response, EvictedResponse):
+            response = response.restore()
         return request, response
 
     def clear(self):
         del self._history[:]
+        del self._sizes[:]
+        self._cached_bytes = self._first_cached = 0
 
     def close(self):
         for request, response in self._history:
             if response is not None:
                 response.close()
-        del self._history[:]
+        self.clear()
 
     def __copy__(self):
-        ans = self.__class__()
+        ans = self.__class__(self.max_entries, self.max_bytes)
         ans._history = self._history[:]
+        ans._sizes = self._sizes[:]
+        ans._cached_bytes = self._cached_bytes
+        ans._first_cached = self._first_cached
         return ans
 
 
@@ -174,7 +275,7 @@ class Browser(UserAgentBase):
         self._copy_state(ans)
         ans._handle_referer = self._handle_referer
         for attr in ('_response_type_finder', '_encoding_finder',
-                     '_content_parser'):
+                     '_content_parser', '_parse_cache', '_stream_links'):
             setattr(ans._factory, attr, getattr(self._factory, attr))
         ans.request_class = self.request_class
         ans._history = copy.copy(self._history)
@@ -262,25 +363,8 @@ class Browser(UserAgentBase):
                    update_history=True,
                    visit=None,
                    timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
-        try:
-            url.get_full_url
-        except AttributeError:
-            # string URL -- convert to absolute URL if required
-            scheme, authority = _rfc3986.urlsplit(url)[:2]
-            if scheme is None:
-                # relative URL
-                if self._response is None:
-                    raise BrowserStateError("can't fetch relative reference: "
-                                            "not viewing any document")
-                url = _rfc3986.urljoin(self._response.geturl(), url)
-
-        request = self._request(url, data, visit, timeout)
-        visit = request.visit
-        if visit is None:
-            visit = True
-
-        if visit:
-            self._visit_request(request, update_history)
+        request, visit = self._mech_request(
+            url, data, update_history, visit, timeout)
 
         success = True
         try:
@@ -303,11 +387,42 @@ class Browser(UserAgentBase):
 #             acceptable.
 #             raise
 
+        return self._mech_response(response, visit, success)
+
+    def _mech_request(self, url, data, update_history, visit, timeout):
+        # Return the request to open for ._mech_open() and whether it is
+        # visited, after visiting it.
+        try:
+            url.get_full_url
+        except AttributeError:
+            # string URL -- convert to absolute URL if required
+            scheme, authority = _rfc3986.urlsplit(url)[:2]
+            if scheme is None:
+                # relative URL
+                if self._response is None:
+                    raise BrowserStateError("can't fetch relative reference: "
+                                            "not viewing any document")
+                url = _rfc3986.urljoin(self._response.geturl(), url)
+
+        request = self._request(url, data, visit, timeout)
+        visit = request.visit
+        if visit is None:
+            visit = True
+
+        if visit:
+            self._visit_request(request, update_history)
+        return request, visit
+
+    def _mech_response(self, response, visit, success):
+        # Return the response to an open() of a request prepared by
+        # ._mech_request(), which failed with HTTPError response if not
+        # success, or raise it.
         if visit:
             self._set_response(response, False)
             response = copy.copy(self._response)
         elif response is not None:
-            response = _response.upgrade_response(response)
+            response = _response.upgrade_response(
+                response, self._spool_threshold)
 
         if not success:
             raise response
@@ -357,7 +472,8 @@ class Browser(UserAgentBase):
 
         self.form = None
         if response is not None:
-            response = _response.upgrade_response(response)
+            response = _response.upgrade_response(
+                response, self._spool_threshold)
         if close_current and self._response is not None:
             self._response.close()
         self._response = response
@@ -393,6 +509,22 @@ class Browser(UserAgentBase):
         response = make_response(html, [("Content-type", "text/html")], url)
         self._set_response(response, True)
 
+    def set_parse_cache(self, cache):
+        """Set a mechanize.ParseCache of parsed documents, or None.
+
+        See :meth:`mechanize.Factory.set_parse_cache()`.  Copies of this
+        browser share the cache.
+        """
+        self._factory.set_parse_cache(cache)
+
+    def set_stream_links(self, handle):
+        """Set whether to find links without parsing the whole document.
+
+        See :meth:`mechanize.Factory.set_stream_links()`.  Useful when
+        crawling, where links are often all that is needed from a page.
+        """
+        self._factory.set_stream_links(handle)
+
     def geturl(self):
         """Get URL of current document."""
         if self._response is None:
@@ -521,11 +653,10 @@ class Browser(UserAgentBase):
         """Return iterable over links (:class:`mechanize.Link` objects)."""
         if not self.viewing_html():
             raise BrowserStateError("not viewing HTML")
-        links = self._factory.links()
         if kwds:
-            return self._filter_links(links, **kwds)
+            return self._filter_links(self._factory.iterlinks(), **kwds)
         else:
-            return links
+            return self._factory.links()
 
     def forms(self):
         """Return iterable over forms.
@@ -630,11 +761,11 @@ class Browser(UserAgentBase):
             raise ValueError(
                 "at least one argument must be supplied to specify form")
 
-        global_form = self._factory.global_form
-        if nr is None and name is None and predicate is not None and predicate(
-                global_form):
-            self.form = global_form
-            return
+        if nr is None and name is None and predicate is not None:
+            global_form = self._factory.global_form
+            if predicate(global_form):
+                self.form = global_form
+                return
 
         def attr_selector(q):
             if is_string(q):
@@ -653,7 +784,7 @@ class Browser(UserAgentBase):
             return True
 
         orig_nr = nr
-        for form in self.forms():
+        for form in self._factory.iterforms():
             if name is not None and name != form.name:
                 continue
             if predicate is not None and not predicate(form):
@@ -784,8 +915,8 @@ class Browser(UserAgentBase):
         """
         try:
             return next(self._filter_links(
-                self._factory.links(), text, text_regex, name, name_regex, url,
-                url_regex, tag, predicate, nr))
+                self._factory.iterlinks(), text, text_regex, name, name_regex,
+                url, url_regex, tag, predicate, nr))
         except StopIteration:
             raise LinkNotFoundError()
 
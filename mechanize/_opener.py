@@ -11,7 +11,11 @@ LICENSE included with the distribution).
 from __future__ import absolute_import
 
 import bisect
+import collections
+import copy
+import errno
 import os
+import re
 import tempfile
 import threading
 
@@ -21,12 +25,18 @@ from . import _sockettimeout
 from . import _urllib2_fork
 from ._request import Request
 from ._util import isstringlike
-from .polyglot import HTTPError, URLError, iteritems, is_class
+from .polyglot import (HTTPError, HTTPException, URLError, iteritems,
+                       is_class, perf_counter)
 
 
 open_file = open
 
 
+RETRYABLE_ERRORS = (EnvironmentError, HTTPException, URLError)
+content_range_re = re.compile(
+    r"\s*bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)\s*$", re.I)
+
+
 class ContentTooShortError(URLError):
 
     def __init__(self, reason, result):
@@ -43,6 +53,172 @@ def set_request_attr(req, name, value, default):
         setattr(req, name, value)
 
 
+def parse_content_range(value):
+    """Return (first, last, length) given a Content-Range header value.
+
+    first and last are None for an unsatisfied range, length is None if not
+    known.  Returns None if value is not a valid byte range.
+
+    >>> parse_content_range("bytes 0-99/1000")
+    (0, 99, 1000)
+    >>> parse_content_range("bytes */1000")
+    (None, None, 1000)
+    >>> print(parse_content_range("bytes 10-9/*"))
+    None
+
+    """
+    mo = content_range_re.match(value or "")
+    if mo is None:
+        return None
+    first, last, length = [
+        None if g in (None, "*") else int(g) for g in mo.groups()]
+    if first is not None and (
+            last < first or length is not None and last >= length):
+        return None
+    return first, last, length
+
+
+def kernel_copy(in_fd, out_fd, offset, chunk_size):
+    """Copy in_fd from offset to its end to out_fd, inside the kernel.
+
+    This is a generator yielding the number of bytes copied by each system
+    call.  Raises OSError before yielding anything if neither
+    os.copy_file_range() nor os.sendfile() can copy between these files.
+    """
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(lambda count, offset: os.copy_file_range(
+            in_fd, out_fd, count, offset))
+    if hasattr(os, "sendfile"):
+        methods.append(lambda count, offset: os.sendfile(
+            out_fd, in_fd, offset, count))
+    error = OSError(errno.ENOSYS, "no kernel copy of files")
+    if os.fstat(in_fd).st_size <= offset:
+        # nothing to copy, or a file like those in /proc that does not
+        # report its size
+        methods = []
+    for method in methods:
+        try:
+            nr_copied = method(chunk_size, offset)
+        except OSError as err:
+            error = err
+            continue
+        if not nr_copied:
+            # unsupported by this file system
+            continue
+        while nr_copied:
+            yield nr_copied
+            offset += nr_copied
+            nr_copied = method(chunk_size, offset)
+        return
+    raise error
+
+
+def range_validator(headers):
+    # the If-Range value for a resource: a strong entity tag if there is one
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
+def range_request(req, first, last=None, validator=None):
+    # a copy of GET request req, asking for bytes first to last only
+    new = Request(req.get_full_url(), headers=req.headers,
+                  origin_req_host=req.get_origin_req_host(),
+                  unverifiable=req.is_unverifiable(), visit=False,
+                  timeout=req.timeout)
+    new.add_header("Range", "bytes=%d-%s" % (
+        first, "" if last is None else last))
+    if validator:
+        new.add_header("If-Range", validator)
+    return new
+
+
+class HandlerTimings(object):
+    """Collects wall-clock time spent in handler methods and network phases.
+
+    Pass an instance to OpenerDirector.set_instrumentation().  Each sample is
+    recorded under a name like "HTTPCookieProcessor.http_request" or
+    "HTTPHandler.http_open"; the HTTP handlers additionally record the network
+    phases "network.connect", "network.send" and "network.wait" (time until
+    the response headers arrive).  Times are inclusive: a redirect followed
+    from HTTPRedirectHandler.http_error_302 counts towards that method too.
+
+    Any object with a .record(name, seconds) method may be used in place of
+    this class.
+
+    >>> timings = HandlerTimings()
+    >>> for seconds in 0.1, 0.2, 0.3:
+    ...     timings.record("HTTPEquivProcessor.http_response", seconds)
+    >>> stats = timings.stats()["HTTPEquivProcessor.http_response"]
+    >>> stats["count"], round(stats["total"], 6), stats["p50"], stats["p99"]
+    (3, 0.6, 0.2, 0.3)
+
+    """
+
+    def __init__(self, max_samples=10000):
+        """max_samples: number of most recent samples kept per name for the
+        percentiles (count and total always cover every sample)"""
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+        self._samples = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = collections.deque(
+                    maxlen=self.max_samples)
+                self._counts[name] = 0
+                self._totals[name] = 0.0
+            samples.append(seconds)
+            self._counts[name] += 1
+            self._totals[name] += seconds
+
+    def stats(self):
+        """Return a dict mapping name to a dict of aggregates.
+
+        The aggregates are "count", "total", "p50" and "p99", all but the first
+        in seconds.
+        """
+        with self._lock:
+            snapshot = [(name, self._counts[name], self._totals[name],
+                         sorted(samples))
+                        for name, samples in iteritems(self._samples)]
+        ans = {}
+        for name, count, total, samples in snapshot:
+            ans[name] = {
+                "count": count, "total": total,
+                "p50": percentile(samples, 50),
+                "p99": percentile(samples, 99)}
+        return ans
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._totals.clear()
+            self._samples.clear()
+
+
+def percentile(sorted_samples, pc):
+    # nearest-rank method
+    rank = max(int(-(-len(sorted_samples) * pc // 100)), 1)
+    return sorted_samples[rank - 1]
+
+
+def timed_call(instrumentation, handler, meth_name, meth, *args):
+    start = perf_counter()
+    try:
+        return meth(*args)
+    finally:
+        instrumentation.record(
+            "%s.%s" % (handler.__class__.__name__, meth_name),
+            perf_counter() - start)
+
+
 class OpenerDirector(_urllib2_fork.OpenerDirector):
 
     def __init__(self):
@@ -54,7 +230,29 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         self._any_request = {}
         self._any_response = {}
         self._handler_index_valid = True
+        self._processor_chains = {}
         self._tempfiles = []
+        self._instrumentation = None
+        # (url, filename) --> If-Range value, for resumed retrievals
+        self._validators = {}
+
+    def set_instrumentation(self, instrumentation):
+        """Record the time taken by each handler method on every request.
+
+        instrumentation: a HandlerTimings instance (or any object with a
+         .record(name, seconds) method), or None to switch recording off
+        """
+        self._instrumentation = instrumentation
+
+    def handler_timings(self):
+        """Return aggregate timings collected so far.
+
+        See HandlerTimings.stats().  Returns an empty dict if instrumentation
+        is not enabled.
+        """
+        if self._instrumentation is None:
+            return {}
+        return self._instrumentation.stats()
 
     def add_handler(self, handler):
         if not hasattr(handler, "add_parent"):
@@ -151,6 +349,33 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         self.process_response = process_response
         self._any_request = any_request
         self._any_response = any_response
+        self._processor_chains = {}
+        self._handler_index_valid = True
+
+    def _processor_chain(self, scheme, phase):
+        # Return a tuple of (processor, method name, bound method) to call, in
+        # order, for phase "request" or "response" of a request with URL
+        # scheme.  Compiled once per scheme and cached until the handlers
+        # change.
+        key = scheme, phase
+        try:
+            return self._processor_chains[key]
+        except KeyError:
+            pass
+        if phase == "request":
+            processors = set(self.process_request.get(scheme, []))
+            processors.update(self._any_request)
+        else:
+            processors = set(self.process_response.get(scheme, []))
+            processors.update(self._any_response)
+        chain = []
+        for processor in sorted(processors):
+            for meth_name in ["any_" + phase, scheme + "_" + phase]:
+                meth = getattr(processor, meth_name, None)
+                if meth:
+                    chain.append((processor, meth_name, meth))
+        chain = self._processor_chains[key] = tuple(chain)
+        return chain
 
     def _request(self, url_or_req, data, visit,
                  timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
@@ -173,19 +398,18 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         req_scheme = req.get_type()
 
         self._maybe_reindex_handlers()
+        instrumentation = self._instrumentation
 
         # pre-process request
         # XXX should we allow a Processor to change the URL scheme
         #   of the request?
-        request_processors = set(self.process_request.get(req_scheme, []))
-        request_processors.update(self._any_request)
-        request_processors = list(request_processors)
-        request_processors.sort()
-        for processor in request_processors:
-            for meth_name in ["any_request", req_scheme + "_request"]:
-                meth = getattr(processor, meth_name, None)
-                if meth:
-                    req = meth(req)
+        for processor, meth_name, meth in self._processor_chain(
+                req_scheme, "request"):
+            if instrumentation is None:
+                req = meth(req)
+            else:
+                req = timed_call(instrumentation, processor, meth_name, meth,
+                                 req)
 
         # In Python >= 2.4, .open() supports processors already, so we must
         # call ._open() instead.
@@ -193,18 +417,27 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         response = urlopen(self, req, data)
 
         # post-process response
-        response_processors = set(self.process_response.get(req_scheme, []))
-        response_processors.update(self._any_response)
-        response_processors = list(response_processors)
-        response_processors.sort()
-        for processor in response_processors:
-            for meth_name in ["any_response", req_scheme + "_response"]:
-                meth = getattr(processor, meth_name, None)
-                if meth:
-                    response = meth(req, response)
+        for processor, meth_name, meth in self._processor_chain(
+                req_scheme, "response"):
+            if instrumentation is None:
+                response = meth(req, response)
+            else:
+                response = timed_call(instrumentation, processor, meth_name,
+                                      meth, req, response)
 
         return response
 
+    def _call_chain(self, chain, kind, meth_name, *args):
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            return _urllib2_fork.OpenerDirector._call_chain(
+                self, chain, kind, meth_name, *args)
+        for handler in chain.get(kind, ()):
+            result = timed_call(instrumentation, handler, meth_name,
+                                getattr(handler, meth_name), *args)
+            if result is not None:
+                return result
+
     def error(self, proto, *args):
         if proto in ['http', 'https']:
             # XXX http[s] protocols are special-cased
@@ -227,11 +460,15 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
             args = (dict, 'default', 'http_error_default') + orig_args
             return self._call_chain(*args)
 
-    BLOCK_SIZE = 1024 * 8
+    BLOCK_SIZE = 1024 * 256
+    # ranged retrieve(): the smallest byte range worth a connection of its
+    # own, and how many times the fetch of a range is resumed after a failure
+    MIN_RANGE_SIZE = 1024 * 1024
+    RANGE_RETRIES = 3
 
     def retrieve(self, fullurl, filename=None, reporthook=None, data=None,
                  timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT,
-                 open=open_file):
+                 open=open_file, resume=False, connections=1):
         """Returns (filename, headers).
 
         For remote objects, the default filename will refer to a temporary
@@ -246,10 +483,53 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
         subclass).  The exception's .result attribute contains the (filename,
         headers) that would have been returned.
 
+        If resume is true and filename names an existing, non-empty file,
+        only the rest of an HTTP resource is requested (with a Range header)
+        and appended to the file.  If the start of the file was retrieved by
+        this opener, also with resume true, an If-Range header ensures that
+        the resource has not changed since.  If the server sends the whole
+        resource instead, the file is rewritten from the start.
+
+        If connections is greater than 1, a large HTTP resource is fetched
+        as that many byte ranges at once, over separate connections, each
+        written into place in a preallocated file.  The fetch of a range that
+        fails part way is resumed where it stopped.  This needs os.pwrite()
+        and a server that supports byte ranges: otherwise the resource is
+        fetched over one connection as usual.  reporthook may be called from
+        other threads in this mode.
+
+        When a Range header was sent, the returned headers are adjusted to
+        describe the whole resource.
+
         """
         req = self._request(fullurl, data, False, timeout)
         scheme = req.get_type()
-        fp = self.open(req)
+        ranged = (scheme in ("http", "https") and req.get_method() == "GET"
+                  and not req.has_header("Range"))
+        key = req.get_full_url(), filename
+        offset = 0
+        if ranged and resume and filename:
+            try:
+                offset = os.path.getsize(filename)
+            except OSError:
+                pass
+        if offset:
+            req = range_request(req, offset,
+                                validator=self._validators.get(key))
+        elif ranged and connections > 1 and hasattr(os, "pwrite"):
+            req = range_request(req, 0)
+        else:
+            ranged = ranged and resume
+        try:
+            fp = self.open(req)
+        except HTTPError as error:
+            if (offset and error.code == 416 and parse_content_range(
+                    error.info().get("content-range")) == (None, None, offset)):
+                # the file is complete already
+                error.close()
+                self._validators.pop(key, None)
+                return filename, error.info()
+            raise
         try:
             headers = fp.info()
             if filename is None and scheme == 'file':
@@ -257,8 +537,23 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
                 #   pending sanity :-/
                 return None, headers
                 # return urllib.url2pathname(req.get_selector()), headers
+            crange = None
+            if ranged and fp.code == 206:
+                crange = parse_content_range(headers.get("content-range"))
+                if crange is None or crange[0] != offset:
+                    raise URLError("unexpected Content-Range: %r" %
+                                   headers.get("content-range"))
+                if crange[2] is not None:
+                    del headers["content-range"]
+                    del headers["content-length"]
+                    headers["Content-Length"] = str(crange[2])
+            else:
+                # the whole resource was sent
+                offset = 0
+            if ranged and resume and filename:
+                self._validators[key] = range_validator(headers)
             if filename:
-                tfp = open(filename, 'wb')
+                tfp = open(filename, 'ab' if offset else 'wb')
             else:
                 path = _rfc3986.urlsplit(req.get_full_url())[2]
                 suffix = os.path.splitext(path)[1]
@@ -269,21 +564,20 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
                 result = filename, headers
                 bs = self.BLOCK_SIZE
                 size = -1
-                read = 0
-                blocknum = 0
+                read = offset
+                blocknum = offset // bs
+                if (reporthook or ranged) and "content-length" in headers:
+                    size = int(headers["content-length"])
                 if reporthook:
-                    if "content-length" in headers:
-                        size = int(headers["content-length"])
                     reporthook(blocknum, bs, size)
-                while 1:
-                    block = fp.read(bs)
-                    if not block:
-                        break
-                    read += len(block)
-                    tfp.write(block)
-                    blocknum += 1
-                    if reporthook:
-                        reporthook(blocknum, bs, size)
+                if (crange is not None and connections > 1 and
+                        size >= 2 * self.MIN_RANGE_SIZE):
+                    self._retrieve_ranges(req, fp, tfp, size, connections,
+                                          reporthook, result)
+                    read = size
+                else:
+                    read += self._copy_body(fp, tfp, bs, blocknum, size,
+                                            reporthook)
             finally:
                 tfp.close()
         finally:
@@ -297,8 +591,136 @@ class OpenerDirector(_urllib2_fork.OpenerDirector):
                 result
             )
 
+        if ranged:
+            self._validators.pop(key, None)
         return result
 
+    def _copy_body(self, fp, tfp, bs, blocknum, size, reporthook):
+        # Copy the rest of response fp to file tfp, returning the number of
+        # bytes copied.  Local files are copied by the kernel if possible,
+        # anything else through a single reused buffer if fp supports
+        # .readinto().
+        read = 0
+        src = _response.regular_file_of(fp)
+        dst_fileno = getattr(tfp, "fileno", None)
+        if src is not None and dst_fileno is not None:
+            try:
+                for nr_copied in kernel_copy(src.fileno(), dst_fileno(),
+                                             src.tell(), bs):
+                    read += nr_copied
+                    blocknum += 1
+                    if reporthook:
+                        reporthook(blocknum, bs, size)
+                return read
+            except OSError:
+                if read:
+                    raise
+        readinto = getattr(fp, "readinto", None)
+        if readinto is not None:
+            buf = bytearray(bs)
+            view = memoryview(buf)
+        while 1:
+            if readinto is not None:
+                nr_read = readinto(buf)
+                block = view[:nr_read]
+            else:
+                block = fp.read(bs)
+                nr_read = len(block)
+            if not nr_read:
+                break
+            read += nr_read
+            tfp.write(block)
+            blocknum += 1
+            if reporthook:
+                reporthook(blocknum, bs, size)
+        return read
+
+    def _retrieve_ranges(self, req, fp, tfp, size, connections, reporthook,
+                         result):
+        # Fetch bytes 0 to size - 1 of the resource as several ranges at
+        # once, the first from fp, which was opened with "Range: bytes=0-".
+        from concurrent.futures import ThreadPoolExecutor
+        fd = tfp.fileno()
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        nr_ranges = min(connections, size // self.MIN_RANGE_SIZE)
+        range_size = -(-size // nr_ranges)
+        bounds = [(first, min(first + range_size, size))
+                  for first in range(0, size, range_size)]
+        validator = range_validator(fp.info())
+        bs = self.BLOCK_SIZE
+        lock = threading.Lock()
+        failed = threading.Event()
+        blocknums = [0]
+
+        def fetch(opener, first, end, response):
+            pos = first
+            failures = 0
+            try:
+                while pos < end and not failed.is_set():
+                    if response is None:
+                        try:
+                            response = opener.open(range_request(
+                                req, pos, end - 1, validator))
+                        except RETRYABLE_ERRORS:
+                            failures += 1
+                            if failures > self.RANGE_RETRIES:
+                                raise
+                            continue
+                        crange = parse_content_range(
+                            response.info().get("content-range"))
+                        if (response.code != 206 or crange is None or
+                                crange[0] != pos):
+                            response.close()
+                            raise URLError(
+                                "server did not send bytes %i-%i" %
+                                (pos, end - 1))
+                    try:
+                        block = response.read(min(bs, end - pos))
+                    except RETRYABLE_ERRORS:
+                        block = None
+                    if not block:
+                        # connection failed or body too short: ask again for
+                        # the rest of the range
+                        response.close()
+                        response = None
+                        failures += 1
+                        if failures > self.RANGE_RETRIES:
+                            raise ContentTooShortError(
+                                "retrieval incomplete: got only %i of bytes "
+                                "%i-%i" % (pos - first, first, end - 1),
+                                result)
+                        continue
+                    view = memoryview(block)
+                    while view:
+                        nr_written = os.pwrite(fd, view, pos)
+                        view = view[nr_written:]
+                        pos += nr_written
+                    if reporthook:
+                        with lock:
+                            blocknums[0] += 1
+                            reporthook(blocknums[0], bs, size)
+            except BaseException:
+                failed.set()
+                raise
+            finally:
+                if response is not None:
+                    response.close()
+
+        def clone():
+            # copies (of a UserAgent, say) may be used from other threads
+            return copy.copy(self) if hasattr(self, "__copy__") else self
+
+        with ThreadPoolExecutor(len(bounds) - 1) as executor:
+            futures = [executor.submit(fetch, clone(), first, end, None)
+                       for first, end in bounds[1:]]
+            first, end = bounds[0]
+            fetch(self, first, end, fp)
+            for future in futures:
+                future.result()
+
     def close(self):
         _urllib2_fork.OpenerDirector.close(self)
 
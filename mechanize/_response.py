@@ -19,6 +19,9 @@ included with the distribution).
 from __future__ import absolute_import
 from functools import partial
 import copy
+import os
+import stat
+import tempfile
 from io import BytesIO
 
 from ._headersutil import normalize_header_name
@@ -63,6 +66,11 @@ class seek_wrapper:
 
     wrapped: the wrapped file object
     is_closed: true iff .close() has been called
+    spool_threshold: if not None, the cache of data read so far is moved from
+     memory to a temporary file once it grows beyond this many bytes.  Pass
+     spool_threshold to the constructor to set it for one wrapper (see also
+     UserAgentBase.set_spool_threshold()); the class attribute is the
+     default for wrappers constructed without it
 
     WARNING: All other attributes of the wrapped object (ie. those that are not
     one of wrapped, read, readline, readlines, xreadlines, __iter__ and next)
@@ -77,19 +85,74 @@ class seek_wrapper:
     # that a single cache may be shared between multiple seek_wrapper objects.
     # Copying using module copy shares the cache in this way.
 
-    def __init__(self, wrapped):
+    spool_threshold = None
+    # size of blocks copied from the wrapped file when caching all of it and
+    # spooling is on
+    SPOOL_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, wrapped, spool_threshold=None):
         self.wrapped = wrapped
+        if spool_threshold is not None:
+            self.spool_threshold = spool_threshold
         self.__read_complete_state = [False]
         self.__is_closed_state = [False]
         self.__have_readline = hasattr(self.wrapped, "readline")
-        self.__cache = BytesIO()
+        self.__reset_cache()
         self.__pos = 0  # seek position
 
+    def _make_cache(self):
+        if self.spool_threshold is None:
+            return BytesIO()
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+
+    def __reset_cache(self):
+        self.__cache = self._make_cache()
+        # [spool threshold of the cache, whether it has been spooled to disk]
+        self.__spool_state = [self.spool_threshold, False]
+
+    def __write(self, data):
+        # append data to the cache, which must be positioned at its end
+        cache = self.__cache
+        cache.write(data)
+        threshold = self.__spool_state[0]
+        if threshold is not None and cache.tell() > threshold:
+            # SpooledTemporaryFile has rolled over to a temporary file
+            self.__spool_state[1] = True
+
+    def _set_cache_data(self, data):
+        # replace the cache with one holding just data
+        self.__reset_cache()
+        self.__write(data)
+
+    def cached_bytes_in_memory(self):
+        """Return the number of bytes read so far that are cached in memory.
+
+        That is zero once the cache has been spooled to a temporary file (see
+        spool_threshold).
+        """
+        if self.__spool_state[1]:
+            return 0
+        return len_of_seekable(self.__cache)
+
+    def __cache_rest(self):
+        # append everything left in the wrapped file to the cache
+        self.__cache.seek(0, 2)
+        if self.spool_threshold is None:
+            self.__write(self.wrapped.read())
+        else:
+            # don't hold the whole of the rest of the file in memory
+            while True:
+                data = self.wrapped.read(self.SPOOL_BLOCK_SIZE)
+                if not data:
+                    break
+                self.__write(data)
+        self.read_complete = True
+
     def invariant(self):
         # The end of the cache is always at the same place as the end of the
         # wrapped file (though the .tell() method is not required to be present
         # on wrapped file).
-        return self.wrapped.tell() == len(self.__cache.getvalue())
+        return self.wrapped.tell() == len_of_seekable(self.__cache)
 
     def close(self):
         self.wrapped.close()
@@ -142,18 +205,17 @@ class seek_wrapper:
                 to_read = 0
 
         if to_read != 0:
-            self.__cache.seek(0, 2)
             if to_read is None:
                 assert whence == 2
-                self.__cache.write(self.wrapped.read())
-                self.read_complete = True
+                self.__cache_rest()
                 self.__pos = self.__cache.tell() - offset
             else:
+                self.__cache.seek(0, 2)
                 data = self.wrapped.read(to_read)
                 if not data:
                     self.read_complete = True
                 else:
-                    self.__cache.write(data)
+                    self.__write(data)
                 # Don't raise an exception even if we've seek()ed past the end
                 # of .wrapped, since fseek() doesn't complain in that case.
                 # Also like fseek(), pretend we have seek()ed past the end,
@@ -170,6 +232,7 @@ class seek_wrapper:
     def __copy__(self):
         cpy = self.__class__(self.wrapped)
         cpy.__cache = self.__cache
+        cpy.__spool_state = self.__spool_state
         cpy.__read_complete_state = self.__read_complete_state
         cpy.__is_closed_state = self.__is_closed_state
         return cpy
@@ -194,18 +257,17 @@ class seek_wrapper:
             return self.__cache.read(size)
 
         # no, so read sufficient data from wrapped file and cache it
-        self.__cache.seek(0, 2)
         if size == -1:
-            self.__cache.write(self.wrapped.read())
-            self.read_complete = True
+            self.__cache_rest()
         else:
+            self.__cache.seek(0, 2)
             to_read = size - available
             assert to_read > 0
             data = self.wrapped.read(to_read)
             if not data:
                 self.read_complete = True
             else:
-                self.__cache.write(data)
+                self.__write(data)
         self.__cache.seek(pos)
 
         data = self.__cache.read(size)
@@ -225,7 +287,7 @@ class seek_wrapper:
         if not data:
             self.read_complete = True
         else:
-            self.__cache.write(data)
+            self.__write(data)
         self.__cache.seek(pos)
 
         data = self.__cache.readline()
@@ -239,9 +301,7 @@ class seek_wrapper:
 
     def readlines(self, sizehint=-1):
         pos = self.__pos
-        self.__cache.seek(0, 2)
-        self.__cache.write(self.wrapped.read())
-        self.read_complete = True
+        self.__cache_rest()
         self.__cache.seek(pos)
         data = self.__cache.readlines(sizehint)
         self.__pos = self.__cache.tell()
@@ -270,8 +330,8 @@ class response_seek_wrapper(seek_wrapper):
 
     """
 
-    def __init__(self, wrapped):
-        seek_wrapper.__init__(self, wrapped)
+    def __init__(self, wrapped, spool_threshold=None):
+        seek_wrapper.__init__(self, wrapped, spool_threshold)
         self._headers = self.wrapped.info()
 
     def __copy__(self):
@@ -300,8 +360,7 @@ class response_seek_wrapper(seek_wrapper):
         self.seek(0)
         self.read()
         self.close()
-        cache = self._seek_wrapper__cache = BytesIO()
-        cache.write(data)
+        self._set_cache_data(data)
         self.seek(0)
 
 
@@ -390,6 +449,10 @@ class closeable_response:
             self.fileno = self.fp.fileno
         else:
             self.fileno = lambda: None
+        if hasattr(self.fp, "readinto"):
+            self.readinto = self.fp.readinto
+        else:
+            self.__dict__.pop("readinto", None)
         self.__iter__ = self.fp.__iter__
         self.next = partial(next, self.fp)
 
@@ -433,6 +496,30 @@ class closeable_response:
         self._set_fp(new_wrapped)
 
 
+def regular_file_of(response):
+    """Return the regular file that response reads from, or None.
+
+    The file is only returned if nothing has been read from it through
+    response, so that its data from .tell() onwards is the rest of the
+    response body.
+    """
+    while True:
+        if isinstance(response, seek_wrapper):
+            if len_of_seekable(response._seek_wrapper__cache):
+                return None
+            response = response.wrapped
+        elif isinstance(response, closeable_response):
+            response = response.fp
+        else:
+            break
+    try:
+        if not stat.S_ISREG(os.fstat(response.fileno()).st_mode):
+            return None
+    except (AttributeError, TypeError, ValueError, EnvironmentError):
+        return None
+    return response
+
+
 def test_response(data='test data',
                   headers=(),
                   url=None,
@@ -506,8 +593,8 @@ def get_seek_wrapper_class(response):
 
             _exc_class_name = exc_class_name
 
-            def __init__(self, wrapped):
-                response_seek_wrapper.__init__(self, wrapped)
+            def __init__(self, wrapped, spool_threshold=None):
+                response_seek_wrapper.__init__(self, wrapped, spool_threshold)
                 # be compatible with undocumented HTTPError attributes :-(
                 self.hdrs = wrapped.info()
                 self.filename = wrapped.geturl()
@@ -533,10 +620,11 @@ def needs_seek_wrapper(obj):
             )
 
 
-def seek_wrapped_response(response):
+def seek_wrapped_response(response, spool_threshold=None):
     """Return a copy of response that supports seekable response interface.
 
-    Accepts responses from both mechanize and urllib2 handlers.
+    Accepts responses from both mechanize and urllib2 handlers.  If response
+    needs wrapping, spool_threshold is passed to the seek_wrapper.
 
     Copes with both ordinary response instances and HTTPError instances (which
     can't be simply wrapped due to the requirement of preserving the exception
@@ -544,19 +632,20 @@ def seek_wrapped_response(response):
     """
     if needs_seek_wrapper(response):
         wrapper_class = get_seek_wrapper_class(response)
-        response = wrapper_class(response)
+        response = wrapper_class(response, spool_threshold)
     assert hasattr(response, "get_data")
     return response
 
 
-def upgrade_response(response):
+def upgrade_response(response, spool_threshold=None):
     """Return a copy of response that supports Browser response interface.
 
     Browser response interface is that of "seekable responses"
     (response_seek_wrapper), plus the requirement that responses must be
     useable after .close() (closeable_response).
 
-    Accepts responses from both mechanize and urllib2 handlers.
+    Accepts responses from both mechanize and urllib2 handlers.  If response
+    needs wrapping, spool_threshold is passed to the seek_wrapper.
 
     Copes with both ordinary response instances and HTTPError instances (which
     can't be simply wrapped due to the requirement of preserving the exception
@@ -565,7 +654,7 @@ def upgrade_response(response):
     wrapper_class = get_seek_wrapper_class(response)
     if hasattr(response, "closeable_response"):
         if needs_seek_wrapper(response):
-            response = wrapper_class(response)
+            response = wrapper_class(response, spool_threshold)
         assert hasattr(response, "get_data")
         return copy.copy(response)
 
@@ -590,7 +679,7 @@ def upgrade_response(response):
     response = closeable_response(response.fp,
                                   response.info(), response.geturl(), code,
                                   msg)
-    response = wrapper_class(response)
+    response = wrapper_class(response, spool_threshold)
     if data:
         response.set_data(data)
     return response
@@ -8,7 +8,7 @@ from ._auth import HTTPProxyPasswordMgr, HTTPSClientCertMgr
 from ._debug import HTTPRedirectDebugProcessor, HTTPResponseDebugProcessor
 from ._http import (HTTPEquivProcessor, HTTPRefererProcessor,
                     HTTPRefreshProcessor, HTTPRobotRulesProcessor,
-                    RobotExclusionError)
+                    RobotExclusionError, RobotRulesCache)
 from ._opener import (OpenerDirector, SeekableResponseOpener, build_opener,
                       install_opener, urlopen)
 from ._request import Request
@@ -17,12 +17,13 @@ from ._request import Request
 # HTTPGzipProcessor
 from ._urllib2_fork import (
     AbstractBasicAuthHandler, AbstractDigestAuthHandler, BaseHandler,
-    CacheFTPHandler, FileHandler, FTPHandler, HTTPBasicAuthHandler,
+    CacheFTPHandler, ConnectionPool, FileHandler, FTPHandler, HTTPBasicAuthHandler,
     HTTPCookieProcessor, HTTPDefaultErrorHandler, HTTPDigestAuthHandler,
     HTTPErrorProcessor, HTTPHandler, HTTPPasswordMgr,
-    HTTPPasswordMgrWithDefaultRealm, HTTPRedirectHandler, HTTPSHandler,
+    HTTPPasswordMgrWithDefaultRealm, HTTPPasswordMgrWithPriorAuth,
+    HTTPRedirectHandler, HTTPSHandler,
     ProxyBasicAuthHandler, ProxyDigestAuthHandler, ProxyHandler,
-    UnknownHandler)
+    RedirectCache, UnknownHandler)
 __all__ = [
     'URLError',
     'HTTPError',
@@ -34,7 +35,9 @@ __all__ = [
     'HTTPRefreshProcessor',
     'HTTPRefererProcessor',
     'HTTPEquivProcessor',
+    'RedirectCache',
     'RobotExclusionError',
+    'RobotRulesCache',
     'OpenerDirector',
     'build_opener',
     'SeekableResponseOpener',
@@ -50,7 +53,9 @@ __all__ = [
     'HTTPDigestAuthHandler',
     'FTPHandler',
     'HTTPPasswordMgrWithDefaultRealm',
+    'HTTPPasswordMgrWithPriorAuth',
     'CacheFTPHandler',
+    'ConnectionPool',
     'HTTPErrorProcessor',
     'AbstractDigestAuthHandler',
     'HTTPRedirectHandler',
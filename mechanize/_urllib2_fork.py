@@ -39,25 +39,28 @@ import os
 import platform
 import posixpath
 import re
+import select
 import socket
 import sys
+import threading
 import time
 from collections import OrderedDict
 from functools import partial
 from io import BufferedReader, BytesIO
 
-from . import _rfc3986
+from . import _rfc3986, _sockettimeout
 from ._clientcookie import CookieJar
 from ._headersutil import normalize_header_name
-from ._response import closeable_response
-from .polyglot import (HTTPConnection, HTTPError, HTTPSConnection, URLError,
-                       as_unicode, create_response_info, ftpwrapper,
-                       getproxies, is_class, is_mapping, is_py2, is_string,
-                       iteritems, map, raise_with_traceback, splitattr,
+from ._response import closeable_response, make_headers
+from .polyglot import (HTTPConnection, HTTPError, HTTPException,
+                       HTTPSConnection, URLError, as_unicode,
+                       create_response_info, ftpwrapper, getproxies, is_class,
+                       is_mapping, is_py2, is_string, iteritems, map,
+                       perf_counter, raise_with_traceback, splitattr,
                        splitpasswd, splitport, splittype, splituser,
-                       splitvalue, unquote, unwrap, url2pathname,
-                       urllib_proxy_bypass, urllib_splithost, urlparse,
-                       urlsplit, urlunparse)
+                       splitvalue, unquote,
+                       unwrap, url2pathname, urllib_proxy_bypass,
+                       urllib_splithost, urlparse, urlsplit, urlunparse)
 
 
 def sha1_digest(data):
@@ -564,7 +567,63 @@ class HTTPDefaultErrorHandler(BaseHandler):
         raise response
 
 
+class RedirectCache(object):
+    """Least-recently-used cache of permanent (301 and 308) redirects, keyed
+    on URL.
+
+    Redirects are kept for at most ttl seconds, less if the redirect
+    response's caching headers say so.  Redirects whose caching headers
+    forbid caching are not kept at all.
+
+    One instance may be shared between several HTTPRedirectHandler instances
+    (e.g. those of copied Browsers): it is thread-safe.
+    """
+
+    def __init__(self, max_entries=1000, ttl=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, url):
+        """Return (code, newurl) for a cached redirect from url, or None."""
+        with self._lock:
+            try:
+                code, newurl, expires = self._entries.pop(url)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                return None
+            # re-insert as most recently used
+            self._entries[url] = code, newurl, expires
+            return code, newurl
+
+    def put(self, url, code, newurl, max_age=None):
+        """Cache a redirect from url to newurl, with status code."""
+        ttl = self.ttl
+        if max_age is not None:
+            ttl = min(ttl, max_age)
+        with self._lock:
+            self._entries.pop(url, None)
+            if ttl <= 0:
+                return
+            self._entries[url] = code, newurl, time.time() + ttl
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
 class HTTPRedirectHandler(BaseHandler):
+    # before HTTPHandler, so that http_open can answer from the cache
+    handler_order = 400
+
     # maximum number of redirections to any single URL
     # this is needed because of the state that cookies introduce
     max_repeats = 4
@@ -589,6 +648,35 @@ class HTTPRedirectHandler(BaseHandler):
     # 305 Use Proxy: probably not worth dealing with here
     # 306 Unused: what was this for in the previous versions of protocol??
 
+    # If a RedirectCache is given, permanent redirects of GET and HEAD
+    # requests are remembered there, and later requests for the same URL are
+    # answered with the cached redirect without contacting the server.
+
+    cacheable_codes = (301, 308)
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def __copy__(self):
+        # copies share the cache
+        return self.__class__(self.cache)
+
+    def http_open(self, req):
+        if self.cache is None or req.get_method() not in ("GET", "HEAD"):
+            return None
+        hit = self.cache.get(req.get_full_url())
+        if hit is None:
+            return None
+        code, newurl = hit
+        msg = {301: "Moved Permanently", 308: "Permanent Redirect"}[code]
+        response = closeable_response(
+            BytesIO(), make_headers([("Location", newurl)]),
+            req.get_full_url(), code, msg)
+        response.from_redirect_cache = True
+        return response
+
+    https_open = http_open
+
     def redirect_request(self, req, fp, code, msg, headers, newurl):
         """Return a Request or None in response to a redirect.
 
@@ -653,6 +741,13 @@ class HTTPRedirectHandler(BaseHandler):
             visited = new.redirect_dict = req.redirect_dict = {}
         visited[newurl] = visited.get(newurl, 0) + 1
 
+        if (self.cache is not None and code in self.cacheable_codes and
+                req.get_method() in ("GET", "HEAD") and
+                not getattr(fp, "from_redirect_cache", False)):
+            from ._http import max_age_from_headers
+            self.cache.put(req.get_full_url(), code, newurl,
+                           max_age_from_headers(headers))
+
         # Don't close the fp until we are sure that we won't use it
         # with HTTPError.
         fp.read()
@@ -874,6 +969,96 @@ class HTTPPasswordMgrWithDefaultRealm(HTTPPasswordMgr):
         return HTTPPasswordMgr.find_user_password(self, None, authuri)
 
 
+def protection_space(uri):
+    """Return the URI of the directory containing uri.
+
+    RFC 7617 section 2.2: a client may assume that everything at or below
+    that directory is covered by the credentials that were accepted for uri.
+    """
+    scheme, authority, path, query, fragment = _rfc3986.urlsplit(uri)
+    return _rfc3986.urlunsplit(
+        [scheme, authority, path[:path.rfind('/') + 1] or '/', None, None])
+
+
+def reduce_uri_with_scheme(passwd, uri, default_port=True):
+    """Return passwd.reduce_uri(uri, default_port) with the scheme of uri
+    prepended (None if uri is just an authority).
+
+    Credentials accepted over https must not be sent unasked over http, so
+    the scheme is part of what is remembered about a protection space.
+    """
+    parts = urlsplit(uri)
+    scheme = parts[0].lower() if parts[1] else None
+    return (scheme, ) + tuple(passwd.reduce_uri(uri, default_port))
+
+
+def in_protection_space(passwd, base, test):
+    """Check if test is below base, both as from reduce_uri_with_scheme().
+
+    A base without a scheme covers all schemes.
+    """
+    return (base[0] in (None, test[0]) and
+            passwd.is_suburi(base[1:], test[1:]))
+
+
+class HTTPPasswordMgrWithPriorAuth(HTTPPasswordMgrWithDefaultRealm):
+    """Password manager that enables preemptive authentication.
+
+    Once credentials have been accepted for a URI, requests for that URI and
+    for everything below its directory, using the same scheme, send them
+    straight away, rather than first receiving a 401 response.  Pass
+    is_authenticated=True to :meth:`add_password` to send credentials for uri
+    from the very first request (for any scheme, if uri is just an
+    authority).
+    """
+
+    def __init__(self):
+        HTTPPasswordMgrWithDefaultRealm.__init__(self)
+        self.authenticated = {}
+
+    def add_password(self, realm, uri, user, passwd, is_authenticated=False):
+        self.update_authenticated(uri, is_authenticated)
+        # preemptive requests do not know the realm yet
+        if realm is not None:
+            HTTPPasswordMgrWithDefaultRealm.add_password(
+                self, None, uri, user, passwd)
+        HTTPPasswordMgrWithDefaultRealm.add_password(
+            self, realm, uri, user, passwd)
+
+    def update_authenticated(self, uri, is_authenticated=False):
+        # uri could be a single URI or a sequence
+        if is_string(uri):
+            uri = [uri]
+        for default_port in True, False:
+            for u in uri:
+                reduced_uri = reduce_uri_with_scheme(self, u, default_port)
+                self.authenticated[reduced_uri] = is_authenticated
+
+    def is_authenticated(self, authuri):
+        # the most specific URI wins
+        best = None
+        for default_port in True, False:
+            reduced_authuri = reduce_uri_with_scheme(
+                self, authuri, default_port)
+            for uri in self.authenticated:
+                if (in_protection_space(self, uri, reduced_authuri) and
+                        (best is None or len(uri[2]) > len(best[2]))):
+                    best = uri
+        return best is not None and self.authenticated[best]
+
+    def __copy__(self):
+        ans = HTTPPasswordMgrWithDefaultRealm.__copy__(self)
+        ans.authenticated = self.authenticated.copy()
+        return ans
+
+
+def close_challenge_response(fp):
+    # Done with the 401 or 407 response before retrying with credentials: if
+    # it came from a pooled connection, that hands the connection back.
+    if fp is not None:
+        fp.close()
+
+
 class AbstractBasicAuthHandler:
 
     # XXX this allows for multiple auth-schemes, but will stupidly pick
@@ -891,9 +1076,8 @@ class AbstractBasicAuthHandler:
                     'realm=(["\']?)([^"\']*)\\2',
                     re.I)
 
-    # XXX could pre-emptively send auth info already accepted (RFC 2617,
-    # end of section 2, and section 1.2 immediately after "credentials"
-    # production).
+    # Auth info already accepted is sent pre-emptively (RFC 7617 section 2.2)
+    # if the password manager is a HTTPPasswordMgrWithPriorAuth.
 
     def __init__(self, password_mgr=None):
         if password_mgr is None:
@@ -901,7 +1085,7 @@ class AbstractBasicAuthHandler:
         self.passwd = password_mgr
         self.add_password = self.passwd.add_password
 
-    def http_error_auth_reqed(self, authreq, host, req, headers):
+    def http_error_auth_reqed(self, authreq, host, req, headers, fp=None):
         # host may be an authority (without userinfo) or a URL with an
         # authority
         # XXX could be multiple headers
@@ -911,23 +1095,27 @@ class AbstractBasicAuthHandler:
             if mo:
                 scheme, quote, realm = mo.groups()
                 if scheme.lower() == 'basic':
-                    return self.retry_http_basic_auth(host, req, realm)
+                    return self.retry_http_basic_auth(host, req, realm, fp)
 
-    def retry_http_basic_auth(self, host, req, realm):
+    def retry_http_basic_auth(self, host, req, realm, fp=None):
         user, pw = self.passwd.find_user_password(realm, host)
         if pw is not None:
-            raw = "%s:%s" % (user, pw)
-            auth = str('Basic %s' % base64.b64encode(
-                    raw.encode('utf-8')).strip().decode('ascii'))
+            auth = self.basic_auth_header(user, pw)
             if req.get_header(self.auth_header, None) == auth:
                 return None
             newreq = copy.copy(req)
             newreq.add_header(self.auth_header, auth)
             newreq.visit = False
+            close_challenge_response(fp)
             return self.parent.open(newreq)
         else:
             return None
 
+    def basic_auth_header(self, user, pw):
+        raw = "%s:%s" % (user, pw)
+        return str('Basic %s' % base64.b64encode(
+                raw.encode('utf-8')).strip().decode('ascii'))
+
     def __copy__(self):
         return self.__class__(self.passwd.__copy__())
 
@@ -939,7 +1127,38 @@ class HTTPBasicAuthHandler(AbstractBasicAuthHandler, BaseHandler):
     def http_error_401(self, req, fp, code, msg, headers):
         url = req.get_full_url()
         return self.http_error_auth_reqed('www-authenticate',
-                                          url, req, headers)
+                                          url, req, headers, fp)
+
+    def http_request(self, req):
+        if (not hasattr(self.passwd, 'is_authenticated') or
+                req.has_header(self.auth_header)):
+            return req
+        url = req.get_full_url()
+        if self.passwd.is_authenticated(url):
+            user, pw = self.passwd.find_user_password(None, url)
+            if pw is not None:
+                req.add_unredirected_header(
+                    self.auth_header, self.basic_auth_header(user, pw))
+        return req
+
+    def http_response(self, req, response):
+        if hasattr(self.passwd, 'is_authenticated'):
+            auth = req.get_header(self.auth_header, '')
+            if auth[:6].lower() == 'basic ':
+                url = req.get_full_url()
+                if response.code == 401:
+                    self.passwd.update_authenticated(url, False)
+                else:
+                    # an earlier rejection of this very URL is more specific
+                    # than its protection space, so overwrite it as well
+                    if not self.passwd.is_authenticated(url):
+                        self.passwd.update_authenticated(url, True)
+                    self.passwd.update_authenticated(
+                        protection_space(url), True)
+        return response
+
+    https_request = http_request
+    https_response = http_response
 
     def __copy__(self):
         return AbstractBasicAuthHandler.__copy__(self)
@@ -956,7 +1175,7 @@ class ProxyBasicAuthHandler(AbstractBasicAuthHandler, BaseHandler):
         # userinfo.
         authority = req.get_host()
         return self.http_error_auth_reqed('proxy-authenticate',
-                                          authority, req, headers)
+                                          authority, req, headers, fp)
 
     def __copy__(self):
         return AbstractBasicAuthHandler.__copy__(self)
@@ -976,6 +1195,9 @@ class AbstractDigestAuthHandler:
 
     # XXX qop="auth-int" supports is shaky
 
+    # number of nonces to keep request counts for
+    max_nonces = 100
+
     def __init__(self, passwd=None):
         if passwd is None:
             passwd = HTTPPasswordMgr()
@@ -984,13 +1206,23 @@ class AbstractDigestAuthHandler:
         self.retried = 0
         self.nonce_count = 0
         self.last_nonce = None
+        # nonce --> number of requests made with it, for the most recently
+        # used nonces: the count must keep increasing for each nonce even
+        # when requests to different protection spaces are interleaved
+        self.nonce_counts = OrderedDict()
+        # reduced protection space URI --> last accepted challenge
+        self.challenges = {}
 
     def reset_retry_count(self):
         self.retried = 0
 
-    def http_error_auth_reqed(self, auth_header, host, req, headers):
+    def http_error_auth_reqed(self, auth_header, host, req, headers,
+                              fp=None):
         authreq = headers.get(auth_header, None)
-        if self.retried > 5:
+        # .retried is reset once the retry returns, so it only counts retries
+        # that are made before that (not so with AsyncOpenerDirector): count
+        # them on the request too
+        if self.retried > 5 or getattr(req, "digest_retries", 0) > 5:
             # Don't fail endlessly - if we failed once, we'll probably
             # fail a second time. Hm. Unless the Password Manager is
             # prompting for the information. Crap. This isn't great
@@ -1003,9 +1235,9 @@ class AbstractDigestAuthHandler:
         if authreq:
             scheme = authreq.split()[0]
             if scheme.lower() == 'digest':
-                return self.retry_http_digest_auth(req, authreq)
+                return self.retry_http_digest_auth(req, authreq, fp)
 
-    def retry_http_digest_auth(self, req, auth):
+    def retry_http_digest_auth(self, req, auth, fp=None):
         token, challenge = auth.split(' ', 1)
         chal = parse_keqv_list(parse_http_list(challenge))
         auth = self.get_authorization(req, chal)
@@ -1016,6 +1248,11 @@ class AbstractDigestAuthHandler:
             newreq = copy.copy(req)
             newreq.add_unredirected_header(self.auth_header, auth_val)
             newreq.visit = False
+            newreq.digest_challenge = chal
+            newreq.digest_retries = getattr(req, "digest_retries", 0) + 1
+            # the retry's response processing records the new challenge
+            req.digest_challenge = None
+            close_challenge_response(fp)
             return self.parent.open(newreq)
 
     def get_cnonce(self, nonce):
@@ -1059,11 +1296,11 @@ class AbstractDigestAuthHandler:
                         # XXX selector: what about proxies and full urls
                         req.get_selector())
         if qop == 'auth':
-            if nonce == self.last_nonce:
-                self.nonce_count += 1
-            else:
-                self.nonce_count = 1
-                self.last_nonce = nonce
+            self.nonce_count = self.nonce_counts.pop(nonce, 0) + 1
+            self.nonce_counts[nonce] = self.nonce_count
+            while len(self.nonce_counts) > self.max_nonces:
+                self.nonce_counts.popitem(last=False)
+            self.last_nonce = nonce
 
             ncvalue = '%08x' % self.nonce_count
             cnonce = self.get_cnonce(nonce)
@@ -1124,10 +1361,61 @@ class HTTPDigestAuthHandler(BaseHandler, AbstractDigestAuthHandler):
     def http_error_401(self, req, fp, code, msg, headers):
         host = urlparse(req.get_full_url())[1]
         retry = self.http_error_auth_reqed('www-authenticate',
-                                           host, req, headers)
+                                           host, req, headers, fp)
         self.reset_retry_count()
         return retry
 
+    def find_challenge(self, url):
+        best = None
+        for default_port in True, False:
+            reduced_url = reduce_uri_with_scheme(
+                self.passwd, url, default_port)
+            for uri in self.challenges:
+                if (in_protection_space(self.passwd, uri, reduced_url) and
+                        (best is None or len(uri[2]) > len(best[2]))):
+                    best = uri
+        return self.challenges.get(best)
+
+    def http_request(self, req):
+        # With a HTTPPasswordMgrWithPriorAuth, keep using the server nonce
+        # (with an incrementing nonce count) until the server says that it
+        # is stale.
+        if (not hasattr(self.passwd, 'is_authenticated') or
+                req.has_header(self.auth_header)):
+            return req
+        chal = self.find_challenge(req.get_full_url())
+        if chal is not None:
+            auth = self.get_authorization(req, chal)
+            if auth:
+                req.add_unredirected_header(self.auth_header,
+                                            'Digest %s' % auth)
+                req.digest_challenge = chal
+        return req
+
+    def http_response(self, req, response):
+        chal = getattr(req, 'digest_challenge', None)
+        if chal is None or not hasattr(self.passwd, 'is_authenticated'):
+            return response
+        space = protection_space(req.get_full_url())
+        keys = [reduce_uri_with_scheme(self.passwd, space, default_port)
+                for default_port in (True, False)]
+        if response.code == 401:
+            for key in keys:
+                self.challenges.pop(key, None)
+            return response
+        info = response.info().get('authentication-info')
+        if info:
+            nextnonce = parse_keqv_list(parse_http_list(info)).get(
+                'nextnonce')
+            if nextnonce:
+                chal = dict(chal, nonce=nextnonce)
+        for key in keys:
+            self.challenges[key] = chal
+        return response
+
+    https_request = http_request
+    https_response = http_response
+
     def __copy__(self):
         return AbstractDigestAuthHandler.__copy__(self)
 
@@ -1140,7 +1428,7 @@ class ProxyDigestAuthHandler(BaseHandler, AbstractDigestAuthHandler):
     def http_error_407(self, req, fp, code, msg, headers):
         host = req.get_host()
         retry = self.http_error_auth_reqed('proxy-authenticate',
-                                           host, req, headers)
+                                           host, req, headers, fp)
         self.reset_retry_count()
         return retry
 
@@ -1148,10 +1436,163 @@ class ProxyDigestAuthHandler(BaseHandler, AbstractDigestAuthHandler):
         return AbstractDigestAuthHandler.__copy__(self)
 
 
+# methods whose requests may safely be sent twice (RFC 7231 section 4.2.2)
+IDEMPOTENT_METHODS = frozenset(
+    ("GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"))
+
+
+def connection_dropped(conn):
+    # An idle keep-alive connection should have nothing to read: if its socket
+    # is readable, the server has closed it (or sent junk), so don't reuse it.
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, select.error, socket.error):
+        return True
+
+
+class ConnectionPool(object):
+    """Pool of persistent (keep-alive) HTTP and HTTPS connections.
+
+    Connections are keyed by URL scheme, host and port, proxy tunnel and TLS
+    settings.  A connection is handed back to the pool only once the response
+    read from it has been consumed completely (or, for short responses, closed
+    early).  Instances are thread-safe, and may be shared between openers, for
+    example between a Browser and its copies.
+
+    max_per_key: maximum number of idle connections kept for each key
+    idle_timeout: idle connections older than this many seconds are not reused
+    max_drain: responses closed before being fully read are read to the end
+     so that their connection can be reused, provided no more than this many
+     bytes are left unread
+
+    """
+
+    def __init__(self, max_per_key=4, idle_timeout=60, max_drain=64 * 1024):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.max_drain = max_drain
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return an idle connection for key, or None."""
+        now = time.time()
+        unusable = []
+        ans = None
+        with self._lock:
+            conns = self._idle.get(key)
+            while conns:
+                conn, last_used = conns.pop()
+                if now - last_used > self.idle_timeout:
+                    # everything older is stale too
+                    unusable.extend(c for c, t in conns)
+                    unusable.append(conn)
+                    del conns[:]
+                elif connection_dropped(conn):
+                    unusable.append(conn)
+                else:
+                    ans = conn
+                    break
+            if not conns:
+                self._idle.pop(key, None)
+        for conn in unusable:
+            conn.close()
+        return ans
+
+    def put(self, key, conn):
+        """Return an idle connection to the pool."""
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_per_key:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(conns) for conns in self._idle.values())
+
+
+class pooled_response_reader(object):
+    # File-like object wrapping the body of a response read from a pooled
+    # connection, which hands the connection back to the pool as soon as the
+    # body has been read to the end.
+
+    def __init__(self, fp, response, conn, pool, key):
+        self._fp = fp
+        self._response = response
+        self._conn = conn
+        self._pool = pool
+        self._key = key
+        self._released = False
+
+    def _maybe_release(self):
+        if not self._released and self._response.isclosed():
+            self._released = True
+            self._pool.put(self._key, self._conn)
+
+    def read(self, size=-1):
+        ans = self._fp.read(size)
+        self._maybe_release()
+        return ans
+
+    def readinto(self, b):
+        ans = self._fp.readinto(b)
+        self._maybe_release()
+        return ans
+
+    def readline(self, size=-1):
+        ans = self._fp.readline(size)
+        self._maybe_release()
+        return ans
+
+    def readlines(self, sizehint=-1):
+        ans = self._fp.readlines(sizehint)
+        self._maybe_release()
+        return ans
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    next = __next__
+
+    def close(self):
+        if not self._released:
+            remaining = self._response.length
+            if (remaining is not None and
+                    remaining <= self._pool.max_drain):
+                try:
+                    self._response.read()
+                except (socket.error, HTTPException):
+                    pass
+            self._maybe_release()
+        if not self._released:
+            self._released = True
+            self._conn.close()
+        self._fp.close()
+
+
 class AbstractHTTPHandler(BaseHandler):
 
     def __init__(self, debuglevel=0):
         self._debuglevel = debuglevel
+        self.connection_pool = None
 
     def set_http_debuglevel(self, level):
         self._debuglevel = level
@@ -1168,8 +1609,15 @@ class AbstractHTTPHandler(BaseHandler):
                     'Content-type',
                     'application/x-www-form-urlencoded')
             if not request.has_header('Content-length'):
-                request.add_unredirected_header(
-                    'Content-length', '%d' % len(data))
+                if hasattr(data, 'read'):
+                    # a file-like body is sent as it is read, using chunked
+                    # transfer encoding if its length isn't known
+                    length = getattr(data, 'length', None)
+                else:
+                    length = len(data)
+                if length is not None:
+                    request.add_unredirected_header(
+                        'Content-length', '%d' % length)
 
         sel_host = host
         if request.has_proxy():
@@ -1185,33 +1633,21 @@ class AbstractHTTPHandler(BaseHandler):
 
         return request
 
-    def do_open(self, http_class, req):
-        """Return an addinfourl object for the request, using http_class.
-
-        http_class must implement the HTTPConnection API from httplib.
-        The addinfourl return value is a file-like object.  It also
-        has methods and attributes including:
-            - info(): return a HTTPMessage object for the headers
-            - geturl(): return the original request URL
-            - code: HTTP status code
-        """
-        host_port = req.get_host()
-        if not host_port:
-            raise URLError('no host given')
-
-        h = http_class(host_port, timeout=req.timeout)
-        h.set_debuglevel(self._debuglevel)
-
+    def _request_headers(self, req, close):
+        # Return the headers to send with req, and those to send to a proxy
+        # with the CONNECT request that sets up a tunnel, if any.  If close
+        # is true, the connection is closed after the response.
         headers = OrderedDict(req.headers)
         for key, val in iteritems(req.unredirected_hdrs):
             headers[key] = val
-        # We want to make an HTTP/1.1 request, but the addinfourl
-        # class isn't prepared to deal with a persistent connection.
-        # It will try to read all remaining data from the socket,
-        # which will block while the server waits for the next request.
-        # So make sure the connection gets closed after the (only)
-        # request.
-        headers["Connection"] = "close"
+        if close:
+            # We want to make an HTTP/1.1 request, but the addinfourl
+            # class isn't prepared to deal with a persistent connection.
+            # It will try to read all remaining data from the socket,
+            # which will block while the server waits for the next request.
+            # So make sure the connection gets closed after the (only)
+            # request.
+            headers["Connection"] = "close"
         # httplib in python 2 needs str() not unicode() for all request
         # parameters
         if is_py2:
@@ -1224,38 +1660,133 @@ class AbstractHTTPHandler(BaseHandler):
                      as_unicode(val, 'iso-8859-1'))
                     for name, val in iteritems(headers))
 
+        tunnel_headers = {}
         if req._tunnel_host:
-            set_tunnel = h.set_tunnel if hasattr(
-                h, "set_tunnel") else h._set_tunnel
-            tunnel_headers = {}
             proxy_auth_hdr = "Proxy-Authorization"
             if proxy_auth_hdr in headers:
                 tunnel_headers[proxy_auth_hdr] = headers[proxy_auth_hdr]
                 # Proxy-Authorization should not be sent to origin server.
                 del headers[proxy_auth_hdr]
-            set_tunnel(req._tunnel_host, headers=tunnel_headers)
 
         if self.parent.finalize_request_headers is not None:
             self.parent.finalize_request_headers(req, headers)
+        return headers, tunnel_headers
 
-        try:
-            h.request(str(req.get_method()), str(req.get_selector()), req.data,
-                      headers)
-            r = h.getresponse()
-        except socket.error as err:  # XXX what error?
-            raise URLError(err)
+    def _connect(self, http_class, req, tunnel_headers):
+        h = http_class(req.get_host(), timeout=req.timeout)
+        if req._tunnel_host:
+            set_tunnel = h.set_tunnel if hasattr(
+                h, "set_tunnel") else h._set_tunnel
+            set_tunnel(req._tunnel_host, headers=tunnel_headers)
+        return h
+
+    def do_open(self, http_class, req, connection_key=None):
+        """Return an addinfourl object for the request, using http_class.
+
+        http_class must implement the HTTPConnection API from httplib.
+        The addinfourl return value is a file-like object.  It also
+        has methods and attributes including:
+            - info(): return a HTTPMessage object for the headers
+            - geturl(): return the original request URL
+            - code: HTTP status code
+
+        If a connection pool is set, connection_key identifies anything
+        (beyond scheme, host, port and proxy tunnel) that makes connections
+        created by http_class unsuitable for reuse by other requests, e.g. TLS
+        settings.
+        """
+        host_port = req.get_host()
+        if not host_port:
+            raise URLError('no host given')
+
+        pool = self.connection_pool
+        h = pool_key = None
+        if pool is not None:
+            pool_key = (req.get_type(), host_port, req._tunnel_host,
+                        connection_key)
+            h = pool.get(pool_key)
+            if h is not None:
+                timeout = req.timeout
+                if timeout is _sockettimeout._GLOBAL_DEFAULT_TIMEOUT:
+                    timeout = socket.getdefaulttimeout()
+                h.timeout = timeout
+                h.sock.settimeout(timeout)
+
+        headers, tunnel_headers = self._request_headers(req, pool is None)
+
+        rewind_body = False
+        if hasattr(req.data, "read"):
+            from ._form_controls import MultipartBody
+            from ._gzip import GzipBody
+            # may already have been sent, e.g. before an authentication retry
+            rewind_body = isinstance(req.data, (MultipartBody, GzipBody))
+
+        instrumentation = getattr(self.parent, "_instrumentation", None)
+        reused = h is not None
+        while True:
+            if h is None:
+                h = self._connect(http_class, req, tunnel_headers)
+            h.set_debuglevel(self._debuglevel)
+            if rewind_body:
+                req.data.seek(0)
+            sent = False
+            try:
+                self._send_request(h, req, headers, instrumentation)
+                sent = True
+                r = self._get_response(h, instrumentation)
+            except socket.error as err:  # XXX what error?
+                h.close()
+                # The server may have closed an idle keep-alive connection
+                # under our feet: try again, once, on a fresh connection --
+                # unless the server may already have acted on the request, or
+                # the body can't be sent again.
+                if (not reused or
+                        (sent and req.get_method() not in IDEMPOTENT_METHODS)
+                        or (hasattr(req.data, "read") and not rewind_body)):
+                    raise URLError(err)
+                h = None
+                reused = False
+            else:
+                break
 
         # Pick apart the HTTPResponse object to get the addinfourl
         # object initialized properly.
         fp = create_readline_wrapper(r)
+        if pool is not None and not r.will_close:
+            fp = pooled_response_reader(fp, r, h, pool, pool_key)
 
         resp = closeable_response(
             fp, r.msg, req.get_full_url(), r.status, r.reason,
             getattr(r, 'version', None))
         return resp
 
+    def _send_request(self, h, req, headers, instrumentation):
+        method, selector = str(req.get_method()), str(req.get_selector())
+        if instrumentation is None:
+            h.request(method, selector, req.data, headers)
+            return
+
+        # time the network phases separately
+        if h.sock is None:
+            start = perf_counter()
+            h.connect()
+            instrumentation.record("network.connect", perf_counter() - start)
+        start = perf_counter()
+        h.request(method, selector, req.data, headers)
+        instrumentation.record("network.send", perf_counter() - start)
+
+    def _get_response(self, h, instrumentation):
+        if instrumentation is None:
+            return h.getresponse()
+        start = perf_counter()
+        r = h.getresponse()
+        instrumentation.record("network.wait", perf_counter() - start)
+        return r
+
     def __copy__(self):
-        return self.__class__(self._debuglevel)
+        ans = self.__class__(self._debuglevel)
+        ans.connection_pool = self.connection_pool
+        return ans
 
 
 class HTTPHandler(AbstractHTTPHandler):
@@ -1273,17 +1804,25 @@ class HTTPSHandler(AbstractHTTPHandler):
         self.client_cert_manager = client_cert_manager
         self.ssl_context = None
 
+    def _key_cert(self, req):
+        if self.client_cert_manager is None:
+            return None, None
+        return self.client_cert_manager.find_key_cert(req.get_full_url())
+
+    def _context(self, key_file, cert_file):
+        # the SSL context for a connection using the client certificate
+        # cert_file, if any
+        import ssl
+        ctx = self.ssl_context or ssl.create_default_context()
+        if cert_file:
+            ctx.load_cert_chain(cert_file, key_file)
+        return ctx
+
     def https_open(self, req):
-        key_file = cert_file = None
-        if self.client_cert_manager is not None:
-            key_file, cert_file = self.client_cert_manager.find_key_cert(
-                req.get_full_url())
+        key_file, cert_file = self._key_cert(req)
         if sys.version_info > (3, 5):
-            import ssl
-            ctx = self.ssl_context or ssl.create_default_context()
-            if cert_file:
-                ctx.load_cert_chain(cert_file, key_file)
-            conn_factory = partial(HTTPSConnection, context=ctx)
+            conn_factory = partial(
+                HTTPSConnection, context=self._context(key_file, cert_file))
         else:
             if self.ssl_context is None:
                 conn_factory = partial(
@@ -1293,7 +1832,8 @@ class HTTPSHandler(AbstractHTTPHandler):
                 conn_factory = partial(
                     HTTPSConnection, key_file=key_file,
                     cert_file=cert_file, context=self.ssl_context)
-        return self.do_open(conn_factory, req)
+        return self.do_open(conn_factory, req,
+                            (self.ssl_context, key_file, cert_file))
 
     https_request = AbstractHTTPHandler.do_request_
 
@@ -1301,6 +1841,7 @@ class HTTPSHandler(AbstractHTTPHandler):
         ans = self.__class__(self.client_cert_manager)
         ans._debuglevel = self._debuglevel
         ans.ssl_context = self.ssl_context
+        ans.connection_pool = self.connection_pool
         return ans
 
 
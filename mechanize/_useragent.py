@@ -13,9 +13,12 @@ included with the distribution).
 
 from __future__ import absolute_import
 
+import collections
 import copy
 
-from . import _auth, _gzip, _opener, _response, _sockettimeout, _urllib2
+from . import (_auth, _cache, _gzip, _opener, _response, _rfc3986,
+               _sockettimeout, _urllib2)
+from ._util import isstringlike
 from .polyglot import iteritems, itervalues
 
 
@@ -68,6 +71,8 @@ class UserAgentBase(_opener.OpenerDirector):
         "_proxy_digestauth": _urllib2.ProxyDigestAuthHandler,
         "_robots": _urllib2.HTTPRobotRulesProcessor,
         "_gzip": _gzip.HTTPGzipProcessor,
+        "_request_gzip": _gzip.HTTPRequestGzipProcessor,
+        "_cache": _cache.HTTPCacheProcessor,
 
         # debug handlers
         "_debug_redirect": _urllib2.HTTPRedirectDebugProcessor,
@@ -95,6 +100,8 @@ class UserAgentBase(_opener.OpenerDirector):
 
     def __init__(self):
         _opener.OpenerDirector.__init__(self)
+        self._redirect_cache = None
+        self._spool_threshold = None
 
         ua_handlers = self._ua_handlers = {}
         for scheme in (self.default_schemes + self.default_others +
@@ -132,8 +139,6 @@ class UserAgentBase(_opener.OpenerDirector):
 # XXX
 # def set_timeout(self, timeout):
 #         self._timeout = timeout
-# def set_http_connection_cache(self, conn_cache):
-#         self._http_conn_cache = conn_cache
 # def set_ftp_connection_cache(self, conn_cache):
 # XXX ATM, FTP has cache as part of handler; should it be separate?
 #         self._ftp_conn_cache = conn_cache
@@ -171,6 +176,39 @@ class UserAgentBase(_opener.OpenerDirector):
         """Set a mechanize.CookieJar, or None."""
         self._set_handler("_cookies", obj=cookiejar)
 
+    def set_connection_pool(self, pool):
+        """Set a mechanize.ConnectionPool, or None.
+
+        With a pool, HTTP and HTTPS connections are kept alive and reused by
+        later requests to the same server, instead of paying for a new TCP
+        (and TLS) handshake on every request.  A connection only becomes
+        available for reuse once the response read from it has been read to
+        the end or closed.  The pool is shared with copies of this object.
+
+        >>> from mechanize import ConnectionPool
+        >>> ua = UserAgentBase()
+        >>> ua.set_connection_pool(ConnectionPool())
+
+        Call the pool's .close() method to close its idle connections.
+
+        """
+        for scheme in "http", "https":
+            handler = self._ua_handlers.get(scheme)
+            if handler is not None:
+                handler.connection_pool = pool
+
+    def set_spool_threshold(self, threshold):
+        """Set the size in bytes beyond which seekable responses cache their
+        data in a temporary file rather than in memory, or None.
+
+        Applies to the seek wrappers of responses opened by this object
+        (and copies of it) from now on, without affecting other user
+        agents.  None means the default, the spool_threshold class attribute
+        of the seek wrappers.
+
+        """
+        self._spool_threshold = threshold
+
     # XXX could use Greg Stein's httpx for some of this instead?
     # or httplib2??
     def set_proxies(self, proxies=None, proxy_bypass=None):
@@ -230,7 +268,11 @@ class UserAgentBase(_opener.OpenerDirector):
     # the following are rarely useful -- use add_password / add_proxy_password
     # instead
     def set_password_manager(self, password_manager):
-        """Set a mechanize.HTTPPasswordMgrWithDefaultRealm, or None."""
+        """Set a mechanize.HTTPPasswordMgrWithDefaultRealm, or None.
+
+        Pass a mechanize.HTTPPasswordMgrWithPriorAuth to send credentials
+        without waiting for a 401 response once they have been accepted.
+        """
         self._password_manager = password_manager
         self._set_handler("_basicauth", obj=password_manager)
         self._set_handler("_digestauth", obj=password_manager)
@@ -275,7 +317,19 @@ class UserAgentBase(_opener.OpenerDirector):
 
     def set_handle_redirect(self, handle):
         """Set whether to handle HTTP 30x redirections."""
-        self._set_handler("_redirect", handle)
+        self._set_handler("_redirect", handle,
+                          constructor_kwds={"cache": self._redirect_cache})
+
+    def set_redirect_cache(self, cache):
+        """Set a mechanize.RedirectCache of permanent redirects, or None.
+
+        The cache is used whenever redirects are handled (see
+        :meth:`set_handle_redirect()`); setting it does not turn redirect
+        handling on.  Copies of this user agent share the cache.
+        """
+        self._redirect_cache = cache
+        if "_redirect" in self._ua_handlers:
+            self.set_handle_redirect(True)
 
     def set_handle_refresh(self, handle, max_time=None, honor_time=True):
         """Set whether to handle HTTP Refresh headers."""
@@ -299,15 +353,41 @@ class UserAgentBase(_opener.OpenerDirector):
         self._set_handler("_equiv", handle, constructor_kwds=constructor_kwds)
 
     def set_request_gzip(self, handle):
-        """Add header indicating to server that we handle gzip
-        content encoding. Note that if the server sends gzip'ed content,
-        it is handled automatically in any case, regardless of this setting.
+        """Add header indicating to server that we handle the gzip and
+        deflate content encodings (and zstd, where Python supports it).
+        Note that if the server sends content in one of those encodings, it
+        is handled automatically in any case, regardless of this setting.
 
         """
         self._set_handler(
             "_gzip", True, constructor_kwds={'request_gzip': bool(handle)})
     set_handle_gzip = set_request_gzip  # legacy
 
+    def set_gzip_request_bodies(self, hosts, min_size=1024):
+        """Send request bodies to the given hosts with gzip content encoding.
+
+        Only do this for servers known to accept compressed request bodies.
+        Bodies smaller than min_size bytes are sent uncompressed.  Pass an
+        empty list of hosts to stop compressing request bodies.  See
+        mechanize.HTTPRequestGzipProcessor.
+
+        """
+        self._set_handler(
+            "_request_gzip", bool(hosts),
+            constructor_kwds={"hosts": hosts, "min_size": min_size})
+
+    def set_http_cache(self, cache):
+        """Cache HTTP responses, following RFC 7234.
+
+        cache: a MemoryCache, a DiskCache, or another object with the same
+            .get(), .set() and .delete() methods; or None to stop caching
+
+        Fresh responses are then returned without contacting the server, and
+        stale ones are revalidated with a conditional request.
+
+        """
+        self._set_handler("_cache", obj=cache)
+
     def set_debug_redirects(self, handle):
         """
         Log information about HTTP redirects (including refreshes).
@@ -359,10 +439,128 @@ class UserAgentBase(_opener.OpenerDirector):
             if h is not None:
                 h.set_http_debuglevel(level)
 
+    def fetch_many(self, urls_or_requests, max_workers=4, per_host_limit=None,
+                   timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
+        """Fetch several URLs concurrently, using a pool of threads.
+
+        This is a generator yielding ``(url_or_request, response)`` pairs in
+        the order the fetches complete.  If a fetch raises an exception
+        (e.g. :class:`mechanize.HTTPError` or :class:`mechanize.URLError`),
+        the exception is yielded in place of the response.
+
+        Each worker thread fetches with its own copy of this object, made
+        once when the generator starts, so handlers and settings are the same
+        as for :meth:`open`.  The copies share the (thread-safe) cookie jar.
+        URLs are taken from ``urls_or_requests`` only as workers become free
+        (holding back at most ``max_workers`` of them while their hosts are at
+        ``per_host_limit``), so it may be a long or unbounded iterator.  The
+        copies are closed when the generator finishes.
+
+        :param max_workers: the number of worker threads
+        :param per_host_limit: the maximum number of fetches in progress to
+            any one host at a time, or None for no limit
+        :param timeout: as for :meth:`open`
+
+        """
+        from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                        wait)
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if per_host_limit is not None and per_host_limit < 1:
+            raise ValueError("per_host_limit must be None or at least 1")
+        clones = [copy.copy(self) for i in range(max_workers)]
+        idle = clones[:]
+        in_flight = {}  # future -> (url_or_request, host, clone)
+        host_counts = collections.Counter()
+        # host -> deque of URLs held back because host is at per_host_limit
+        waiting = collections.OrderedDict()
+        nr_waiting = [0]
+        pending = iter(urls_or_requests)
+
+        def fetch(clone, url_or_request):
+            try:
+                return clone.open(url_or_request, timeout=timeout)
+            except Exception as exc:
+                return exc
+
+        def host_of(url_or_request):
+            if not isstringlike(url_or_request):
+                url_or_request = url_or_request.get_full_url()
+            authority = _rfc3986.urlsplit(url_or_request)[1] or ""
+            return authority.rpartition("@")[2].lower()
+
+        def next_fetch():
+            # the next URL whose host is not at per_host_limit, or None
+            for host, items in waiting.items():
+                if host_counts[host] < per_host_limit:
+                    item = items.popleft()
+                    if not items:
+                        del waiting[host]
+                    nr_waiting[0] -= 1
+                    return item, host
+            while nr_waiting[0] < max_workers:
+                try:
+                    item = next(pending)
+                except StopIteration:
+                    return None
+                host = host_of(item)
+                if (per_host_limit is None or
+                        host_counts[host] < per_host_limit):
+                    return item, host
+                waiting.setdefault(host, collections.deque()).append(item)
+                nr_waiting[0] += 1
+            return None
+
+        try:
+            with ThreadPoolExecutor(max_workers) as executor:
+                try:
+                    while True:
+                        while idle:
+                            nxt = next_fetch()
+                            if nxt is None:
+                                break
+                            item, host = nxt
+                            clone = idle.pop()
+                            host_counts[host] += 1
+                            future = executor.submit(fetch, clone, item)
+                            in_flight[future] = item, host, clone
+                        if not in_flight:
+                            break
+                        done = wait(
+                            in_flight, return_when=FIRST_COMPLETED)[0]
+                        for future in done:
+                            item, host, clone = in_flight.pop(future)
+                            host_counts[host] -= 1
+                            idle.append(clone)
+                            yield item, future.result()
+                finally:
+                    # the generator was closed early: drop fetches not yet
+                    # started
+                    for future in in_flight:
+                        future.cancel()
+        finally:
+            for clone in clones:
+                # not Browser.close(), which would close responses still in
+                # use: those yielded, and the history shared with self
+                UserAgentBase.close(clone)
+
+    def __copy__(self):
+        """Clone this user agent.
+
+        The clone has the same handlers and settings, and shares the same,
+        thread-safe cookie jar, so it may be used in another thread.
+
+        """
+        ans = self.__class__()
+        self._copy_state(ans)
+        return ans
+
     def _copy_state(self, other):
         if self._ua_handlers is None:
             raise ValueError('Cannot copy state from a closed UserAgentBase')
         other.addheaders = self.addheaders[:]
+        other._redirect_cache = self._redirect_cache
+        other._spool_threshold = self._spool_threshold
         rmap = {v: k for k, v in iteritems(self._ua_handlers)}
 
         def clone_handler(h):
@@ -377,6 +575,7 @@ class UserAgentBase(_opener.OpenerDirector):
         other._ua_handlers.clear()
         other.handlers = [clone_handler(h) for h in self.handlers]
         other._handler_index_valid = False
+        other._instrumentation = self._instrumentation
 
     def handlers_by_class(self, cls):
         for h in self.handlers:
@@ -411,6 +610,7 @@ class UserAgentBase(_opener.OpenerDirector):
                     self.handlers.remove(handler)
                 except ValueError:
                     pass
+                self._handler_index_valid = False
         # then add the replacement, if any
         if newhandler is not None:
             self.add_handler(newhandler)
@@ -422,6 +622,11 @@ class UserAgent(UserAgentBase):
         UserAgentBase.__init__(self)
         self._seekable = False
 
+    def __copy__(self):
+        ans = UserAgentBase.__copy__(self)
+        ans._seekable = self._seekable
+        return ans
+
     def set_seekable_responses(self, handle):
         """Make response objects .seek()able."""
         self._seekable = bool(handle)
@@ -437,8 +642,11 @@ class UserAgent(UserAgentBase):
                            timeout=_sockettimeout._GLOBAL_DEFAULT_TIMEOUT):
                 return UserAgentBase.open(self, fullurl, data, timeout)
 
-            response = _opener.wrapped_open(bound_open,
-                                            _response.seek_wrapped_response,
+            def seek_wrapped_response(response):
+                return _response.seek_wrapped_response(
+                    response, self._spool_threshold)
+
+            response = _opener.wrapped_open(bound_open, seek_wrapped_response,
                                             fullurl, data, timeout)
         else:
             response = UserAgentBase.open(self, fullurl, data)
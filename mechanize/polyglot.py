@@ -24,7 +24,8 @@ if is_py2:
     )
     from robotparser import RobotFileParser
     from urlparse import urlsplit, urljoin, urlparse, urlunparse
-    from httplib import HTTPMessage, HTTPConnection, HTTPSConnection
+    from httplib import (
+            HTTPMessage, HTTPConnection, HTTPSConnection, HTTPException)
     from cookielib import (
             DEFAULT_HTTP_PORT, CookiePolicy, DefaultCookiePolicy,
             FileCookieJar, LoadError, LWPCookieJar, _debug, domain_match,
@@ -33,6 +34,7 @@ if is_py2:
             MozillaCookieJar, request_host)
     from cStringIO import StringIO
     from future_builtins import map  # noqa
+    from time import time as perf_counter
 
     def is_string(x):
         return isinstance(x, basestring)
@@ -71,7 +73,7 @@ else:
             proxy_bypass as urllib_proxy_bypass, url2pathname, Request)
     from http.client import (
             HTTPMessage, parse_headers, HTTPConnection,
-            HTTPSConnection)
+            HTTPSConnection, HTTPException)
     from http.cookiejar import (
             DEFAULT_HTTP_PORT, CookiePolicy, DefaultCookiePolicy,
             FileCookieJar, LoadError, LWPCookieJar, _debug, domain_match,
@@ -79,6 +81,7 @@ else:
             request_path, request_port, user_domain_match, Cookie, CookieJar,
             MozillaCookieJar, request_host)
     from io import StringIO
+    from time import perf_counter
 
     def splitattr(url):
         words = url.split(';')
@@ -208,7 +211,7 @@ if False:
      splitvalue, splittype, unquote, unwrap, url2pathname)
     pathname2url, RobotFileParser, URLError, quote, HTTPConnection
     HTTPSConnection, StringIO, addinfourl, install_opener, build_opener
-    ProxyHandler, quote_plus, urlopen
+    ProxyHandler, quote_plus, urlopen, HTTPException, perf_counter
     (DEFAULT_HTTP_PORT, CookiePolicy, DefaultCookiePolicy,
      FileCookieJar, LoadError, LWPCookieJar, _debug,
      domain_match, eff_request_host, escape_path, is_HDN,
@@ -10,7 +10,8 @@ from unittest import TestCase
 import mechanize
 import mechanize._response
 import mechanize._testcase
-from mechanize._gzip import HTTPGzipProcessor, compress_readable_output
+from mechanize._gzip import (HTTPGzipProcessor, accepted_encodings,
+                             compress_readable_output)
 from mechanize.polyglot import (HTTPConnection, addinfourl, codepoint_to_chr,
                                 create_response_info, iteritems, unicode_type)
 
@@ -329,6 +330,57 @@ class BrowserTests(TestCase):
         br.back()
         self.assertFalse(br.reloaded)
 
+    def test_history_limits(self):
+        import mechanize
+        from mechanize._response import test_response
+
+        class Handler(mechanize.BaseHandler):
+            def __init__(self):
+                self.requests = []
+
+            def http_open(self, request):
+                self.requests.append(request.get_full_url())
+                return test_response(
+                    request.get_full_url() * 10, url=request.get_full_url())
+
+        def make_browser(history):
+            br = TestBrowser2(history=history)
+            handler = Handler()
+            br.add_handler(handler)
+            return br, handler
+
+        # max_entries: oldest entries are forgotten
+        br, handler = make_browser(mechanize.History(max_entries=2))
+        for i in range(4):
+            br.open("http://example.com/%d" % i).read()
+        self.assertEqual(len(br._history._history), 2)
+        br.back(2)
+        self.assertEqual(br.geturl(), "http://example.com/1")
+        self.assertRaises(mechanize.BrowserStateError, br.back)
+
+        # max_bytes: bodies of the oldest entries are evicted, and re-fetched
+        # by .back()
+        url_size = len("http://example.com/0") * 10
+        br, handler = make_browser(
+            mechanize.History(max_bytes=2 * url_size))
+        for i in range(4):
+            br.open("http://example.com/%d" % i).read()
+        self.assertEqual(br._history._cached_bytes, 2 * url_size)
+        del handler.requests[:]
+        self.assertEqual(br.back(2).read(), b"http://example.com/1" * 10)
+        self.assertEqual(handler.requests, [])
+        self.assertEqual(br.back().read(), b"http://example.com/0" * 10)
+        self.assertEqual(handler.requests, ["http://example.com/0"])
+        self.assertEqual(br._history._cached_bytes, 0)
+
+        # ...except for requests with data, whose bodies are kept on disk
+        br, handler = make_browser(mechanize.History(max_bytes=0))
+        br.open("http://example.com/0", data="spam=eggs").read()
+        br.open("http://example.com/1").read()
+        del handler.requests[:]
+        self.assertEqual(br.back().read(), b"http://example.com/0" * 10)
+        self.assertEqual(handler.requests, [])
+
     def test_viewing_html(self):
         # XXX not testing multiple Content-Type headers
         url = "http://example.com/"
@@ -750,11 +802,15 @@ class BrowserTests(TestCase):
         self.assertIsNone(req.get_header('Accept-Encoding'))
         p.request_gzip = True
         req = p.https_request(mechanize.Request(url))
-        self.assertEqual(req.get_header('Accept-Encoding'), 'gzip')
+        codings = ', '.join(accepted_encodings())
+        self.assertEqual(req.get_header('Accept-Encoding'), codings)
+        self.assertTrue(codings.startswith('gzip, deflate'))
         req = mechanize.Request(url)
-        req.add_header('Accept-Encoding', 'moo, *')
+        req.add_header('Accept-Encoding', 'moo, *, deflate')
         req = p.https_request(req)
-        self.assertEqual(req.get_header('Accept-Encoding'), 'moo, *, gzip')
+        self.assertEqual(req.get_header('Accept-Encoding'),
+                         'moo, *, deflate, ' + codings.replace(
+                             ', deflate', ''))
         data = os.urandom(1024 * 1024)
         cdata = b''.join(compress_readable_output(BytesIO(data)))
         r = MockResponse(
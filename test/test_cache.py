@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from unittest import TestCase
+
+import mechanize
+from mechanize._cache import CacheEntry, DiskCache, MemoryCache
+from mechanize._response import closeable_response, make_headers
+
+
+def http_date(t):
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(t))
+
+
+class FakeHTTPHandler(mechanize.BaseHandler):
+    # Serves queued (code, headers, body) responses, recording the requests.
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def http_open(self, req):
+        self.requests.append(req)
+        code, headers, body = self.responses.pop(0)
+        msg = {200: "OK", 304: "Not Modified"}.get(code, "Whatever")
+        return closeable_response(
+            BytesIO(body), make_headers(headers), req.get_full_url(), code,
+            msg)
+
+
+class HTTPCacheProcessorTests(TestCase):
+
+    def setUp(self):
+        self.handler = FakeHTTPHandler()
+        self.cache = MemoryCache()
+        self.opener = mechanize.OpenerDirector()
+        for h in (self.handler, mechanize.HTTPCacheProcessor(self.cache),
+                  mechanize.HTTPErrorProcessor(),
+                  mechanize.HTTPDefaultErrorHandler()):
+            self.opener.add_handler(h)
+
+    def fetch(self, url="http://example.com/", **kwds):
+        return self.opener.open(mechanize.Request(url, **kwds)).read()
+
+    def test_fresh_hit(self):
+        self.handler.responses.append((200, [
+            ("Date", http_date(time.time())),
+            ("Cache-Control", "max-age=60"),
+            ("Set-Cookie", "a=b")], b"body"))
+        self.assertEqual(self.fetch(), b"body")
+        r = self.opener.open("http://example.com/")
+        self.assertEqual(r.read(), b"body")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(len(self.handler.requests), 1)
+        self.assertTrue("Age" in r.info())
+        self.assertEqual(r.info().get("Set-Cookie"), None)
+
+        # other URLs and other methods go to the network
+        self.handler.responses.append((200, [], b"other"))
+        self.assertEqual(self.fetch("http://example.com/other"), b"other")
+        self.handler.responses.append((200, [], b"posted"))
+        self.assertEqual(self.fetch(data=b"x"), b"posted")
+        # a successful POST invalidated the entry
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(len(self.handler.requests), 3)
+
+    def test_request_directives(self):
+        self.handler.responses.append((200, [
+            ("Cache-Control", "max-age=60")], b"body"))
+        self.fetch()
+        self.handler.responses.append((200, [], b"new"))
+        self.assertEqual(
+            self.fetch(headers={"Cache-Control": "no-cache"}), b"new")
+        self.assertEqual(len(self.handler.requests), 2)
+        self.handler.responses.append((200, [], b"new"))
+        self.cache.set("http://example.com/", CacheEntry(
+            "http://example.com/", 200, "OK",
+            [("Cache-Control", "max-age=60")], b"body", [],
+            time.time() - 30, time.time() - 30))
+        self.assertEqual(
+            self.fetch(headers={"Cache-Control": "max-age=10"}), b"new")
+
+    def test_not_stored(self):
+        for headers in ([("Cache-Control", "no-store, max-age=60")],
+                        [("Cache-Control", "max-age=60"), ("Vary", "*")],
+                        # neither fresh nor revalidatable
+                        []):
+            self.handler.responses.append((200, headers, b"body"))
+            self.fetch()
+            self.assertEqual(len(self.cache), 0)
+        # a body that was not read to the end is not stored
+        self.handler.responses.append((200, [
+            ("Cache-Control", "max-age=60")], b"body"))
+        r = self.opener.open("http://example.com/")
+        r.read(1)
+        r.close()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_revalidation(self):
+        now = time.time()
+        self.handler.responses.append((200, [
+            ("Date", http_date(now)),
+            ("Cache-Control", "no-cache"),
+            ("ETag", '"v1"'),
+            ("X-Version", "1")], b"body"))
+        self.assertEqual(self.fetch(), b"body")
+        self.handler.responses.append((304, [
+            ("Date", http_date(now)), ("X-Version", "2")], b""))
+        r = self.opener.open("http://example.com/")
+        self.assertEqual(r.code, 200)
+        self.assertEqual(r.read(), b"body")
+        self.assertEqual(r.info()["X-Version"], "2")
+        req = self.handler.requests[-1]
+        self.assertEqual(req.get_header("If-none-match"), '"v1"')
+        self.assertEqual(self.cache.get(
+            "http://example.com/").validators(), ('"v1"', None))
+
+        # a new response replaces the entry
+        self.handler.responses.append((200, [
+            ("Cache-Control", "no-cache"), ("ETag", '"v2"')], b"new"))
+        self.assertEqual(self.fetch(), b"new")
+        self.assertEqual(self.cache.get(
+            "http://example.com/").validators(), ('"v2"', None))
+
+        # the caller's own conditional requests are left alone
+        self.handler.responses.append((304, [], b""))
+        self.assertRaises(mechanize.HTTPError, self.fetch, headers={
+            "If-None-Match": '"v0"'})
+
+    def test_vary(self):
+        self.handler.responses.append((200, [
+            ("Cache-Control", "max-age=60"),
+            ("Vary", "Accept-Language")], b"en"))
+        self.fetch(headers={"Accept-Language": "en"})
+        self.assertEqual(self.fetch(headers={"Accept-Language": "en"}), b"en")
+        self.handler.responses.append((200, [], b"fr"))
+        self.assertEqual(self.fetch(headers={"Accept-Language": "fr"}), b"fr")
+        self.assertEqual(len(self.handler.requests), 2)
+
+    def test_freshness(self):
+        now = time.time()
+
+        def entry(headers, request_time=now, response_time=now):
+            return CacheEntry("http://example.com/", 200, "OK", headers,
+                              b"", [], request_time, response_time)
+        self.assertEqual(entry([("Expires", http_date(now + 100)),
+                                ("Date", http_date(now))]
+                               ).freshness_lifetime(), 100)
+        # heuristic: 10% of the time since last modification, at most a day
+        self.assertEqual(entry([("Last-Modified", http_date(now - 1000)),
+                                ("Date", http_date(now))]
+                               ).freshness_lifetime(), 100)
+        self.assertEqual(entry([("Last-Modified", http_date(0)),
+                                ("Date", http_date(now))]
+                               ).freshness_lifetime(), 24 * 60 * 60)
+        e = entry([("Age", "10"), ("Date", http_date(now - 5))],
+                  request_time=now - 2)
+        self.assertAlmostEqual(e.current_age(now + 1), 13, delta=1)
+
+    def test_useragent(self):
+        ua = mechanize.UserAgentBase()
+        ua.set_http_cache(self.cache)
+        self.assertTrue(ua._ua_handlers["_cache"].cache is self.cache)
+        ua.set_http_cache(None)
+        self.assertFalse("_cache" in ua._ua_handlers)
+
+
+class CacheBackendTests(TestCase):
+
+    def entry(self, url, body=b"body"):
+        return CacheEntry(url, 200, "OK", [("ETag", '"x"')], body, [],
+                          time.time(), time.time())
+
+    def test_memory_cache(self):
+        cache = MemoryCache(max_entries=2, max_size=10)
+        cache.set("a", self.entry("a"))
+        cache.set("b", self.entry("b"))
+        self.assertEqual(cache.get("a").url, "a")
+        cache.set("c", self.entry("c"))
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get("b") is None)
+        cache.set("d", self.entry("d", b"x" * 8))
+        self.assertEqual(len(cache), 1)
+        cache.delete("d")
+        self.assertEqual(len(cache), 0)
+
+    def test_disk_cache(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            directory = os.path.join(tempdir, "cache")
+            cache = DiskCache(directory)
+            cache.set("http://example.com/", self.entry("http://example.com/"))
+            entry = DiskCache(directory).get("http://example.com/")
+            self.assertEqual(entry.body, b"body")
+            self.assertEqual(entry.validators(), ('"x"', None))
+            self.assertTrue(cache.get("http://example.com/other") is None)
+            self.assertEqual(len(cache), 1)
+            cache.delete("http://example.com/")
+            self.assertTrue(cache.get("http://example.com/") is None)
+            cache.delete("http://example.com/")
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_disk_cache_clear(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = DiskCache(directory)
+            cache.set("a", self.entry("a"))
+            with open(os.path.join(directory, "notes.json"), "wb") as f:
+                f.write(b"{}")
+            cache.clear()
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(os.listdir(directory), ["notes.json"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_disk_cache_format(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = DiskCache(directory)
+            url = "http://example.com/"
+            cache.set(url, self.entry(url))
+            path = cache._path(url)
+            with open(path + ".body", "rb") as f:
+                self.assertEqual(f.read(), b"body")
+            with open(path + ".json", "rb") as f:
+                meta = json.loads(f.read().decode("utf-8"))
+            self.assertEqual(meta["url"], url)
+            self.assertEqual(meta["headers"], [["ETag", '"x"']])
+            # a body that doesn't belong to the metadata is ignored
+            with open(path + ".body", "wb") as f:
+                f.write(b"other")
+            self.assertTrue(cache.get(url) is None)
+            # so is a corrupt metadata file
+            cache.set(url, self.entry(url))
+            with open(path + ".json", "wb") as f:
+                f.write(b"{")
+            self.assertTrue(cache.get(url) is None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_disk_cache_eviction(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = DiskCache(directory, max_size=10)
+            cache.set("a", self.entry("a"))
+            cache.set("b", self.entry("b"))
+            # make "a" the least recently used, whatever the resolution of
+            # file timestamps
+            os.utime(cache._path("a") + ".json", (0, 0))
+            cache.set("c", self.entry("c"))
+            self.assertEqual(len(cache), 2)
+            self.assertTrue(cache.get("a") is None)
+            self.assertEqual(cache.get("b").body, b"body")
+            cache.set("d", self.entry("d", b"x" * 20))
+            self.assertTrue(cache.get("d") is None)
+            # sizes are only read from the directory again when it is full
+            scans = []
+            orig_scan = cache._scan
+
+            def scan():
+                scans.append(1)
+                orig_scan()
+            cache._scan = scan
+            cache.delete("b")
+            cache.set("e", self.entry("e", b"x"))
+            self.assertEqual(scans, [])
+            cache.set("f", self.entry("f", b"x" * 8))
+            self.assertEqual(scans, [1])
+            self.assertTrue(cache.get("c") is None)
+            self.assertEqual(cache.get("f").body, b"x" * 8)
+            self.assertEqual(len(cache), 2)
+            # a new instance finds the existing entries
+            self.assertEqual(DiskCache(directory, max_size=10)._size, 9)
+            cache.delete("e")
+            cache.delete("f")
+            cache.set("b", self.entry("b"))
+            cache.set("c", self.entry("c"))
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                sorted(cache._path(k)[len(directory) + 1:] + suffix
+                       for k in "bc" for suffix in (".body", ".json")))
+        finally:
+            shutil.rmtree(directory)
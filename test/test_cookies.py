@@ -230,6 +230,63 @@ class CookieJarInterfaceTests(unittest.TestCase):
         request = StubRequest(dict(unverifiable=False))
         self.assertEqual(request_is_unverifiable(request), False)
 
+    def test_cookies_for_request_index(self):
+        from mechanize import CookieJar, DefaultCookiePolicy
+
+        class UnindexedPolicy(DefaultCookiePolicy):
+            # overriding domain_return_ok() turns off the domain index
+            def domain_return_ok(self, domain, request):
+                return DefaultCookiePolicy.domain_return_ok(
+                    self, domain, request)
+
+        jar = CookieJar()
+        for i in range(20):
+            host = "http://www%d.example.com" % i
+            interact_netscape(jar, host + "/", "host=%d" % i)
+            interact_netscape(jar, host + "/a/", "path=%d; path=/a" % i)
+            interact_netscape(jar, host + "/",
+                              "dom%d=1; domain=.example.com" % i)
+        interact_netscape(jar, "http://intranet/", "local=1")
+        interact_netscape(jar, "http://example.org/", "other=1")
+
+        def cookies(url):
+            return [(c.name, c.value, c.path)
+                    for c in jar.cookies_for_request(Request(url))]
+
+        urls = ["http://www3.example.com/a/b", "http://www3.example.com/",
+                "http://example.com/", "http://x.www7.example.com/a",
+                "http://intranet/", "http://intranet.local/",
+                "http://example.org/", "http://nowhere.test/"]
+        indexed = [cookies(url) for url in urls]
+        jar.set_policy(UnindexedPolicy())
+        for url, expected in zip(urls, indexed):
+            got = cookies(url)
+            self.assertEqual(sorted(got), sorted(expected))
+            self.assertEqual([c[2] for c in got], [c[2] for c in expected])
+        jar.set_policy(DefaultCookiePolicy())
+        self.assertEqual(len(cookies(urls[0])), 22)
+
+        # the cached lookups are dropped when the jar changes
+        interact_netscape(jar, urls[0], "new=1")
+        self.assertIn(("new", "1", "/a"), cookies(urls[0]))
+        jar.clear(".example.com")
+        self.assertEqual(len(cookies(urls[0])), 3)
+        jar.clear()
+        self.assertEqual(cookies(urls[0]), [])
+
+        # add_cookie_header() sweeps out expired cookies, but only once the
+        # earliest expiry time has passed
+        interact_netscape(jar, urls[0], "a=1; max-age=3600")
+        interact_netscape(jar, urls[0])
+        self.assertEqual(len(jar), 1)
+        cookie = list(jar)[0]
+        cookie.expires = time.time() - 1
+        interact_netscape(jar, urls[0])
+        self.assertEqual(len(jar), 1)
+        jar.set_cookie(cookie)
+        self.assertEqual(interact_netscape(jar, urls[0]), "")
+        self.assertEqual(len(jar), 0)
+
 
 class CookieTests(unittest.TestCase):
     # XXX
@@ -1118,6 +1175,60 @@ class CookieJarPersistenceTests(TempfileTestMixin, unittest.TestCase):
         interact_netscape(cj, "http://www.foo.com/",
                           "fooc=bar; Domain=www.foo.com; %s" % expires)
 
+    def test_sqlite_cookiejar(self):
+        from mechanize import DefaultCookiePolicy, SQLiteCookieJar
+        filename = self.mktemp()
+        for suffix in "-wal", "-shm":
+            self._tempfiles.append(filename + suffix)
+
+        def create_cookiejar():
+            cj = SQLiteCookieJar(filename,
+                                 policy=DefaultCookiePolicy(rfc2965=True))
+            self.addCleanup(cj.close)
+            return cj
+
+        cj = create_cookiejar()
+        self._interact(cj)
+        self.assertEqual(len(cj), 6)
+        cj.close()
+
+        # cookies are read back a domain at a time
+        cj = create_cookiejar()
+
+        def cookie_names(cj, url, *set_cookie_hdrs):
+            hdr = interact_netscape(cj, url, *set_cookie_hdrs)
+            return sorted(c.split("=")[0] for c in hdr.split("; ") if c)
+
+        self.assertEqual(cookie_names(cj, "http://www.foo.com/"),
+                         ["fooa", "foob", "fooc"])
+        self.assertEqual(sorted(cj._cookies), [".foo.com", ".www.foo.com",
+                                               "www.foo.com"])
+        self.assertEqual(len(cj), 6)
+        cj.clear_session_cookies()
+        self.assertEqual(len(cj), 4)
+        self.assertTrue("name='foo1', value='bar'" in repr(cj))
+
+        # changes made by another jar on the same database are seen
+        other = create_cookiejar()
+        other.clear("www.acme.com", "/", "foo1")
+        other.commit()
+        interact_netscape(other, "http://www.foo.com/", "new=1")
+        self.assertEqual(cookie_names(cj, "http://www.foo.com/"),
+                         ["fooa", "foob", "fooc", "new"])
+        self.assertEqual(
+            sorted(cookie.name for cookie in cj),
+            ["fooa", "foob", "fooc", "new"])
+
+        # expired cookies are not read back
+        cj.set_cookie(mechanize.Cookie(
+            0, "old", "1", None, False, "www.foo.com", False, False, "/",
+            False, False, int(time.time()) - 1, False, None, None, {}))
+        cj.commit()
+        self.assertEqual(len(create_cookiejar()), 4)
+        cj.clear()
+        cj.commit()
+        self.assertEqual(len(create_cookiejar()), 0)
+
     def test_firefox3_cookiejar_restore(self):
         try:
             from mechanize import Firefox3CookieJar
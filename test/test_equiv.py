@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+"""Tests for mechanize._equiv.HTTPEquivParser.
+
+Run this file with --benchmark to compare its speed with the byte-at-a-time
+implementation it replaced, which is kept here as a reference.
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import string
+import sys
+import timeit
+import unittest
+
+from mechanize._equiv import HTTPEquivParser, replace_entity
+
+space_chars = frozenset(("\t", "\n", "\u000C", " ", "\r"))
+space_chars_bytes = frozenset(item.encode("ascii") for item in space_chars)
+ascii_letters_bytes = frozenset(
+    item.encode("ascii") for item in string.ascii_letters)
+spaces_angle_brackets = space_chars_bytes | frozenset((b">", b"<"))
+skip1 = space_chars_bytes | frozenset((b"/", ))
+head_elems = frozenset((
+    b"html", b"head", b"title", b"base", b"script",
+    b"style", b"meta", b"link", b"object"))
+
+
+class Bytes(bytes):
+    """String-like object with an associated position and various extra methods
+    If the position is ever greater than the string length then an exception is
+    raised"""
+
+    def __init__(self, value):
+        self._position = -1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        p = self._position = self._position + 1
+        if p >= len(self):
+            raise StopIteration
+        elif p < 0:
+            raise TypeError
+        return self[p:p + 1]
+
+    def next(self):
+        # Py2 compat
+        return self.__next__()
+
+    def previous(self):
+        p = self._position
+        if p >= len(self):
+            raise StopIteration
+        elif p < 0:
+            raise TypeError
+        self._position = p = p - 1
+        return self[p:p + 1]
+
+    @property
+    def position(self):
+        if self._position >= len(self):
+            raise StopIteration
+        if self._position >= 0:
+            return self._position
+
+    @position.setter
+    def position(self, position):
+        if self._position >= len(self):
+            raise StopIteration
+        self._position = position
+
+    @property
+    def current_byte(self):
+        return self[self.position:self.position + 1]
+
+    def skip(self, chars=space_chars_bytes):
+        """Skip past a list of characters"""
+        p = self.position  # use property for the error-checking
+        while p < len(self):
+            c = self[p:p + 1]
+            if c not in chars:
+                self._position = p
+                return c
+            p += 1
+        self._position = p
+        return
+
+    def skip_until(self, chars):
+        p = pos = self.position
+        while p < len(self):
+            c = self[p:p + 1]
+            if c in chars:
+                self._position = p
+                return self[pos:p], c
+            p += 1
+        self._position = p
+        return b'', b''
+
+    def match_bytes(self, bytes):
+        """Look for a sequence of bytes at the start of a string. If the bytes
+        are found return True and advance the position to the byte after the
+        match. Otherwise return False and leave the position alone"""
+        p = self.position
+        data = self[p:p + len(bytes)]
+        rv = data.startswith(bytes)
+        if rv:
+            self.position += len(bytes)
+        return rv
+
+    def match_bytes_pat(self, pat):
+        bytes = pat.pattern
+        m = pat.match(self, self.position)
+        if m is None:
+            return False
+        bytes = m.group()
+        self.position += len(bytes)
+        return True
+
+    def jump_to(self, bytes):
+        """Look for the next sequence of bytes matching a given sequence. If
+        a match is found advance the position to the last byte of the match"""
+        new_pos = self.find(bytes, max(0, self.position))
+        if new_pos > -1:
+            new_pos -= self.position
+            if self._position == -1:
+                self._position = 0
+            self._position += (new_pos + len(bytes) - 1)
+            return True
+        else:
+            raise StopIteration
+
+
+class ReferenceHTTPEquivParser(object):
+    """The original byte-at-a-time parser, which HTTPEquivParser must agree
+    with"""
+
+    def __init__(self, data):
+        """string - the data to work on """
+        self.data = Bytes(data)
+        self.headers = []
+
+    def __call__(self):
+        mb, mbp = self.data.match_bytes, self.data.match_bytes_pat
+        dispatch = (
+                (mb, b"<!--", self.handle_comment),
+                (mbp, re.compile(b"<meta", flags=re.IGNORECASE),
+                    self.handle_meta),
+                (mbp, re.compile(b"</head", flags=re.IGNORECASE),
+                    lambda: False),
+                (mb, b"</", self.handle_possible_end_tag),
+                (mb, b"<!", self.handle_other),
+                (mb, b"<?", self.handle_other),
+                (mb, b"<", self.handle_possible_start_tag)
+        )
+        for byte in self.data:
+            keep_parsing = True
+            for matcher, key, method in dispatch:
+                if matcher(key):
+                    try:
+                        keep_parsing = method()
+                        break
+                    except StopIteration:
+                        keep_parsing = False
+                        break
+            if not keep_parsing:
+                break
+
+        ans = []
+        entity_pat = re.compile(r'&(\S+?);')
+        for name, val in self.headers:
+            try:
+                name, val = name.decode('ascii'), val.decode('ascii')
+            except ValueError:
+                continue
+            name = entity_pat.sub(replace_entity, name)
+            val = entity_pat.sub(replace_entity, val)
+            try:
+                name, val = name.encode('ascii'), val.encode('ascii')
+            except ValueError:
+                continue
+            ans.append((name, val))
+        return ans
+
+    def handle_comment(self):
+        """Skip over comments"""
+        return self.data.jump_to(b"-->")
+
+    def handle_meta(self):
+        if self.data.current_byte not in space_chars_bytes:
+            # if we have <meta not followed by a space so just keep going
+            return True
+        # We have a valid meta element we want to search for attributes
+        pending_header = pending_content = None
+
+        while True:
+            # Try to find the next attribute after the current position
+            attr = self.get_attribute()
+            if attr is None:
+                return True
+            name, val = attr
+            name = name.lower()
+            if name == b"http-equiv":
+                if val:
+                    val = val.lower()
+                    if pending_content:
+                        self.headers.append((val, pending_content))
+                        return True
+                    pending_header = val
+            elif name == b'content':
+                if val:
+                    if pending_header:
+                        self.headers.append((pending_header, val))
+                        return True
+                    pending_content = val
+        return True
+
+    def handle_possible_start_tag(self):
+        return self.handle_possible_tag(False)
+
+    def handle_possible_end_tag(self):
+        next(self.data)
+        return self.handle_possible_tag(True)
+
+    def handle_possible_tag(self, end_tag):
+        data = self.data
+        if data.current_byte not in ascii_letters_bytes:
+            # If the next byte is not an ascii letter either ignore this
+            # fragment (possible start tag case) or treat it according to
+            # handle_other
+            if end_tag:
+                data.previous()
+                self.handle_other()
+            return True
+
+        tag_name, c = data.skip_until(spaces_angle_brackets)
+        tag_name = tag_name.lower()
+        if not end_tag and tag_name not in head_elems:
+            return False
+        if c == b"<":
+            # return to the first step in the overall "two step" algorithm
+            # reprocessing the < byte
+            data.previous()
+        else:
+            # Read all attributes
+            attr = self.get_attribute()
+            while attr is not None:
+                attr = self.get_attribute()
+        return True
+
+    def handle_other(self):
+        return self.data.jump_to(b">")
+
+    def get_attribute(self):
+        """Return a name,value pair for the next attribute in the stream,
+        if one is found, or None"""
+        data = self.data
+        # Step 1 (skip chars)
+        c = data.skip(skip1)
+        assert c is None or len(c) == 1
+        # Step 2
+        if c in (b">", None):
+            return None
+        # Step 3
+        attr_name = []
+        attr_value = []
+        # Step 4 attribute name
+        while True:
+            if c == b"=" and attr_name:
+                break
+            elif c in space_chars_bytes:
+                # Step 6!
+                c = data.skip()
+                break
+            elif c in (b"/", b">"):
+                return b"".join(attr_name), b""
+            elif c is None:
+                return None
+            else:
+                attr_name.append(c)
+            # Step 5
+            c = next(data)
+        # Step 7
+        if c != b"=":
+            data.previous()
+            return b"".join(attr_name), b""
+        # Step 8
+        next(data)
+        # Step 9
+        c = data.skip()
+        # Step 10
+        if c in (b"'", b'"'):
+            # 10.1
+            quote_char = c
+            while True:
+                # 10.2
+                c = next(data)
+                # 10.3
+                if c == quote_char:
+                    next(data)
+                    return b"".join(attr_name), b"".join(attr_value)
+                # 10.4
+                else:
+                    attr_value.append(c)
+        elif c == b">":
+            return b"".join(attr_name), b""
+        elif c is None:
+            return None
+        else:
+            attr_value.append(c)
+        # Step 11
+        while True:
+            c = next(data)
+            if c in spaces_angle_brackets:
+                return b"".join(attr_name), b"".join(attr_value)
+            elif c is None:
+                return None
+            else:
+                attr_value.append(c)
+
+
+def realistic_head(size):
+    # The sort of <head> served by news and shopping sites: lots of
+    # <meta>/<link> tags, inline scripts and styles, and a couple of
+    # http-equiv headers.
+    parts = [
+        b'<!DOCTYPE html>\n<html lang="en" class="no-js">\n<head>\n',
+        b'<meta charset="utf-8">\n',
+        b'<meta http-equiv="X-UA-Compatible" content="IE=edge">\n',
+        b'<title>Some page &amp; its title</title>\n',
+        b'<!-- generated by SomeCMS 4.2 -->\n',
+    ]
+    n = 0
+    while sum(map(len, parts)) < size:
+        n += 1
+        parts.append(
+            b'<meta property="og:item%d" content="Lorem ipsum dolor sit amet,'
+            b' consectetur adipiscing elit">\n'
+            b'<link rel="preload" href="/static/js/chunk.%d.js" as="script"'
+            b' crossorigin>\n'
+            b'<script type="text/javascript">window.dataLayer=window.dataLaye'
+            b'r||[];dataLayer.push({"page":%d});</script>\n'
+            b'<style>.c%d{margin:0 auto;padding:4px}</style>\n' % (
+                n, n, n, n))
+    parts.append(
+        b'<meta http-equiv="refresh" content="300; url=/">\n</head>\n')
+    return b''.join(parts)
+
+
+def random_document(rng):
+    fragments = (
+        b"<", b">", b"/", b"=", b"'", b'"', b" ", b"\n", b"\x0c", b"a",
+        b"<meta", b"<META ", b"<meta ", b"http-equiv", b"content",
+        b"http-equiv=", b" content=", b"<meta http-equiv=", b"<meta content=",
+        b'"v"', b"refresh", b"<!--", b"-->", b"<!", b"<?", b"</", b"</head",
+        b"<title", b"<link", b"<p", b"</x", b"&amp;", b"<</")
+    return b"".join(
+        rng.choice(fragments) for i in range(rng.randint(0, 25)))
+
+
+class HTTPEquivParserTests(unittest.TestCase):
+
+    def assert_same_as_reference(self, html):
+        self.assertEqual(HTTPEquivParser(html)(),
+                         ReferenceHTTPEquivParser(html)(), html)
+
+    def test_edge_cases(self):
+        for html in (
+                b"",
+                b"<",
+                b"<meta",
+                b"<meta http-equiv=refresh content=1",
+                b"<meta http-equiv=refresh content=1>",
+                b"<meta http-equiv=refresh content='1'",
+                b"<meta http-equiv=refresh content='1'>",
+                b"<meta http-equiv=refresh content=1<meta http-equiv=a "
+                b"content=b>",
+                b"<meta content = 1 / http-equiv = refresh >",
+                b"<meta =x http-equiv=refresh content=1>",
+                b"<meta<meta http-equiv=refresh content=1>",
+                b"<<meta http-equiv=refresh content=1>",
+                b"</x<meta http-equiv=refresh content=1>",
+                b"</ti><meta http-equiv=refresh content=1>",
+                b"</1 x> <meta http-equiv=refresh content=1>",
+                b"<!-- <meta http-equiv=a content=b> --><meta "
+                b"http-equiv=c content=d>",
+                b"<!--><meta http-equiv=a content=b>",
+                b"<? x ><meta http-equiv=a content=b>",
+                b"<title<meta http-equiv=a content=b>",
+                b"<title x='<p>'><meta http-equiv=a content=b>",
+                b"<p><meta http-equiv=a content=b>",
+                b"</HEAD><meta http-equiv=a content=b>",
+                b"<META HTTP-EQUIV=A CONTENT=B>",
+                b"<meta http-equiv=a\x0ccontent=b\x0c>",
+                realistic_head(4096),
+        ):
+            self.assert_same_as_reference(html)
+
+    def test_random_documents(self):
+        rng = random.Random(1)
+        for i in range(2000):
+            self.assert_same_as_reference(random_document(rng))
+
+
+def benchmark():
+    for size in (4096, 64 * 1024):
+        html = realistic_head(size)
+        print("%d byte head:" % len(html))
+        for parser in (ReferenceHTTPEquivParser, HTTPEquivParser):
+            number = 20
+
+            def run():
+                parser(html)()
+            elapsed = min(timeit.repeat(run, number=number, repeat=5))
+            print("  %-25s %8.1f us" % (
+                parser.__name__, elapsed / number * 1e6))
+
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv[1:]:
+        benchmark()
+    else:
+        unittest.main()
@@ -2228,6 +2228,68 @@ class FormTests(unittest.TestCase):  # {{{
         ctl = form.find_control(type="checkbox", name=mechanize.Missing, nr=1)
         self.assertEqual(ctl.id, "a")
 
+    def test_find_control_index(self):
+        f = BytesIO(b"""\
+<form>
+  <input type="text" name="a" id="t1" />
+  <input type="checkbox" name="a" value="1" />
+  <input type="text" name="b" id="t2" />
+  <input type="checkbox" name="a" value="2" />
+</form>
+""")
+        form = parse_file(f, "http://example.com/")[0]
+        fc = form.find_control
+        self.assertEqual(len(form.controls), 3)
+        self.assertEqual(fc("a", type="checkbox").possible_items(), ["1", "2"])
+        self.assertEqual(fc("a", nr=0).id, "t1")
+        self.assertRaises(AmbiguityError, fc, "a")
+        self.assertRaises(ControlNotFoundError, fc, "a", type="radio")
+        self.assertEqual(fc(id="t2").name, "b")
+
+        # the index follows controls added later, and id changes
+        form.new_control("text", "a", {"id": "t3"})
+        self.assertEqual(fc("a", nr=2).id, "t3")
+        self.assertEqual(fc(id="t3").name, "a")
+        fc("b").id = "t4"
+        self.assertRaises(ControlNotFoundError, fc, id="t2")
+        self.assertEqual(fc(id="t4").name, "b")
+        form.controls.reverse()
+        form.controls.pop()
+        self.assertRaises(ControlNotFoundError, fc, id="t1")
+        self.assertEqual(fc("a", nr=0).id, "t3")
+
+        # a control given an id already in use is found by that id, too
+        form = parse_file(BytesIO(
+            b'<form><input name=a id=x><input name=b id=y></form>'),
+            "http://example.com/")[0]
+        form.find_control(id="x")
+        form.find_control(name="b").id = "x"
+        self.assertRaises(AmbiguityError, form.find_control, id="x")
+        self.assertEqual(form.find_control(id="x", nr=1).name, "b")
+        self.assertRaises(ControlNotFoundError, form.find_control, id="y")
+
+    def test_forms_parser_is_lazy(self):
+        html = b"""\
+<form name="f1"><input name="a" form="f3id"><select name="s" form="f3id">
+  <option>x</select></form>
+<form name="f2"><input name="b"></form>
+<form name="f3" id="f3id"><input name="c"></form>
+<input name="g">
+"""
+        expected = [str(f) for f in parse_file_ex(BytesIO(html), "http://x/")]
+        parser = _form.FormsParser(content_parser(html), "http://x/")
+        forms = iter(parser)
+        f1 = next(forms)
+        self.assertEqual(f1.name, "f1")
+        self.assertEqual(parser.nr_done, 1)
+        self.assertEqual(len(parser.forms[1].controls), 0)
+        self.assertTrue(list(parser)[0] is f1)
+        self.assertEqual(
+            [str(f) for f in [parser.global_form] + parser.all_forms()],
+            expected)
+        self.assertEqual(
+            [c.name for c in parser.forms[2].controls], ["a", "s", "c"])
+
     def test_deselect_disabled(self):
         def get_new_form(f, compat):
             f.seek(0)
@@ -3433,6 +3495,46 @@ john\r
 --1--\r
 ''')
 
+    def test_streamed_multipart_file_request(self):
+        def make_request(stream):
+            self.boundary_count = 0
+            form = self.make_form()
+            form.stream_multipart = stream
+            form["user"] = "john"
+            data_control = form.find_control("data")
+            data_control.add_file(BytesIO(b"blah\nbaz\n"), filename="a")
+            data_control.add_file(BytesIO(b"rhubarb\n" * 1000))
+            return form.click()
+
+        expected = make_request(False).get_data()
+        req = make_request(True)
+        body = req.get_data()
+        self.assertEqual(body.length, len(expected))
+        chunks = []
+        while True:
+            chunk = body.read(100)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= 100)
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), expected)
+        # can be re-sent, e.g. after an authentication challenge
+        body.seek(0)
+        self.assertEqual(body.read(), expected)
+
+    def test_streamed_upload_of_unknown_size(self):
+        class Unseekable:
+            def __init__(self, data):
+                self.read = BytesIO(data).read
+
+        form = self.make_form()
+        form.stream_multipart = True
+        form.find_control("data").add_file(Unseekable(b"blah\nbaz\n"))
+        body = form.click().get_data()
+        self.assertIsNone(body.length)
+        self.assertIn(b"\r\n\r\nblah\nbaz\n\r\n", body.read())
+        self.assertRaises(ValueError, body.seek, 0)
+
     def test_upload_data(self):
         form = self.make_form()
         data = form.click().get_data()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+import copy
+import gzip
+import os
+import random
+import unittest
+import zlib
+from io import BytesIO
+
+import mechanize
+from mechanize._gzip import (GzipBody, HTTPGzipProcessor, UnzipWrapper,
+                             ZstdDecompressor, ZstdWrapper,
+                             compress_readable_output,
+                             create_deflate_decompressor,
+                             create_gzip_decompressor)
+from mechanize._response import closeable_response, make_headers
+
+
+def gzipped(data, **kwds):
+    out = BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb", **kwds)
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+class CountingFile(object):
+    # records how much of the compressed stream has been read
+
+    def __init__(self, data):
+        self._f = BytesIO(data)
+        self.amt_read = 0
+
+    def read(self, sz=-1):
+        data = self._f.read(sz)
+        self.amt_read += len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+
+def lines_of(rng, nr_lines):
+    return [b"x" * rng.randint(0, 100) + b"\n" for i in range(nr_lines)]
+
+
+class UnzipWrapperTests(unittest.TestCase):
+
+    def unzipper(self, data, chunk_size=None, **kwds):
+        return create_gzip_decompressor(BytesIO(gzipped(data, **kwds)),
+                                        chunk_size)
+
+    def test_read(self):
+        rng = random.Random(1)
+        data = os.urandom(100 * 1024) + b"a" * (300 * 1024)
+        for chunk_size in None, 1, 7, 1000:
+            self.assertEqual(self.unzipper(data, chunk_size).read(), data)
+            f = self.unzipper(data, chunk_size)
+            pieces = []
+            while True:
+                piece = f.read(rng.randint(0, 5000))
+                if not piece and f.read(1) == b"":
+                    break
+                pieces.append(piece)
+            self.assertEqual(b"".join(pieces), data)
+        self.assertEqual(self.unzipper(b"").read(), b"")
+        # header with extra field, file name and comment
+        gz = bytearray(gzipped(b"spam"))
+        gz[3] = 4 | 8 | 16
+        gz[10:10] = b"\x02\x00xyname\0comment\0"
+        f = create_gzip_decompressor(BytesIO(bytes(gz)))
+        self.assertEqual(f.read(), b"spam")
+
+    def test_readinto(self):
+        data = os.urandom(50 * 1024)
+        f = self.unzipper(data, 100)
+        buf = bytearray(3000)
+        out = []
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            out.append(bytes(buf[:n]))
+        self.assertEqual(b"".join(out), data)
+
+    def test_readline(self):
+        rng = random.Random(2)
+        lines = lines_of(rng, 1000) + [b"no newline"]
+        data = b"".join(lines)
+        for chunk_size in None, 1, 50:
+            f = self.unzipper(data, chunk_size)
+            self.assertEqual(list(f), lines)
+            self.assertEqual(f.readline(), b"")
+            f = self.unzipper(data, chunk_size)
+            self.assertEqual(f.readlines(), lines)
+            f = self.unzipper(data, chunk_size)
+            self.assertEqual([f.readline(), f.readline()], lines[:2])
+            self.assertEqual(f.read(), b"".join(lines[2:]))
+        f = self.unzipper(b"abcdef\nghi\n")
+        self.assertEqual(f.readline(4), b"abcd")
+        self.assertEqual(f.readline(4), b"ef\n")
+        self.assertEqual(f.readline(0), b"")
+        self.assertEqual(next(f), b"ghi\n")
+        self.assertRaises(StopIteration, next, f)
+
+    def test_incremental(self):
+        # reading a line must not decompress the whole body
+        data = b"".join(lines_of(random.Random(3), 50000))
+        fp = CountingFile(gzipped(data))
+        f = create_gzip_decompressor(fp, 1024)
+        f.readline()
+        self.assertLess(fp.amt_read, 20 * 1024)
+        f.read(10)
+        self.assertLess(fp.amt_read, 20 * 1024)
+
+        # highly compressible data is decompressed a bounded amount at a time
+        fp = CountingFile(gzipped(b"\0" * (10 * 1024 * 1024)))
+        f = create_gzip_decompressor(fp)
+        self.assertEqual(len(f.read(10)), 10)
+        self.assertLessEqual(len(f._DecompressWrapper__buf),
+                             UnzipWrapper.CHUNK_SIZE)
+
+    def test_errors(self):
+        data = os.urandom(10000)
+        gz = gzipped(data)
+        corrupt = gz[:-8] + b"\0\0\0\0" + gz[-4:]
+        self.assertRaises(ValueError,
+                          create_gzip_decompressor(BytesIO(corrupt)).read)
+        self.assertRaises(ValueError,
+                          create_gzip_decompressor(BytesIO(gz[:-20])).read)
+        self.assertRaises(ValueError, create_gzip_decompressor,
+                          BytesIO(b"not gzip data"))
+
+    def test_compress_readable_output(self):
+        data = os.urandom(100000)
+        cdata = b"".join(compress_readable_output(BytesIO(data)))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(cdata)).read(), data)
+        self.assertEqual(create_gzip_decompressor(BytesIO(cdata)).read(),
+                         data)
+
+
+def deflated(data, wbits=zlib.MAX_WBITS):
+    zobj = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return zobj.compress(data) + zobj.flush()
+
+
+class ContentDecodingTests(unittest.TestCase):
+
+    def response(self, body, coding, code=200):
+        headers = make_headers([("Content-Encoding", coding),
+                                ("Content-Length", str(len(body)))])
+        return closeable_response(BytesIO(body), headers,
+                                  "http://example.com/", code, "OK")
+
+    def decode(self, body, coding, request=None, code=200):
+        p = HTTPGzipProcessor()
+        return p.http_response(request, self.response(body, coding, code))
+
+    def test_no_body(self):
+        # HEAD, 204 and 304 responses carry the headers of the encoded
+        # representation, but no body
+        head = mechanize.Request("http://example.com/", method="HEAD")
+        get = mechanize.Request("http://example.com/")
+        for coding in "gzip", "deflate", "gzip, deflate":
+            for request, code in (head, 200), (get, 204), (get, 304):
+                r = self.decode(b"", coding, request, code)
+                self.assertEqual(r.read(), b"")
+                self.assertEqual(r.info()["Content-Encoding"], coding)
+        # the deflate format isn't sniffed until the body is read
+        r = self.decode(b"", "deflate", get)
+        self.assertRaises(ValueError, r.read)
+
+    def test_deflate(self):
+        data = os.urandom(100 * 1024) + b"a" * (300 * 1024)
+        for wbits in zlib.MAX_WBITS, -zlib.MAX_WBITS, 9, -9:
+            cdata = deflated(data, wbits)
+            self.assertEqual(
+                create_deflate_decompressor(BytesIO(cdata), 100).read(), data)
+            r = self.decode(cdata, "deflate")
+            self.assertEqual(r.read(), data)
+            self.assertFalse(r.info().getheaders("Content-Encoding"))
+        self.assertRaises(ValueError, create_deflate_decompressor(
+            BytesIO(deflated(data)[:-100])).read)
+
+    def test_multiple_codings(self):
+        data = b"spam\n" * 10000
+        r = self.decode(deflated(gzipped(data)), "gzip, deflate")
+        self.assertEqual(r.readline(), b"spam\n")
+        self.assertEqual(r.read(), data[5:])
+        self.assertFalse(r.info().getheaders("Content-Length"))
+        r = self.decode(gzipped(data), "identity, x-gzip")
+        self.assertEqual(r.read(), data)
+
+        # unknown codings are left for the caller
+        cdata = gzipped(data)
+        r = self.decode(cdata, "gzip, moo")
+        self.assertEqual(r.read(), cdata)
+        self.assertEqual(r.info()["Content-Encoding"], "gzip, moo")
+        self.assertEqual(r.info()["Content-Length"], str(len(cdata)))
+
+    @unittest.skipIf(ZstdDecompressor is None, "zstd is not supported")
+    def test_zstd(self):
+        from compression import zstd
+        data = os.urandom(100 * 1024) + b"a" * (300 * 1024)
+        # a body may consist of several frames
+        cdata = zstd.compress(data) + zstd.compress(b"more")
+        for chunk_size in None, 1, 1000:
+            f = ZstdWrapper(BytesIO(cdata), chunk_size)
+            self.assertEqual(f.read(), data + b"more")
+        r = self.decode(cdata, "zstd")
+        self.assertEqual(r.read(), data + b"more")
+        self.assertRaises(ValueError, ZstdWrapper(BytesIO(cdata[:-10])).read)
+
+
+class RequestGzipTests(unittest.TestCase):
+
+    def process(self, url, data, **kwds):
+        p = mechanize.HTTPRequestGzipProcessor(
+            ["example.com", ".example.org"], min_size=100)
+        return p.http_request(mechanize.Request(url, data, **kwds))
+
+    def test_bytes(self):
+        data = b"spam=eggs&" * 100
+        req = self.process("http://example.com:8080/", data, headers={
+            "Content-Length": str(len(data))})
+        self.assertEqual(req.get_header("Content-encoding"), "gzip")
+        self.assertFalse(req.has_header("Content-length"))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(req.data)).read(),
+                         data)
+        self.assertEqual(
+            self.process("http://www.example.org/", data).data[:2],
+            b"\x1f\x8b")
+
+        # bodies that are small or incompressible are sent as they are,
+        # and other hosts are not sent compressed bodies
+        for url, data in [
+                ("http://example.com/", b"x" * 99),
+                ("http://example.com/", os.urandom(1000)),
+                ("http://www.example.com/", b"x" * 1000),
+                ("http://example.org.com/", b"x" * 1000)]:
+            req = self.process(url, data)
+            self.assertIs(req.data, data)
+            self.assertFalse(req.has_header("Content-encoding"))
+        req = self.process("http://example.com/", b"x" * 1000, headers={
+            "Content-Encoding": "br"})
+        self.assertEqual(req.data, b"x" * 1000)
+        self.assertEqual(self.process("http://example.com/", None).data,
+                         None)
+
+    def test_stream(self):
+        data = b"x" * 100000
+        src = BytesIO(b"ignored" + data)
+        src.seek(7)
+        req = self.process("http://example.com/", src)
+        body = req.data
+        self.assertIsInstance(body, GzipBody)
+        self.assertIsNone(body.length)
+        cdata = b"".join(iter(lambda: body.read(100), b""))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(cdata)).read(), data)
+        body.seek(0)
+        self.assertEqual(body.read(), cdata)
+
+        class Unseekable(object):
+            length = None
+
+            def __init__(self, data):
+                self.read = BytesIO(data).read
+
+        body = self.process("http://example.com/", Unseekable(data)).data
+        self.assertEqual(gzip.GzipFile(fileobj=body).read(), data)
+        self.assertRaises(ValueError, body.seek, 0)
+        small = Unseekable(b"x")
+        small.length = 1
+        self.assertIs(self.process("http://example.com/", small).data, small)
+
+    def test_useragent(self):
+        ua = mechanize.UserAgentBase()
+        ua.set_gzip_request_bodies(["example.com"], min_size=10)
+        h = ua._ua_handlers["_request_gzip"]
+        self.assertEqual((h.hosts, h.min_size), ({"example.com"}, 10))
+        h = copy.copy(ua)._ua_handlers["_request_gzip"]
+        self.assertEqual((h.hosts, h.min_size), ({"example.com"}, 10))
+        ua.set_gzip_request_bodies([])
+        self.assertFalse("_request_gzip" in ua._ua_handlers)
+
+
+if __name__ == "__main__":
+    unittest.main()
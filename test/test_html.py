@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 
+import copy
+import os
 from unittest import TestCase
 
 import mechanize
 import mechanize._form
 from mechanize._response import test_html_response
-from mechanize._html import content_parser, get_title, Factory
+from mechanize._html import (content_parser, get_title, iterlinks,
+                             stream_links, Factory, LinkTokenizer, ParseCache)
 
 
 class RegressionTests(TestCase):
@@ -133,6 +136,174 @@ class MiscTests(TestCase):
         self.assertEqual(get_title(html), u'')
 
 
+class ParseCacheTests(TestCase):
+
+    def test_parse_once(self):
+        calls = []
+
+        def counting_parser(data, *args, **kwds):
+            calls.append(data)
+            return content_parser(data, *args, **kwds)
+
+        html = (b'<html><head><title>T</title></head><body>'
+                b'<a href="a">a</a><form><input name="q"></form>')
+        br = mechanize.Browser(content_parser=counting_parser)
+        # off by default
+        br.set_html(html, url="http://example.com/")
+        br.title()
+        br.set_html(html, url="http://example.com/")
+        br.title()
+        self.assertEqual(len(calls), 2)
+        del calls[:]
+
+        br.set_parse_cache(ParseCache())
+        br.set_html(html, url="http://example.com/")
+        self.assertEqual(br.title(), "T")
+        links = br._factory.links()
+        self.assertTrue(br._factory.links() is links)
+        br.select_form(nr=0)
+        br["q"] = "changed"
+
+        # the same document again, also from a copied browser
+        for b in (br, copy.copy(br)):
+            b.set_html(html, url="http://example.com/")
+            self.assertEqual(b.title(), "T")
+            self.assertTrue(b._factory.links() is links)
+            # forms are built afresh, so changes made to them don't leak
+            b.select_form(nr=0)
+            self.assertEqual(b["q"], "")
+        self.assertEqual(len(calls), 1)
+
+        # different content, or a different URL, is parsed again
+        br.set_html(html + b" ", url="http://example.com/")
+        br.title()
+        br.set_html(html, url="http://example.com/other")
+        self.assertEqual(list(br.links())[0].absolute_url,
+                         "http://example.com/a")
+        self.assertEqual(len(calls), 3)
+
+        br._factory.set_parse_cache(None)
+        br.set_html(html, url="http://example.com/")
+        br.title()
+        self.assertEqual(len(calls), 4)
+
+    def test_lru(self):
+        cache = ParseCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("c"), 3)
+
+
+class StreamLinksTests(TestCase):
+
+    def assert_same_links(self, html, base_url="http://example.com/"):
+        expected = list(iterlinks(
+            content_parser(html, transport_encoding="utf-8"), base_url))
+        for chunk_size in (7, 16 * 1024):
+            links = list(stream_links(html, base_url, chunk_size=chunk_size))
+            self.assertEqual(links, expected)
+            self.assertEqual([link.base_url for link in links],
+                             [link.base_url for link in expected])
+            self.assertEqual([link.attrs for link in links],
+                             [link.attrs for link in expected])
+
+    def test_same_as_tree(self):
+        for html in (
+                b"",
+                b"<a href='a'>a &amp; <b>b</b>\n c</a><a name=x>no href</a>",
+                b"<a href=a HREF=b id=x>first attribute wins</a>",
+                b"<a href=a>unclosed <a href=b>closed by the next a</a>",
+                b"<a href=a><iframe src=b></iframe>nested</a>",
+                b"<map><area href=a alt=x><area href=b></map><a href=c>c</a>",
+                b"<base href='http://example.net/x/'><a href=a>a</a>"
+                b"<base target=_top><base href='/y/'><a href=b>b</a>",
+                b"<a href='  a b  '>url is cleaned</a>",
+                b"<a href=a>text <!-- comment --> <script>s</script></a>",
+                b"<a href=a>unterminated",
+                # the content of these elements is text, not markup
+                b"<textarea><a href=x>t</a></textarea><a href=y>y</a>",
+                b"<title><a href=x></title><a href=y>y</a>",
+                b"<script>'<a href=x>'</script><a href=y>y</a>",
+                b"<style>/* <a href=x> */</style><a href=y>y</a>",
+                b"<TEXTAREA><a href=x></TextArea ><a href=y>y</a>",
+                b"<a href=a>x<textarea>&amp;<b></textarea></a>",
+                b"<a href=a>x<title>&lt;<a href=b>&gt;</title></a>",
+                b"<iframe src=a><a href=x>y</a></iframe><a href=b>b</a>",
+                b"<a href=a><textarea>unterminated &amp; <a href=b>",
+                u"<a href=a>\xe9</a>".encode("utf-8"),
+        ):
+            self.assert_same_links(html)
+        for name in ("GeneralSearch", "MarkedResults", "Results"):
+            path = os.path.join(
+                os.path.dirname(__file__), "test_form_data", name + ".html")
+            with open(path, "rb") as f:
+                self.assert_same_links(f.read())
+
+    def test_browser(self):
+        calls = []
+
+        def counting_parser(*args, **kwds):
+            calls.append(1)
+            return content_parser(*args, **kwds)
+        html = b"".join(
+            b"<a href='%d'>link %d</a>\n" % (i, i) for i in range(10000))
+        br = mechanize.Browser(content_parser=counting_parser)
+        br.set_stream_links(True)
+        br.set_html(html, url="http://example.com/")
+        fed = []
+        orig_feed = LinkTokenizer.feed
+
+        def feed(self, data):
+            fed.append(len(data))
+            return orig_feed(self, data)
+        LinkTokenizer.feed = feed
+        try:
+            link = br.find_link(text="link 1")
+        finally:
+            LinkTokenizer.feed = orig_feed
+        self.assertEqual(link.absolute_url, "http://example.com/1")
+        # stopped after the first chunk, without building a tree
+        self.assertEqual(len(fed), 1)
+        self.assertEqual(calls, [])
+        self.assertEqual(len(br.links()), 10000)
+        self.assertEqual(calls, [])
+        self.assertTrue(copy.copy(br)._factory._stream_links)
+
+        # forms need the tree, and then links come from it
+        br.forms()
+        self.assertEqual(len(calls), 1)
+        br.set_html(html, url="http://example.com/")
+        self.assertEqual(br.find_link(nr=2).url, "2")
+
+
+class LazyIterationTests(TestCase):
+
+    def test_find_link_and_select_form_stop_early(self):
+        html = b"".join(
+            b"<a href='%d'>link %d</a><form name='f%d'><input name='q'></form>"
+            % (i, i, i) for i in range(100))
+        br = mechanize.Browser()
+        br.set_html(html, url="http://example.com/")
+
+        br.select_form(nr=1)
+        self.assertEqual(br.form.name, "f1")
+        parser = br._factory._forms_parser
+        self.assertEqual(parser.nr_done, 2)
+        self.assertTrue(br.forms()[1] is br.form)
+        self.assertEqual(parser.nr_done, 100)
+
+        seen = []
+        link = br.find_link(predicate=lambda link: seen.append(link) or True)
+        self.assertEqual(link.url, "0")
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(len(br.links()), 100)
+        self.assertTrue(br.find_link(nr=5) is br.links()[5])
+
+
 if __name__ == "__main__":
     import unittest
     unittest.main()
@@ -3,9 +3,15 @@
 # Copyright: 2019, Kovid Goyal <kovid at kovidgoyal.net>
 
 
+import copy
+from io import BytesIO
 from unittest import TestCase
 
-from mechanize._http import MechanizeRobotFileParser
+from mechanize import URLError
+
+from mechanize._http import (HTTPRobotRulesProcessor, MechanizeRobotFileParser,
+                             RobotRulesCache)
+from mechanize._response import closeable_response, make_headers
 
 
 class TestRobotFileParser(TestCase):
@@ -15,3 +21,72 @@ class TestRobotFileParser(TestCase):
         rfp.set_opener()
         q = '<mechanize._opener.OpenerDirector object at '
         self.assertTrue(repr(rfp._opener).startswith(q))
+
+    def test_status(self):
+        def read(status, body=b"User-agent: *\nDisallow: /private\n"):
+            class Opener(object):
+                def open(self, req):
+                    if status is None:
+                        raise URLError("unreachable")
+                    return closeable_response(
+                        BytesIO(body), make_headers([]), req.get_full_url(),
+                        status, "Whatever")
+            rfp = MechanizeRobotFileParser("http://example.com/robots.txt",
+                                           Opener())
+            rfp.read()
+            self.assertEqual(rfp.status, status)
+            return [rfp.can_fetch("bot", "http://example.com" + path)
+                    for path in ("/", "/private")]
+        self.assertEqual(read(200), [True, False])
+        self.assertEqual(read(200, b""), [True, True])
+        self.assertEqual(read(404), [True, True])
+        self.assertEqual(read(403), [False, False])
+        self.assertEqual(read(503), [False, False])
+        self.assertEqual(read(None), [False, False])
+
+
+class FakeRobotFileParser(object):
+
+    def __init__(self, status=200, max_age=None):
+        self.status = status
+        self.max_age = max_age
+
+
+class TestRobotRulesCache(TestCase):
+
+    def test_lru(self):
+        cache = RobotRulesCache(max_hosts=2)
+        a, b, c = [FakeRobotFileParser() for i in range(3)]
+        cache.put(("http", "a"), a)
+        cache.put(("http", "b"), b)
+        self.assertTrue(cache.get(("http", "a")) is a)
+        cache.put(("http", "c"), c)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get(("http", "b")) is None)
+        self.assertTrue(cache.get(("http", "a")) is a)
+        self.assertTrue(cache.get(("http", "c")) is c)
+        self.assertTrue(cache.get(("https", "a")) is None)
+
+    def test_ttl(self):
+        cache = RobotRulesCache(ttl=60, error_ttl=-1, min_ttl=-1)
+        rfp = FakeRobotFileParser()
+        cache.put("ok", rfp)
+        self.assertTrue(cache.get("ok") is rfp)
+        cache.put("no-store", FakeRobotFileParser(max_age=0))
+        self.assertTrue(cache.get("no-store") is None)
+        cache.min_ttl = 30
+        rfp = FakeRobotFileParser(max_age=0)
+        cache.put("no-cache", rfp)
+        self.assertTrue(cache.get("no-cache") is rfp)
+        cache.put("5xx", FakeRobotFileParser(status=503))
+        self.assertTrue(cache.get("5xx") is None)
+        cache.put("unreachable", FakeRobotFileParser(status=None))
+        self.assertTrue(cache.get("unreachable") is None)
+        rfp = FakeRobotFileParser(status=404)
+        cache.put("4xx", rfp)
+        self.assertTrue(cache.get("4xx") is rfp)
+        self.assertEqual(len(cache), 3)
+
+    def test_shared_by_copies(self):
+        h = HTTPRobotRulesProcessor()
+        self.assertTrue(copy.copy(h).cache is h.cache)
@@ -1,8 +1,21 @@
+import subprocess
+import sys
 import unittest
 
 import mechanize
 from mechanize._testcase import TestCase
 
+# generous, so that slow or heavily loaded machines do not fail spuriously,
+# but low enough to notice if the heavy modules start being imported again
+IMPORT_TIME_BUDGET = 0.5  # seconds
+
+LAZY_MODULES = ("mechanize._entities", "mechanize._form_controls",
+                "mechanize._html", "mechanize._mechanize")
+
+
+def import_in_subprocess(code):
+    return subprocess.check_output([sys.executable, "-c", code])
+
 
 class ImportTests(TestCase):
 
@@ -10,6 +23,30 @@ class ImportTests(TestCase):
         for name in mechanize.__all__:
             exec("from mechanize import %s" % name)
 
+    @unittest.skipIf(sys.version_info[:2] < (3, 7),
+                     "module __getattr__ needs Python 3.7")
+    def test_lazy_imports(self):
+        out = import_in_subprocess(
+            "import sys, mechanize; mechanize.urlopen; mechanize.UserAgent; "
+            "print(' '.join(m for m in %r if m in sys.modules))"
+            % (LAZY_MODULES,))
+        self.assertEqual(out.decode("ascii").strip(), "")
+        out = import_in_subprocess(
+            "import sys, mechanize; mechanize.Browser; "
+            "print(' '.join(m for m in %r if m in sys.modules))"
+            % (LAZY_MODULES,))
+        self.assertEqual(out.decode("ascii").split(),
+                         ["mechanize._form_controls", "mechanize._html",
+                          "mechanize._mechanize"])
+        self.assertTrue("Browser" in dir(mechanize))
+        self.assertRaises(AttributeError, getattr, mechanize, "no_such_name")
+
+    def test_import_time(self):
+        out = import_in_subprocess(
+            "from timeit import default_timer as timer; t = timer(); "
+            "import mechanize; print(timer() - t)")
+        self.assert_less_than(float(out), IMPORT_TIME_BUDGET)
+
 
 if __name__ == "__main__":
     unittest.main()
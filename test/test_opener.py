@@ -3,9 +3,11 @@
 import os
 import math
 import stat
+import tempfile
 import unittest
 
 import mechanize
+import mechanize._opener as _opener
 import mechanize._response as _response
 import mechanize._sockettimeout as _sockettimeout
 
@@ -124,6 +126,80 @@ class OpenerTests(unittest.TestCase):
         self._check_retrieve(urlopen=response_verifier.open)
         response_verifier.verify(self.assertEqual)
 
+    def test_retrieve_local_file(self):
+        # local files are copied by the kernel where possible, else through
+        # a buffer
+        data = os.urandom(3 * mechanize.OpenerDirector.BLOCK_SIZE + 10)
+        fd, src = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        dst = src + ".copy"
+        url = "file://" + src.replace(os.sep, "/")
+        orig_kernel_copy = _opener.kernel_copy
+
+        def no_kernel_copy(*args):
+            raise OSError("not supported")
+            yield
+
+        try:
+            for kernel_copy in orig_kernel_copy, no_kernel_copy:
+                _opener.kernel_copy = kernel_copy
+                for opener in mechanize.build_opener(), mechanize.Browser():
+                    blocks = []
+                    opener.retrieve(url, dst, lambda *args: blocks.append(
+                        args))
+                    with open(dst, "rb") as f:
+                        self.assertEqual(f.read(), data)
+                    self.assertEqual(blocks[-1][2], len(data))
+        finally:
+            _opener.kernel_copy = orig_kernel_copy
+            killfile(src)
+            killfile(dst)
+
+        # retrieve() of a file: URL really is done by the kernel
+        calls = []
+        names = [name for name in ("copy_file_range", "sendfile")
+                 if hasattr(os, name)]
+        originals = [getattr(os, name) for name in names]
+
+        def recording(name, orig):
+            def call(*args):
+                calls.append(name)
+                return orig(*args)
+            return call
+        fd, src = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        dst = src + ".copy"
+        url = "file://" + src.replace(os.sep, "/")
+        try:
+            for name, orig in zip(names, originals):
+                setattr(os, name, recording(name, orig))
+            for opener in mechanize.build_opener(), mechanize.Browser():
+                del calls[:]
+                opener.retrieve(url, dst)
+                with open(dst, "rb") as f:
+                    self.assertEqual(f.read(), data)
+                if names:
+                    self.assertTrue(calls)
+        finally:
+            for name, orig in zip(names, originals):
+                setattr(os, name, orig)
+            killfile(src)
+            killfile(dst)
+
+        fp = open(__file__, "rb")
+        try:
+            response = _response.seek_wrapped_response(
+                _response.closeable_response(fp, {}, "file:x"))
+            self.assertTrue(_response.regular_file_of(response) is fp)
+            response.read(1)
+            self.assertIsNone(_response.regular_file_of(response))
+        finally:
+            fp.close()
+        self.assertIsNone(_response.regular_file_of(
+            _response.test_response()))
+
     def test_retrieve(self):
         # The .retrieve() method deals with a number of different cases.  In
         # each case, .read() should be called the expected number of times, the
@@ -259,7 +335,7 @@ class OpenerTests(unittest.TestCase):
             killfile(tifn)
 
         # Content-Length mismatch with real file length gives URLError
-        big = 1024 * 32
+        big = 4 * mechanize.OpenerDirector.BLOCK_SIZE
         op = Opener(content_length=big)
         verif = CallbackVerifier(self, big, op.block_size)
         url = "http://example.com/"
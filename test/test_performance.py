@@ -51,7 +51,7 @@ class PerformanceTests(TestCase):
 
         size = 100 * MB
         #         size = 1 * KB
-        desired_rate = 2 * MB  # per second
+        desired_rate = 20 * MB  # per second
         desired_time = size / float(desired_rate)
         fudge_factor = 2.
         self.assert_less_than(
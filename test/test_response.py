@@ -76,6 +76,38 @@ dog.
         sfh = seek_wrapper(fh)
         self._testCopy(sfh)
 
+    def testSpooled(self):
+        from mechanize._response import seek_wrapper
+        orig_threshold = seek_wrapper.spool_threshold
+        seek_wrapper.spool_threshold = 16
+        try:
+            for ii in range(1, 6):
+                fh = TestUnSeekable(self.text)
+                sfh = seek_wrapper(fh)
+                test = getattr(self, "_test%d" % ii)
+                test(sfh)
+                self.assertTrue(sfh._seek_wrapper__cache._rolled)
+                self.assertEqual(sfh.cached_bytes_in_memory(), 0)
+            sfh = seek_wrapper(TestUnSeekable(self.text))
+            self._testCopy(sfh)
+            sfh = seek_wrapper(TestUnSeekable(self.text))
+            sfh.read(10)
+            self.assertFalse(sfh._seek_wrapper__cache._rolled)
+            self.assertEqual(sfh.cached_bytes_in_memory(), 10)
+            self.assertEqual(copy.copy(sfh).cached_bytes_in_memory(), 10)
+            sfh.read()
+            self.assertEqual(copy.copy(sfh).cached_bytes_in_memory(), 0)
+        finally:
+            seek_wrapper.spool_threshold = orig_threshold
+
+        # the threshold may be set for a single wrapper instead
+        sfh = seek_wrapper(TestUnSeekable(self.text), spool_threshold=16)
+        sfh.read()
+        self.assertEqual(sfh.cached_bytes_in_memory(), 0)
+        sfh = seek_wrapper(TestUnSeekable(self.text))
+        sfh.read()
+        self.assertEqual(sfh.cached_bytes_in_memory(), len(self.text))
+
     def _testCopy(self, sfh):
         sfh2 = copy.copy(sfh)
         sfh.read(10)
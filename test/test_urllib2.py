@@ -11,8 +11,10 @@ to mechanize.
 # CacheFTPHandler (hard to write)
 # parse_keqv_list, parse_http_list
 
+import copy
 import os
 import sys
+import time
 import unittest
 from io import BytesIO
 
@@ -511,6 +513,9 @@ class MockHTTPClass:
     def getresponse(self):
         return MockHTTPResponse(MockFile(), {}, 200, "OK")
 
+    def close(self):
+        pass
+
 
 class MockHTTPSHandler(AbstractHTTPHandler):
     # Useful for testing the Proxy-Authorization request by verifying the
@@ -783,6 +788,69 @@ class OpenerDirectorTests(unittest.TestCase):
                     self.assertTrue(args[1] is None or isinstance(
                         args[1], MockResponse))
 
+    def test_processor_chains_cached(self):
+        o = OpenerDirector()
+        meth_spec = [
+            [("http_request", "return request"),
+             ("any_response", "return response")],
+            [("http_response", "return response")],
+        ]
+        handlers = add_ordered_mock_handlers(o, meth_spec)
+        o.open("http://example.com/")
+        chain = o._processor_chain("http", "request")
+        self.assertEqual(chain, ((handlers[0], "http_request",
+                                  handlers[0].http_request),))
+        self.assertEqual(
+            [(h, name) for h, name, meth in
+             o._processor_chain("http", "response")],
+            [(handlers[0], "any_response"), (handlers[1], "http_response")])
+        self.assertEqual(
+            [(h, name) for h, name, meth in
+             o._processor_chain("ftp", "response")],
+            [(handlers[0], "any_response")])
+        o.open("http://example.com/")
+        self.assertTrue(o._processor_chain("http", "request") is chain)
+
+        # adding a handler recompiles the chains
+        handlers += add_ordered_mock_handlers(
+            o, [[("http_request", "return request")]])
+        handlers[2].handler_order = handlers[1].handler_order + 1
+        o.open("http://example.com/")
+        self.assertEqual(
+            [h for h, name, meth in o._processor_chain("http", "request")],
+            [handlers[0], handlers[2]])
+
+    def test_instrumentation(self):
+        o = OpenerDirector()
+        meth_spec = [[
+            ("http_request", "return request"),
+            ("http_open", "return response"),
+            ("http_response", "return response"),
+        ]]
+        add_ordered_mock_handlers(o, meth_spec)
+        self.assertEqual(o.handler_timings(), {})
+
+        timings = mechanize.HandlerTimings()
+        o.set_instrumentation(timings)
+        for i in range(3):
+            o.open("http://example.com/")
+        stats = o.handler_timings()
+        self.assertEqual(
+            sorted(stats.keys()),
+            ["MockHandlerSubclass.http_open",
+             "MockHandlerSubclass.http_request",
+             "MockHandlerSubclass.http_response"])
+        for name, aggregates in stats.items():
+            self.assertEqual(aggregates["count"], 3)
+            self.assertTrue(aggregates["p50"] <= aggregates["p99"] <=
+                            aggregates["total"])
+
+        timings.reset()
+        self.assertEqual(o.handler_timings(), {})
+        o.set_instrumentation(None)
+        o.open("http://example.com/")
+        self.assertEqual(timings.stats(), {})
+
 
 class MockRobotFileParserClass:
     def __init__(self):
@@ -997,6 +1065,9 @@ class HandlerTests(mechanize._testcase.TestCase):
             def getresponse(self):
                 return MockHTTPResponse(MockFile(), {}, 200, "OK")
 
+            def close(self):
+                pass
+
         h = AbstractHTTPHandler()
         o = h.parent = MockOpener()
 
@@ -1240,6 +1311,14 @@ class HandlerTests(mechanize._testcase.TestCase):
             "read",
             ("can_fetch", "", url),
         ])
+        # back to the first host: robots.txt rules for it are still cached
+        rfpc.clear()
+        url = "http://example.com:80/foo/bar.html"
+        req = Request(url)
+        h.http_request(req)
+        self.assertEqual(rfpc.calls, [
+            ("can_fetch", "", url),
+        ])
         # non-HTTP URL -> ignore robots.txt
         rfpc.clear()
         url = "ftp://example.com/"
@@ -1516,6 +1595,75 @@ class HandlerTests(mechanize._testcase.TestCase):
         o.open("http://www.example.com/")
         self.assertFalse(hh.req.has_header("Cookie"))
 
+    def test_redirect_cache(self):
+        class ScriptedHTTPHandler(mechanize.BaseHandler):
+            def __init__(self):
+                self.responses = {}
+                self.requests = []
+
+            def http_open(self, req):
+                url = req.get_full_url()
+                self.requests.append(url)
+                code, headers = self.responses.get(url, (200, []))
+                return test_response("", headers, url, code, "Blah")
+
+            https_open = http_open
+
+        hh = ScriptedHTTPHandler()
+        hh.responses = {
+            "http://example.com/a": (
+                301, [("Location", "http://example.com/a/")]),
+            "http://example.com/a/": (
+                308, [("Location", "https://example.com/a/")]),
+            "http://example.com/b": (
+                302, [("Location", "http://example.com/a")]),
+            "http://example.com/c": (
+                301, [("Location", "http://example.com/"),
+                      ("Cache-Control", "no-store")]),
+        }
+        cache = mechanize.RedirectCache()
+        hrh = HTTPRedirectHandler(cache)
+        o = build_test_opener(
+            hh, hrh, mechanize.HTTPErrorProcessor(),
+            mechanize.HTTPDefaultErrorHandler())
+
+        r = o.open("http://example.com/b")
+        self.assertEqual(r.geturl(), "https://example.com/a/")
+        self.assertEqual(hh.requests, [
+            "http://example.com/b", "http://example.com/a",
+            "http://example.com/a/", "https://example.com/a/"])
+        # temporary redirects are not cached, permanent ones are
+        hh.requests = []
+        r = o.open("http://example.com/b")
+        self.assertEqual(r.geturl(), "https://example.com/a/")
+        self.assertEqual(hh.requests, [
+            "http://example.com/b", "https://example.com/a/"])
+        self.assertEqual(len(cache), 2)
+        # ...unless the response says otherwise
+        o.open("http://example.com/c")
+        self.assertEqual(cache.get("http://example.com/c"), None)
+        # ...or the request is not a GET or HEAD
+        hh.requests = []
+        o.open(Request("http://example.com/a", data=b"x"))
+        self.assertEqual(hh.requests[0], "http://example.com/a")
+
+        # copies share the cache
+        self.assertTrue(copy.copy(hrh).cache is cache)
+
+        # entries expire
+        cache = mechanize.RedirectCache(ttl=0)
+        cache.put("http://example.com/a", 301, "http://example.com/")
+        self.assertEqual(len(cache), 0)
+        cache = mechanize.RedirectCache(max_entries=1)
+        cache.put("http://example.com/a", 301, "http://example.com/")
+        cache.put("http://example.com/b", 301, "http://example.com/",
+                  max_age=60)
+        self.assertEqual(cache.get("http://example.com/a"), None)
+        self.assertEqual(cache.get("http://example.com/b"),
+                         (301, "http://example.com/"))
+        cache._entries["http://example.com/b"] = (301, "x", time.time())
+        self.assertEqual(cache.get("http://example.com/b"), None)
+
     def test_proxy(self):
         o = OpenerDirector()
         ph = mechanize.ProxyHandler(dict(http="proxy.example.com:3128"))
@@ -1705,6 +1853,194 @@ class HandlerTests(mechanize._testcase.TestCase):
         # _test_basic_auth called .open() twice)
         self.assertEqual(opener.recorded, ["digest", "basic"] * 2)
 
+    def test_preemptive_basic_auth(self):
+        opener = OpenerDirector()
+        password_manager = mechanize.HTTPPasswordMgrWithPriorAuth()
+        auth_handler = mechanize.HTTPBasicAuthHandler(password_manager)
+        http_handler = MockHTTPHandler(
+            401, 'WWW-Authenticate: Basic realm="ACME"\r\n\r\n')
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        password_manager.add_password(
+            "ACME", "http://acme.example.com/", "wile", "coyote")
+        auth = auth_handler.basic_auth_header("wile", "coyote")
+
+        opener.open("http://acme.example.com/protected/a")
+        self.assertEqual(
+            [r.get_header("Authorization") for r in http_handler.requests],
+            [None, auth])
+        # credentials are sent up front below the authenticated directory...
+        for url in ("http://acme.example.com/protected/b",
+                    "http://acme.example.com:80/protected/c/d"):
+            http_handler.requests = []
+            opener.open(url)
+            self.assertEqual(
+                [r.get_header("Authorization") for r in http_handler.requests],
+                [auth])
+        # ...but not elsewhere
+        http_handler.reset()
+        opener.open("http://acme.example.com/other")
+        self.assertEqual(len(http_handler.requests), 2)
+        self.assertFalse(http_handler.requests[0].has_header("Authorization"))
+        self.assertTrue(password_manager.is_authenticated(
+            "http://acme.example.com/protected/e"))
+        self.assertFalse(password_manager.is_authenticated(
+            "http://acme.example.com:8080/protected/e"))
+
+        # a 401 in reply to preemptive credentials stops them being sent
+        class RejectingHTTPHandler(mechanize.BaseHandler):
+            def http_open(self, req):
+                return test_response(
+                    "", [("WWW-Authenticate", 'Basic realm="ACME"')],
+                    req.get_full_url(), 401, "Unauthorized")
+        opener = OpenerDirector()
+        for h in (auth_handler, RejectingHTTPHandler(),
+                  mechanize.HTTPErrorProcessor(),
+                  mechanize.HTTPDefaultErrorHandler()):
+            opener.add_handler(h)
+        self.assertRaises(mechanize.HTTPError, opener.open,
+                          "http://acme.example.com/protected/f")
+        self.assertFalse(password_manager.is_authenticated(
+            "http://acme.example.com/protected/f"))
+        self.assertTrue(password_manager.is_authenticated(
+            "http://acme.example.com/protected/e"))
+        # ...until they are accepted for that URL again
+        opener = OpenerDirector()
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        http_handler.reset()
+        opener.open("http://acme.example.com/protected/f")
+        self.assertEqual(
+            [r.get_header("Authorization") for r in http_handler.requests],
+            [None, auth])
+        self.assertTrue(password_manager.is_authenticated(
+            "http://acme.example.com/protected/f"))
+
+        # credentials may be marked as accepted in advance
+        password_manager.add_password(
+            None, "http://api.example.com/", "road", "runner",
+            is_authenticated=True)
+        opener = OpenerDirector()
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        http_handler.requests = []
+        opener.open("http://api.example.com/x")
+        self.assertEqual(
+            [r.get_header("Authorization") for r in http_handler.requests],
+            [auth_handler.basic_auth_header("road", "runner")])
+
+        # copies keep their own state
+        pm = copy.copy(password_manager)
+        pm.update_authenticated("http://api.example.com/", False)
+        self.assertTrue(password_manager.is_authenticated(
+            "http://api.example.com/x"))
+
+    def test_preemptive_auth_scheme(self):
+        # credentials accepted over https are not sent unasked over http
+        class MockHTTPSHandler(MockHTTPHandler):
+            https_open = MockHTTPHandler.http_open
+
+        password_manager = mechanize.HTTPPasswordMgrWithPriorAuth()
+        auth_handler = mechanize.HTTPBasicAuthHandler(password_manager)
+        http_handler = MockHTTPSHandler(
+            401, 'WWW-Authenticate: Basic realm="ACME"\r\n\r\n')
+        opener = OpenerDirector()
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        password_manager.add_password(
+            "ACME", "acme.example.com", "wile", "coyote")
+        auth = auth_handler.basic_auth_header("wile", "coyote")
+        opener.open("https://acme.example.com/protected/a")
+        self.assertEqual(
+            [r.get_header("Authorization") for r in http_handler.requests],
+            [None, auth])
+        for url in ("https://acme.example.com/protected/b",
+                    "https://acme.example.com:443/protected/b"):
+            self.assertTrue(password_manager.is_authenticated(url))
+        for url in ("http://acme.example.com/protected/b",
+                    "http://acme.example.com:443/protected/b"):
+            self.assertFalse(password_manager.is_authenticated(url))
+        http_handler.reset()
+        opener.open("http://acme.example.com/protected/b")
+        self.assertEqual(
+            [r.get_header("Authorization") for r in http_handler.requests],
+            [None, auth])
+
+        # nor are digest challenges reused across schemes
+        auth_handler = mechanize.HTTPDigestAuthHandler(password_manager)
+        key = mechanize._urllib2_fork.reduce_uri_with_scheme(
+            password_manager, "https://acme.example.com/")
+        auth_handler.challenges[key] = {
+            "realm": "ACME", "nonce": "n", "qop": "auth"}
+        self.assertTrue(auth_handler.find_challenge(
+            "https://acme.example.com/x") is not None)
+        self.assertTrue(auth_handler.find_challenge(
+            "http://acme.example.com/x") is None)
+
+    def test_preemptive_digest_auth(self):
+        opener = OpenerDirector()
+        password_manager = mechanize.HTTPPasswordMgrWithPriorAuth()
+        auth_handler = mechanize.HTTPDigestAuthHandler(password_manager)
+        challenge = ('WWW-Authenticate: Digest realm="ACME", nonce="%s", '
+                     'qop="auth"%s\r\n\r\n')
+        http_handler = MockHTTPHandler(401, challenge % ("n1", ""))
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        password_manager.add_password(
+            "ACME", "http://acme.example.com/", "wile", "coyote")
+
+        def sent():
+            ans = []
+            for req in http_handler.requests:
+                chal = req.get_header("Authorization")
+                if chal is not None:
+                    chal = mechanize._urllib2_fork.parse_keqv_list(
+                        mechanize._urllib2_fork.parse_http_list(chal[7:]))
+                    chal = chal["nonce"], chal["nc"], chal["uri"]
+                ans.append(chal)
+            http_handler.requests = []
+            return ans
+
+        opener.open("http://acme.example.com/dir/a")
+        self.assertEqual(sent(), [None, ("n1", "00000001", "/dir/a")])
+        opener.open("http://acme.example.com/dir/b")
+        self.assertEqual(sent(), [("n1", "00000002", "/dir/b")])
+
+        # the nonce is reused until the server says that it is stale
+        http_handler.headers = challenge % ("n2", ", stale=true")
+        http_handler.reset()
+        opener.open("http://acme.example.com/dir/c")
+        self.assertEqual(sent(), [("n1", "00000003", "/dir/c"),
+                                  ("n2", "00000001", "/dir/c")])
+        opener.open("http://acme.example.com/dir/d")
+        self.assertEqual(sent(), [("n2", "00000002", "/dir/d")])
+        opener.open("http://acme.example.com/other")
+        self.assertEqual(sent(), [None])
+
+        # nonce counts are kept per nonce, so that alternating between
+        # protection spaces does not restart them
+        http_handler.headers = challenge % ("n3", "")
+        http_handler.reset()
+        opener.open("http://acme.example.com/other/a")
+        self.assertEqual(sent(), [None, ("n3", "00000001", "/other/a")])
+        opener.open("http://acme.example.com/dir/e")
+        self.assertEqual(sent(), [("n2", "00000003", "/dir/e")])
+        opener.open("http://acme.example.com/other/b")
+        self.assertEqual(sent(), [("n3", "00000002", "/other/b")])
+
+        # without a HTTPPasswordMgrWithPriorAuth every request is challenged
+        opener = OpenerDirector()
+        auth_handler = mechanize.HTTPDigestAuthHandler()
+        auth_handler.add_password(
+            "ACME", "http://acme.example.com/", "wile", "coyote")
+        opener.add_handler(auth_handler)
+        opener.add_handler(http_handler)
+        for url in ("http://acme.example.com/dir/a",
+                    "http://acme.example.com/dir/b"):
+            http_handler.reset()
+            opener.open(url)
+            self.assertEqual(len(http_handler.requests), 2)
+
     def _test_basic_auth(self, opener, auth_handler, auth_header, realm,
                          http_handler, password_manager, request_url,
                          protected_url):
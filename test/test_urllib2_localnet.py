@@ -2,7 +2,11 @@
 
 """Functional tests from the Python standard library test suite."""
 
+import copy
+import os
+import sys
 import threading
+from io import BytesIO
 import mechanize
 import unittest
 
@@ -15,8 +19,10 @@ import testprogram
 
 if is_py2:
     from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from httplib import HTTPException
 else:
     from http.server import HTTPServer, BaseHTTPRequestHandler
+    from http.client import HTTPException
 
 # Loopback http server infrastructure
 
@@ -299,6 +305,31 @@ class ProxyAuthTests(TestCase):
             pass
         result.close()
 
+    @unittest.skipIf(sys.version_info[:2] < (3, 7),
+                     "asyncio API needs Python 3.7")
+    def test_async_proxy_auth(self):
+        import asyncio
+        opener = mechanize.OpenerFactory(
+            mechanize.AsyncOpenerDirector).build_opener(
+                *[copy.copy(h) for h in self.opener.handlers
+                  if isinstance(h, (mechanize.ProxyHandler,
+                                    mechanize.ProxyDigestAuthHandler))])
+        digest_handler = next(
+            h for h in opener.handlers
+            if isinstance(h, mechanize.ProxyDigestAuthHandler))
+
+        async def fetch():
+            return (await opener.open(self.URL)).read()
+
+        # retries are counted although each one is made after the handler
+        # returns
+        digest_handler.add_password(self.REALM, self.URL, self.USER,
+                                    self.PASSWD + "bad")
+        self.assertRaises(mechanize.HTTPError, asyncio.run, fetch())
+        digest_handler.add_password(self.REALM, self.URL, self.USER,
+                                    self.PASSWD)
+        self.assertIn(b"You've reached http://localhost/!", asyncio.run(fetch()))
+
     def test_proxy_qop_auth_int_works_or_throws_urlerror(self):
         server = self._make_server("auth-int")
         self.add_teardown(lambda: server.stop())
@@ -477,6 +508,22 @@ class TestUrlopen(TestCase):
         mechanize.urlopen(req)
         self.assertEqual(handler.received_headers['Range'], 'bytes=20-39')
 
+    def test_instrumentation(self):
+        handler = self._make_request_handler([(200, [], b"we don't care")])
+
+        timings = mechanize.HandlerTimings()
+        opener = mechanize.build_opener()
+        opener.set_instrumentation(timings)
+        opener.open("http://localhost:%s/" % handler.port).read()
+        stats = opener.handler_timings()
+        for name in ("HTTPCookieProcessor.http_request",
+                     "HTTPHandler.http_open",
+                     "network.connect", "network.send", "network.wait",
+                     "HTTPErrorProcessor.http_response"):
+            self.assertEqual(stats[name]["count"], 1)
+        self.assertTrue(stats["HTTPHandler.http_open"]["total"] >=
+                        stats["network.wait"]["total"])
+
     def test_basic(self):
         handler = self._make_request_handler([(200, [], b"we don't care")])
 
@@ -531,5 +578,549 @@ class TestUrlopen(TestCase):
                           mechanize.urlopen, "http://sadflkjsasf.i.nvali.d./")
 
 
+class KeepAliveHTTPRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, client_addresses, *args, **kwds):
+        self._client_addresses = client_addresses
+        BaseHTTPRequestHandler.__init__(self, *args, **kwds)
+
+    def do_GET(self):
+        self._client_addresses.append(self.client_address)
+        if self.path == "/auth" and "Authorization" not in self.headers:
+            body = b"Log in first"
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", 'Basic realm="test"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        body = ("You asked for %s" % self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # echo the request body back
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamingUploadTests(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        server = make_started_server(
+            lambda *args, **kwds: KeepAliveHTTPRequestHandler(
+                [], *args, **kwds))
+        self.add_teardown(server.stop)
+        self.url = "http://127.0.0.1:%d/upload" % server.port
+
+    def _upload(self, file_object):
+        form = mechanize.HTMLForm(self.url, method="POST",
+                                  enctype="multipart/form-data")
+        form.new_control("file", "data", {})
+        form.fixup()
+        form.stream_multipart = True
+        form.add_file(file_object, filename="big.bin")
+        req = form.click()
+        return req.get_data(), mechanize.urlopen(req).read()
+
+    def test_known_length(self):
+        data = b"x" * (1024 * 1024)
+        body, echoed = self._upload(BytesIO(data))
+        self.assertEqual(len(echoed), body.length)
+        self.assertIn(data, echoed)
+
+    def test_chunked(self):
+        class Unseekable(object):
+            def __init__(self, data):
+                self.read = BytesIO(data).read
+
+        data = b"y" * (100 * 1024)
+        body, echoed = self._upload(Unseekable(data))
+        self.assertIsNone(body.length)
+        self.assertIn(data, echoed)
+
+    def test_gzip(self):
+        import zlib
+        opener = mechanize.build_opener(
+            mechanize.HTTPRequestGzipProcessor(["127.0.0.1"]))
+        data = os.urandom(1024) * 100
+        form = mechanize.HTMLForm(self.url, method="POST",
+                                  enctype="multipart/form-data")
+        form.new_control("file", "data", {})
+        form.fixup()
+        form.stream_multipart = True
+        form.add_file(BytesIO(data), filename="big.bin")
+        echoed = opener.open(form.click()).read()
+        self.assertLess(len(echoed), len(data))
+        self.assertIn(data, zlib.decompress(echoed, 16 + zlib.MAX_WBITS))
+
+        echoed = opener.open(self.url, data).read()
+        self.assertEqual(zlib.decompress(echoed, 16 + zlib.MAX_WBITS), data)
+
+
+class ConnectionPoolTests(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.client_addresses = []
+
+        def make_request_handler(*args, **kwds):
+            return KeepAliveHTTPRequestHandler(
+                self.client_addresses, *args, **kwds)
+        server = make_started_server(make_request_handler)
+        self.add_teardown(server.stop)
+        self.url = "http://127.0.0.1:%d" % server.port
+        self.pool = mechanize.ConnectionPool()
+        # the server handles one connection at a time, so close ours before
+        # stopping it
+        self.add_teardown(self.pool.close)
+
+    def test_connection_reused(self):
+        br = mechanize.Browser()
+        br.set_handle_robots(False)
+        br.set_connection_pool(self.pool)
+        for path in "/a", "/b", "/c":
+            r = br.open(self.url + path)
+            self.assertEqual(r.read(), b"You asked for " + path.encode())
+        self.assertEqual(len(self.client_addresses), 3)
+        self.assertEqual(len(set(self.client_addresses)), 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_connection_shared_with_copies(self):
+        br = mechanize.Browser()
+        br.set_handle_robots(False)
+        br.set_connection_pool(self.pool)
+        br.open(self.url + "/a").read()
+        copy.copy(br).open(self.url + "/b").read()
+        self.assertEqual(len(set(self.client_addresses)), 1)
+
+    def test_connection_released_once_body_read(self):
+        opener = mechanize.build_opener()
+        for h in opener.handlers:
+            if isinstance(h, mechanize.HTTPHandler):
+                h.connection_pool = self.pool
+        r = opener.open(self.url + "/a")
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(r.read(), b"You asked for /a")
+        self.assertEqual(len(self.pool), 1)
+        r.close()
+        self.assertEqual(len(self.pool), 1)
+
+    def test_stale_connection(self):
+        opener = mechanize.build_opener()
+        for h in opener.handlers:
+            if isinstance(h, mechanize.HTTPHandler):
+                h.connection_pool = self.pool
+        opener.open(self.url + "/a").read()
+        self.pool.idle_timeout = -1
+        self.assertEqual(opener.open(self.url + "/b").read(),
+                         b"You asked for /b")
+        self.assertEqual(len(set(self.client_addresses)), 2)
+
+    def test_retry_on_dropped_connection(self):
+        import socket
+
+        class DroppedConnection(object):
+            # an idle connection that the server closed without our noticing
+            def __init__(self, fail_on_send):
+                self.sock, self._other_end = socket.socketpair()
+                self.fail_on_send = fail_on_send
+                self.timeout = None
+                self.closed = False
+
+            def set_debuglevel(self, level):
+                pass
+
+            def request(self, *args):
+                if self.fail_on_send:
+                    raise socket.error("broken pipe")
+
+            def getresponse(self):
+                raise socket.error("connection reset")
+
+            def close(self):
+                self.closed = True
+                self.sock.close()
+                self._other_end.close()
+
+        opener = mechanize.build_opener()
+        for h in opener.handlers:
+            if isinstance(h, mechanize.HTTPHandler):
+                h.connection_pool = self.pool
+        key = ("http", self.url[len("http://"):], None, None)
+
+        def open_on(conn, data=None):
+            # the server handles one connection at a time
+            self.pool.close()
+            self.pool.put(key, conn)
+            try:
+                return opener.open(self.url + "/a", data).read()
+            finally:
+                self.assertTrue(conn.closed)
+
+        # a GET is sent again on a new connection
+        self.assertEqual(open_on(DroppedConnection(False)),
+                         b"You asked for /a")
+        self.assertEqual(len(self.client_addresses), 1)
+        # a POST is not, since the server may have received it...
+        self.assertRaises(mechanize.URLError, open_on,
+                          DroppedConnection(False), b"data")
+        self.assertEqual(len(self.client_addresses), 1)
+        # ...unless it could not be sent at all
+        self.assertEqual(open_on(DroppedConnection(True), b"data"), b"data")
+
+    def test_connection_reused_after_auth_challenge(self):
+        br = mechanize.Browser()
+        br.set_handle_robots(False)
+        br.set_connection_pool(self.pool)
+        br.add_password(self.url, "user", "pass")
+        self.assertEqual(br.open(self.url + "/auth").read(),
+                         b"You asked for /auth")
+        self.assertEqual(len(self.client_addresses), 2)
+        self.assertEqual(len(set(self.client_addresses)), 1)
+
+
+class PageHTTPRequestHandler(KeepAliveHTTPRequestHandler):
+
+    page = (b'<html><body><a href="/next">next</a>'
+            b'<form method="POST" action="/form"><input name="q" /></form>'
+            b'</body></html>')
+
+    def do_GET(self):
+        if self.path != "/":
+            return KeepAliveHTTPRequestHandler.do_GET(self)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+
+class AsyncHTTPRequestHandler(PageHTTPRequestHandler):
+
+    def do_GET(self):
+        headers = [("Content-Type", "text/plain")]
+        if self.path == "/robots.txt":
+            body = b"User-agent: *\nDisallow: /private\n"
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/next")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        elif self.path == "/refresh":
+            body = b"wait"
+            headers.append(("Refresh", "0.01; url=/next"))
+        elif self.path == "/cookie":
+            body = b"set"
+            headers.append(("Set-Cookie", "session=1; Path=/"))
+        elif self.path == "/show-cookie":
+            body = self.headers.get("Cookie", "").encode("ascii")
+        elif self.path == "/gzip":
+            import gzip
+            body = gzip.compress(b"unzipped")
+            headers.append(("Content-Encoding", "gzip"))
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in b"chunked ", b"body", b"":
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            return
+        else:
+            return PageHTTPRequestHandler.do_GET(self)
+        self.send_response(200)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@unittest.skipIf(sys.version_info[:2] < (3, 7), "asyncio API needs Python 3.7")
+class AsyncTests(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        server = make_started_server(
+            lambda *args, **kwds: AsyncHTTPRequestHandler([], *args, **kwds))
+        self.add_teardown(server.stop)
+        self.url = "http://127.0.0.1:%d" % server.port
+
+        def do_open(*args):
+            raise AssertionError("blocking do_open() called")
+        self.monkey_patch(mechanize._urllib2_fork.AbstractHTTPHandler,
+                          "do_open", do_open)
+
+    def test_browser(self):
+        import asyncio
+
+        async def session(n):
+            br = mechanize.AsyncBrowser()
+            await br.open(self.url + "/")
+            r = await br.follow_link(text="next")
+            self.assertEqual(r.read(), b"You asked for /next")
+            await br.back()
+            self.assertEqual(br.response().read(),
+                             PageHTTPRequestHandler.page)
+            br.select_form(nr=0)
+            br["q"] = str(n)
+            await br.submit()
+            self.assertEqual(br.geturl(), self.url + "/form")
+            data = br.response().read()
+            try:
+                await br.open(self.url + "/private")
+            except mechanize.HTTPError as exc:
+                self.assertEqual(exc.code, 403)
+            else:
+                self.fail("robots.txt not obeyed")
+            return data
+
+        async def main():
+            return await asyncio.gather(*[session(n) for n in range(5)])
+
+        self.assertEqual(asyncio.run(main()),
+                         [("q=%d" % n).encode() for n in range(5)])
+
+    def test_handlers(self):
+        import asyncio
+        br = mechanize.AsyncBrowser()
+        br.set_handle_robots(False)
+        br.set_handle_gzip(True)
+        br.set_handle_refresh(True)
+        br.add_password(self.url, "user", "pass")
+        slept = []
+
+        async def sleep(seconds):
+            slept.append(seconds)
+        self.monkey_patch(asyncio, "sleep", sleep)
+
+        async def fetch(path):
+            r = await br.open(self.url + path)
+            return br.geturl()[len(self.url):], r.read()
+
+        async def main():
+            self.assertEqual(await fetch("/redirect"),
+                             ("/next", b"You asked for /next"))
+            self.assertEqual(await fetch("/refresh"),
+                             ("/next", b"You asked for /next"))
+            self.assertEqual(slept, [0.01])
+            await fetch("/cookie")
+            self.assertEqual(await fetch("/show-cookie"),
+                             ("/show-cookie", b"session=1"))
+            self.assertEqual(await fetch("/gzip"), ("/gzip", b"unzipped"))
+            self.assertEqual(await fetch("/auth"),
+                             ("/auth", b"You asked for /auth"))
+            self.assertEqual(await fetch("/chunked"),
+                             ("/chunked", b"chunked body"))
+            r = await br.open_novisit(self.url + "/novisit")
+            self.assertEqual(r.read(), b"You asked for /novisit")
+            self.assertEqual(br.geturl(), self.url + "/chunked")
+            r = await br.reload()
+            self.assertEqual(r.read(), b"chunked body")
+        asyncio.run(main())
+
+    def test_opener(self):
+        import asyncio
+        opener = mechanize.OpenerFactory(
+            mechanize.AsyncOpenerDirector).build_opener()
+        self.add_teardown(opener.close)
+
+        async def main():
+            r = await opener.open(self.url + "/a", b"posted")
+            self.assertEqual(r.read(3), b"pos")
+            self.assertEqual(r.read(), b"ted")
+            filename, headers = await opener.retrieve(self.url + "/b")
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), b"You asked for /b")
+            self.assertEqual(headers["Content-Length"], "16")
+        asyncio.run(main())
+
+    def test_event_loop_not_blocked(self):
+        # the server runs in the same event loop as the client
+        import asyncio
+        opener = mechanize.OpenerFactory(
+            mechanize.AsyncOpenerDirector).build_opener()
+
+        async def handle(reader, writer):
+            while (await reader.readline()).strip():
+                pass
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            url = "http://127.0.0.1:%d/" % server.sockets[0].getsockname()[1]
+            try:
+                responses = await asyncio.gather(
+                    *[opener.open(url, timeout=5) for _ in range(20)])
+            finally:
+                server.close()
+            return [r.read() for r in responses]
+
+        self.assertEqual(asyncio.run(main()), [b"ok"] * 20)
+
+
+class RangeHTTPRequestHandler(BaseHTTPRequestHandler):
+
+    data = bytes(bytearray(range(256))) * 40
+    etag = '"v1"'
+
+    def __init__(self, server_state, *args, **kwds):
+        self._state = server_state
+        BaseHTTPRequestHandler.__init__(self, *args, **kwds)
+
+    def do_GET(self):
+        state = self._state
+        data = state.get("data", self.data)
+        etag = state.get("etag", self.etag)
+        range_hdr = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        state["requests"].append((range_hdr, if_range))
+        if (range_hdr is None or not state.get("ranges", True) or
+                if_range not in (None, etag)):
+            first, last = 0, len(data) - 1
+            self.send_response(200)
+        else:
+            first, last = range_hdr.split("=")[1].split("-")
+            first = int(first)
+            last = min(int(last or len(data) - 1), len(data) - 1)
+            if first >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % len(data))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (first, last, len(data)))
+        body = data[first:last + 1]
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if state.get("truncate") and (range_hdr is None or
+                                      not range_hdr.endswith("-")):
+            # simulate a dropped connection
+            state["truncate"] -= 1
+            body = body[:len(body) // 2]
+        try:
+            self.wfile.write(body)
+        except EnvironmentError:
+            # the client read only part of the body
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeRetrieveTests(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.state = {"requests": []}
+        server = make_started_server(
+            lambda *args, **kwds: RangeHTTPRequestHandler(
+                self.state, *args, **kwds))
+        self.add_teardown(server.stop)
+        self.url = "http://127.0.0.1:%d/big.bin" % server.port
+        self.filename = os.path.join(self.make_temp_dir(), "big.bin")
+
+    def read_file(self):
+        with open(self.filename, "rb") as f:
+            return f.read()
+
+    def test_resume(self):
+        data = RangeHTTPRequestHandler.data
+        opener = mechanize.build_opener()
+        self.state["truncate"] = 1
+        self.assertRaises(
+            (mechanize.URLError, HTTPException), opener.retrieve,
+            self.url, self.filename, resume=True)
+        partial = len(self.read_file())
+        self.assertTrue(0 < partial < len(data))
+
+        del self.state["requests"][:]
+        filename, headers = opener.retrieve(self.url, self.filename,
+                                            resume=True)
+        self.assertEqual(self.read_file(), data)
+        self.assertEqual(self.state["requests"],
+                         [("bytes=%d-" % partial, '"v1"')])
+        self.assertEqual(headers["Content-Length"], str(len(data)))
+        self.assertNotIn("Content-Range", headers)
+
+        # already complete
+        del self.state["requests"][:]
+        opener.retrieve(self.url, self.filename, resume=True)
+        self.assertEqual(self.read_file(), data)
+        self.assertEqual(self.state["requests"],
+                         [("bytes=%d-" % len(data), None)])
+
+    def test_resume_changed(self):
+        opener = mechanize.build_opener()
+        self.state["truncate"] = 1
+        self.assertRaises(
+            (mechanize.URLError, HTTPException), opener.retrieve,
+            self.url, self.filename, resume=True)
+        self.state["etag"] = '"v2"'
+        self.state["data"] = new_data = b"new" * 1000
+        opener.retrieve(self.url, self.filename, resume=True)
+        self.assertEqual(self.read_file(), new_data)
+        self.assertEqual(self.state["requests"][-1][1], '"v1"')
+
+    def test_parallel(self):
+        data = RangeHTTPRequestHandler.data
+        br = mechanize.Browser()
+        br.set_handle_robots(False)
+        br.MIN_RANGE_SIZE = 1000
+        self.state["truncate"] = 1
+        blocks = []
+        filename, headers = br.retrieve(
+            self.url, self.filename, connections=4,
+            reporthook=lambda *args: blocks.append(args))
+        self.assertEqual(self.read_file(), data)
+        self.assertEqual(headers["Content-Length"], str(len(data)))
+        ranges = [r for r, v in self.state["requests"]]
+        # one of the ranges was fetched again from where it stopped
+        initial = ["bytes=0-", "bytes=2560-5119", "bytes=5120-7679",
+                   "bytes=7680-10239"]
+        self.assertEqual(len(ranges), 5)
+        for r in initial:
+            ranges.remove(r)
+        self.assertIn(ranges[0].split("-")[1], ("5119", "7679", "10239"))
+        self.assertTrue(all(v == '"v1"' for r, v in self.state["requests"][1:]))
+        self.assertEqual(blocks[-1][2], len(data))
+
+        # servers that do not support ranges get one request
+        self.state["ranges"] = False
+        del self.state["requests"][:]
+        br.retrieve(self.url, self.filename, connections=4)
+        self.assertEqual(self.read_file(), data)
+        self.assertEqual(len(self.state["requests"]), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
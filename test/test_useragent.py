@@ -1,12 +1,47 @@
 #!/usr/bin/env python
 
+import collections
+import copy
+import itertools
+import os
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
 import mechanize
+from mechanize._response import make_response
 
 from test.test_browser import make_mock_handler
 
 
+class ConcurrencyRecordingHandler(mechanize.BaseHandler):
+
+    handler_order = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = collections.Counter()
+        self.peak = collections.Counter()
+
+    def __copy__(self):
+        # the copies made for each worker share the counters
+        ans = self.__class__.__new__(self.__class__)
+        ans.__dict__.update(self.__dict__)
+        return ans
+
+    def http_open(self, req):
+        host = req.get_host()
+        with self.lock:
+            self.active[host] += 1
+            self.peak[host] = max(self.peak[host], self.active[host])
+        time.sleep(0.01)
+        with self.lock:
+            self.active[host] -= 1
+        url = req.get_full_url()
+        return make_response(url, [], url)
+
+
 class UserAgentTests(TestCase):
     def _get_handler_from_ua(self, ua, name):
         handler = ua._ua_handlers.get(name)
@@ -80,6 +115,103 @@ class UserAgentTests(TestCase):
             self.assertEqual(expect, got[1:])
         ua._set_handler("_blah", True)
 
+        # removing a handler after requests have been made takes effect
+        ua.calls = []
+        req = mechanize.Request("blah://example.com/")
+        ua._set_handler("_blah", False)
+        ua.open(req)
+        exp_calls = [("blah_open", (req, ), {})]
+        self.assertEqual(len(ua.calls), len(exp_calls))
+        for got, expect in zip(ua.calls, exp_calls):
+            self.assertEqual(expect, got[1:])
+
+    def test_fetch_many(self):
+        ua = mechanize.UserAgentBase()
+        ua.set_handle_robots(False)
+        handler = ConcurrencyRecordingHandler()
+        ua.add_handler(handler)
+        urls = ["http://%s/%d" % (host, i)
+                for i in range(5) for host in ("a.example", "b.example")]
+        results = dict(ua.fetch_many(
+            iter(urls + ["blah://a.example/"]), max_workers=4,
+            per_host_limit=2))
+        self.assertEqual(sorted(results), sorted(urls + ["blah://a.example/"]))
+        for url in urls:
+            self.assertEqual(results[url].read(), url.encode("ascii"))
+        self.assertIsInstance(results["blah://a.example/"], mechanize.URLError)
+        self.assertLessEqual(max(handler.peak.values()), 2)
+        self.assertRaises(ValueError, list, ua.fetch_many(urls, max_workers=0))
+
+        # URLs for a host at per_host_limit are only read a few at a time
+        pulled = []
+
+        def endless(host):
+            for i in itertools.count():
+                pulled.append(i)
+                yield "http://%s/%d" % (host, i)
+        fetches = ua.fetch_many(endless("a.example"), max_workers=4,
+                                per_host_limit=1)
+        self.assertEqual(len(list(itertools.islice(fetches, 20))), 20)
+        fetches.close()
+        self.assertLessEqual(len(pulled), 20 + 1 + 4 + 1)
+        # self is still usable
+        self.assertEqual(ua.open("http://b.example/x").read(),
+                         b"http://b.example/x")
+
+    def test_redirect_cache(self):
+        ua = mechanize.UserAgentBase()
+        cache = mechanize.RedirectCache()
+        ua.set_handle_redirect(False)
+        # setting the cache doesn't turn redirect handling on...
+        ua.set_redirect_cache(cache)
+        self.assertNotIn("_redirect", ua._ua_handlers)
+        # ...but is remembered when it is turned on
+        ua.set_handle_redirect(True)
+        self.assertIs(ua._ua_handlers["_redirect"].cache, cache)
+        ua.set_handle_redirect(True)
+        self.assertIs(ua._ua_handlers["_redirect"].cache, cache)
+        clone = copy.copy(ua)
+        self.assertIs(clone._ua_handlers["_redirect"].cache, cache)
+        clone.set_handle_redirect(False)
+        clone.set_handle_redirect(True)
+        self.assertIs(clone._ua_handlers["_redirect"].cache, cache)
+        ua.set_redirect_cache(None)
+        self.assertIsNone(ua._ua_handlers["_redirect"].cache)
+
+    def test_spool_threshold(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b"x" * 100)
+        os.close(fd)
+        url = "file://" + path.replace(os.sep, "/")
+        try:
+            ua = mechanize.UserAgent()
+            ua.set_seekable_responses(True)
+            br = mechanize.Browser()
+            for opener in ua, br:
+                opener.set_spool_threshold(16)
+                for o in opener, copy.copy(opener):
+                    r = o.open(url)
+                    self.assertEqual(r.read(), b"x" * 100)
+                    self.assertEqual(r.cached_bytes_in_memory(), 0)
+            # other user agents are not affected
+            r = mechanize.Browser().open(url)
+            self.assertEqual(r.read(), b"x" * 100)
+            self.assertEqual(r.cached_bytes_in_memory(), 100)
+        finally:
+            os.remove(path)
+
+    def test_copy(self):
+        ua = mechanize.UserAgent()
+        ua.set_seekable_responses(True)
+        ua.addheaders = [("From", "someone@example.com")]
+        clone = copy.copy(ua)
+        self.assertEqual(clone.addheaders, ua.addheaders)
+        self.assertTrue(clone._seekable)
+        self.assertEqual(len(clone.handlers), len(ua.handlers))
+        for h in clone.handlers:
+            self.assertNotIn(h, ua.handlers)
+            self.assertIs(h.parent, clone)
+
 
 if __name__ == "__main__":
     import unittest